@@ -0,0 +1,77 @@
+import itertools
+import re
+import timeit
+
+from executor import Collection, Request
+
+
+def resolve_regex(variables: dict[str, str], value: bytes | str | None) -> bytes | str | None:
+    if value is None:
+        return None
+
+    if isinstance(value, bytes):
+        def repl(match: re.Match[bytes]) -> bytes:
+            key = match.group(1).decode('utf-8')
+            if key in variables:
+                return variables[key].encode('utf-8')
+            return match.group(0)
+
+        return re.sub(b"\\{\\{(.*?)}}", repl, value)
+
+    def repl(match: re.Match[str]) -> str:
+        key = match.group(1)
+        if key in variables:
+            return variables[key]
+        return match.group(0)
+
+    return re.sub("\\{\\{(.*?)}}", repl, value)
+
+
+def resolve_request_regex(variables: dict[str, str], request: Request):
+    return (
+        resolve_regex(variables, request.method),
+        resolve_regex(variables, request.url),
+        [(resolve_regex(variables, k), resolve_regex(variables, v)) for k, v in request.headers],
+        resolve_regex(variables, request.payload),
+    )
+
+
+def payloads() -> dict[str, bytes]:
+    record = b'{"id": 12345, "name": "some name", "tags": ["a", "b", "c"]},\n'
+    return {
+        "small-plain": record,
+        "small-template": b'{"token": "{{token}}", "user": "{{user}}"}',
+        "1mb-plain": record * (1024 * 1024 // len(record)),
+        "1mb-template": (record * (1024 * 1024 // len(record) // 100) + b'"{{token}}",\n') * 100,
+    }
+
+
+def main():
+    variables = {"host": "example.com", "token": "secret-token", "user": "someone"}
+    collection = Collection(variables=variables, requests=[])
+
+    # "changed" resolves with a new token every time, so each template is rendered again; "memoised" resolves
+    # with the same variables, which only compares them with the last render.
+    changing = itertools.cycle([variables | {"token": f"secret-token-{i}"} for i in range(16)])
+
+    print(f"{'payload':<16}{'regex (us)':>14}{'changed (us)':>16}{'speedup':>10}{'memoised (us)':>16}{'speedup':>10}")
+    for name, payload in payloads().items():
+        request = Request(
+            name=name,
+            method="POST",
+            url="https://{{host}}/api/items",
+            headers=[("Authorization", "Bearer {{token}}"), ("Content-Type", "application/json")],
+            payload=payload,
+        )
+        assert request.resolve(collection.variables) == resolve_request_regex(variables, request)
+
+        number = 20 if len(payload) > 4096 else 10000
+        regex = min(timeit.repeat(lambda: resolve_request_regex(next(changing), request), number=number, repeat=5))
+        changed = min(timeit.repeat(lambda: request.resolve(next(changing)), number=number, repeat=5))
+        memoised = min(timeit.repeat(lambda: request.resolve(collection.variables), number=number, repeat=5))
+        print(f"{name:<16}{regex / number * 1e6:>14.2f}{changed / number * 1e6:>16.2f}{regex / changed:>9.1f}x"
+              f"{memoised / number * 1e6:>16.2f}{regex / memoised:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
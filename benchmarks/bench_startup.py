@@ -0,0 +1,90 @@
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Budgets for this benchmark, in milliseconds. Raise them deliberately, not to make a regression pass.
+IMPORT_BUDGET_MS = 150
+FIRST_PAGE_BUDGET_MS = 300
+RUNS = 7
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must not be loaded before the first page is served.
+LAZY = ["httpx", "jinja2", "executor", "diff", "load", "server.ws.handler"]
+
+
+def import_time() -> float:
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pyramis"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stderr
+    for line in output.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == "pyramis":
+            return int(cumulative) / 1000
+    raise Exception("pyramis not found in -X importtime output")
+
+
+def eager_modules() -> list[str]:
+    output = subprocess.run(
+        [sys.executable, "-c", f"import sys, pyramis; print(' '.join(m for m in {LAZY!r} if m in sys.modules))"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    return output.split()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def first_page() -> float:
+    # Time from process start until both the page and its first rendered fragment are served.
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "pyramis.py", "-p", str(port), "--history", ""],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=os.environ | {"BROWSER": "true"},
+    )
+    try:
+        while True:
+            try:
+                for path in ("/", "/collections"):
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+                        response.read()
+                return (time.perf_counter() - start) * 1000
+            except OSError:
+                if process.poll() is not None:
+                    raise Exception(f"pyramis exited with {process.returncode}")
+                time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    ok = True
+    eager = eager_modules()
+    if eager:
+        print(f"loaded at startup: {', '.join(eager)}")
+        ok = False
+
+    print(f"{'measure':<14}{'median (ms)':>14}{'min (ms)':>12}{'budget (ms)':>14}")
+    for name, measure, budget in (
+        ("import", import_time, IMPORT_BUDGET_MS),
+        ("first page", first_page, FIRST_PAGE_BUDGET_MS),
+    ):
+        times = [measure() for _ in range(RUNS)]
+        median = statistics.median(times)
+        print(f"{name:<14}{median:>14.1f}{min(times):>12.1f}{budget:>14}{'' if median <= budget else '  over budget'}")
+        ok = ok and median <= budget
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
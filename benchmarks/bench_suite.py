@@ -0,0 +1,231 @@
+import asyncio
+import getopt
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from executor import Collection, Request, CLIENTS
+from server import TEMPLATES, read_collections
+from server.ws import ws_encode_frame, ws_read_frame
+from storage import INDEX, read_collection, read_request
+
+# Runs the hot paths against a local mock target and compares the numbers with
+# a stored baseline. Baselines depend on the machine: record one with --save
+# before a change and compare after it on the same machine.
+
+USAGE = ' [--save] [--baseline <path>] [--tolerance <fraction>]'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+# Timings on a busy machine easily move by 10%; a change smaller than this is not reported.
+TOLERANCE = 0.25
+RUNS = 3
+
+REQUESTS = 1000
+CONCURRENCY = 50
+SINGLE_RUNS = 200
+MEMORY_REQUESTS = 200
+MEMORY_BODY_SIZE = 256 * 1024
+FRAME_SIZE = 1024 * 1024
+
+
+class Target:
+    # The mock server runs in its own process, so it does not compete with the measured event loop.
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.mock_server", "-p", "0"],
+            cwd=ROOT, stdout=subprocess.PIPE, text=True,
+        )
+        self.url = self.process.stdout.readline().strip().rpartition(" ")[2]
+        if not self.url.startswith("http"):
+            raise Exception("mock server did not start")
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def requests(count: int, path: str) -> list[Request]:
+    return [Request(f"request-{i}", "GET", "{{base}}" + path, [("Accept", "application/json")]) for i in range(count)]
+
+
+async def collection_throughput(target: Target) -> float:
+    # 5% of the responses fail, so failed results are part of the path measured.
+    collection = Collection({"base": target.url}, requests(REQUESTS, "/items?size=1024&status=200%3D19%2C500%3D1"),
+                            concurrency=CONCURRENCY, name="bench")
+    await collection.run(lambda request, result: asyncio.sleep(0))
+    best = 0.0
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await collection.run(lambda request, result: asyncio.sleep(0))
+        best = max(best, REQUESTS / (time.perf_counter() - start))
+    return best
+
+
+async def single_latency(target: Target) -> float:
+    collection = Collection({"base": target.url}, requests(1, "/item?size=1024"), name="bench")
+    request = collection.requests[0]
+    await collection.run_single(request)
+    times = []
+    for _ in range(SINGLE_RUNS):
+        start = time.perf_counter()
+        await collection.run_single(request)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+async def memory_peak(target: Target) -> float:
+    collection = Collection({"base": target.url}, requests(MEMORY_REQUESTS, f"/large?size={MEMORY_BODY_SIZE}"),
+                            concurrency=CONCURRENCY, name="bench")
+    tracemalloc.start()
+    try:
+        await collection.run(lambda request, result: asyncio.sleep(0))
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def resolve() -> float:
+    collection = Collection({"host": "example.com", "token": "secret-token", "user": "someone"}, [])
+    value = '{"token": "{{token}}", "user": "{{user}}", "host": "{{host}}", "padding": "' + "x" * 1024 + '"}'
+    number = 20000
+    return min(timeit.repeat(lambda: collection.resolve(value), number=number, repeat=5)) / number * 1e6
+
+
+def ws_encode() -> float:
+    data = os.urandom(FRAME_SIZE)
+    number = 50
+    return FRAME_SIZE * number / min(timeit.repeat(lambda: ws_encode_frame(data), number=number, repeat=5)) / 2 ** 20
+
+
+async def ws_decode() -> float:
+    frame = ws_encode_frame(os.urandom(FRAME_SIZE))
+    number = 50
+    best = None
+    for _ in range(5):
+        reader = asyncio.StreamReader(limit=2 * len(frame))
+        reader.feed_data(frame * number)
+        start = time.perf_counter()
+        for _ in range(number):
+            await ws_read_frame(reader)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return FRAME_SIZE * number / best / 2 ** 20
+
+
+def collection_dir(root: str, name: str, count: int) -> str:
+    path = os.path.join(root, name)
+    for i in range(count):
+        os.makedirs(os.path.join(path, "requests", f"request-{i}"))
+        with open(os.path.join(path, "requests", f"request-{i}", "meta.json"), "w") as f:
+            json.dump({"method": "GET", "url": "{{base}}/items/" + str(i), "headers": []}, f)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"variables": [{"name": "base", "value": "http://127.0.0.1", "enabled": True}]}, f)
+    return path
+
+
+def read_collection_cold(collections: list[str]) -> float:
+    def read():
+        for path in collections:
+            INDEX.invalidate(path)
+            read_collection(path)
+
+    number = 10
+    return min(timeit.repeat(read, number=number, repeat=RUNS)) / number * 1000
+
+
+def page_render(collections: list[str]) -> float:
+    template = TEMPLATES.get("collections.html")
+    template.render(read_collections(collections))
+    number = 20
+    return min(timeit.repeat(lambda: template.render(read_collections(collections)), number=number, repeat=5)) \
+        / number * 1000
+
+
+def request_form_render(collection: str) -> float:
+    template = TEMPLATES.get("request_form.html")
+    number = 200
+    return min(timeit.repeat(lambda: template.render(read_request(collection, "request-0")), number=number,
+                             repeat=5)) / number * 1e6
+
+
+async def measure() -> list[tuple[str, float, str, bool]]:
+    # Name, value, unit and whether higher is better.
+    results = []
+    target = Target()
+    try:
+        results.append(("collection throughput", await collection_throughput(target), "req/s", True))
+        results.append(("single run latency", await single_latency(target), "ms", False))
+        results.append(("memory peak", await memory_peak(target), "MiB", False))
+    finally:
+        await CLIENTS.close()
+        target.close()
+    results.append(("Collection.resolve", resolve(), "us", False))
+    results.append(("ws encode", ws_encode(), "MiB/s", True))
+    results.append(("ws decode", await ws_decode(), "MiB/s", True))
+    with tempfile.TemporaryDirectory(prefix="pyramis-bench-") as root:
+        collections = [collection_dir(root, f"collection-{i}", 50) for i in range(20)]
+        results.append(("read_collection cold", read_collection_cold(collections), "ms", False))
+        results.append(("collections page", page_render(collections), "ms", False))
+        results.append(("request form", request_form_render(collections[0]), "us", False))
+    return results
+
+
+def main(name: str, argv: list[str]):
+    save = False
+    baseline_path = BASELINE
+    tolerance = TOLERANCE
+    try:
+        opts, args = getopt.getopt(argv, "?", ["save", "baseline=", "tolerance="])
+    except getopt.GetoptError:
+        print(name + USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-?":
+            print(name + USAGE)
+            sys.exit()
+        elif opt == "--save":
+            save = True
+        elif opt == "--baseline":
+            baseline_path = arg
+        elif opt == "--tolerance":
+            tolerance = float(arg)
+
+    baseline = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+
+    results = asyncio.run(measure())
+    regressions = 0
+    print(f"{'benchmark':<24}{'value':>12}{'unit':>8}{'baseline':>12}{'change':>10}")
+    for metric, value, unit, higher in results:
+        line = f"{metric:<24}{value:>12.2f}{unit:>8}"
+        if metric in baseline:
+            change = value / baseline[metric] - 1 if baseline[metric] else 0.0
+            worse = -change if higher else change
+            line += f"{baseline[metric]:>12.2f}{change:>+10.1%}"
+            if worse > tolerance:
+                line += "  regression"
+                regressions += 1
+        print(line)
+
+    if save:
+        with open(baseline_path, "w") as f:
+            json.dump({
+                "timestamp": time.time(),
+                "python": sys.version.split()[0],
+                "results": {metric: value for metric, value, _, _ in results},
+            }, f, indent="\t")
+        print(f"saved baseline to {baseline_path}")
+    sys.exit(1 if regressions and not save else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[0], sys.argv[1:])
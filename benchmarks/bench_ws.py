@@ -0,0 +1,72 @@
+import asyncio
+import os
+import time
+
+from server.ws import ws_encode_frame, ws_read_frame, ws_unmask, WebSocket
+
+
+def unmask_bytewise(data: bytes, mask_key: bytes) -> bytes:
+    return bytes([data[i] ^ mask_key[i % 4] for i in range(len(data))])
+
+
+def masked_frame(data: bytes, mask_key: bytes) -> bytes:
+    frame = ws_encode_frame(data)
+    header = bytes([frame[0], frame[1] | 0x80]) + frame[2:len(frame) - len(data)]
+    return header + mask_key + ws_unmask(data, mask_key)
+
+
+class NullWriter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+    async def drain(self):
+        pass
+
+
+def throughput(size: int, seconds: float) -> str:
+    return f"{size / seconds / 1024 / 1024:>10.1f}"
+
+
+async def measure(size: int) -> list[str]:
+    data = os.urandom(size // 2).hex().encode("ascii")
+    mask_key = os.urandom(4)
+    row = [f"{size // 1024 // 1024} MiB"]
+
+    start = time.perf_counter()
+    ws_encode_frame(data)
+    row.append(throughput(size, time.perf_counter() - start))
+
+    frame = masked_frame(data, mask_key)
+    reader = asyncio.StreamReader(limit=2 * size)
+    reader.feed_data(frame)
+    start = time.perf_counter()
+    assert (await ws_read_frame(reader))[3] == data
+    row.append(throughput(size, time.perf_counter() - start))
+
+    if size <= 4 * 1024 * 1024:
+        start = time.perf_counter()
+        unmask_bytewise(data, mask_key)
+        row.append(throughput(size, time.perf_counter() - start))
+    else:
+        row.append(f"{'-':>10}")
+
+    writer = NullWriter()
+    socket = WebSocket(asyncio.StreamReader(), writer, deflate={})
+    start = time.perf_counter()
+    await socket.send(data)
+    row.append(throughput(size, time.perf_counter() - start))
+    row.append(f"{writer.size / size:>8.2f}")
+    return row
+
+
+async def main():
+    print(f"{'frame':<8}{'encode':>10}{'decode':>10}{'bytewise':>10}{'deflate':>10}{'ratio':>8}   (MiB/s)")
+    for size in (1, 4, 16, 64):
+        print("".join(f"{c:<8}" if i == 0 else c for i, c in enumerate(await measure(size * 1024 * 1024))))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
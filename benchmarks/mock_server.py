@@ -0,0 +1,120 @@
+import asyncio
+import getopt
+import itertools
+import sys
+import urllib.parse
+
+# A local HTTP/1.1 target for benchmarks. Every response can be shaped by the
+# query string, and falls back to the defaults given on the command line:
+#
+#   latency  milliseconds to wait before answering
+#   size     body size in bytes
+#   status   status mix as code=weight pairs, e.g. 200=90,500=10
+#
+# The status mix is dealt out in a fixed rotation rather than at random, so
+# two runs with the same requests see the same statuses.
+
+USAGE = ' [-p <port>] [--latency <ms>] [--size <bytes>] [--status <code>=<weight>,...]'
+
+REASONS = {200: "OK", 201: "Created", 204: "No Content", 304: "Not Modified", 404: "Not Found",
+           429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def parse_mix(value: str) -> list[int]:
+    mix = []
+    for part in value.split(","):
+        code, _, weight = part.partition("=")
+        mix += [int(code)] * int(weight or 1)
+    return mix
+
+
+class MockServer:
+    def __init__(self, latency: float = 0.0, size: int = 0, status: str = "200"):
+        self.latency = latency
+        self.size = size
+        self.mixes: dict[str, itertools.cycle] = {}
+        self.status = status
+        self.bodies: dict[int, bytes] = {}
+
+    def body(self, size: int) -> bytes:
+        body = self.bodies.get(size)
+        if body is None:
+            line = b'{"id": 12345, "name": "some name", "tags": ["a", "b", "c"]}\n'
+            body = self.bodies[size] = (line * (size // len(line) + 1))[:size]
+        return body
+
+    def next_status(self, mix: str) -> int:
+        statuses = self.mixes.get(mix)
+        if statuses is None:
+            statuses = self.mixes[mix] = itertools.cycle(parse_mix(mix))
+        return next(statuses)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin1").split("\r\n")
+                _, target, _ = lines[0].split(" ", 2)
+                length = 0
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+
+                query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(target).query))
+                latency = float(query.get("latency", self.latency))
+                if latency > 0:
+                    await asyncio.sleep(latency / 1000)
+                status = self.next_status(query.get("status", self.status))
+                body = b"" if status in (204, 304) else self.body(int(query.get("size", self.size)))
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode("latin1") + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int):
+        server = await asyncio.start_server(self.handle, "127.0.0.1", port, backlog=1024)
+        async with server:
+            print(f"Mock server on http://127.0.0.1:{server.sockets[0].getsockname()[1]}", flush=True)
+            await server.serve_forever()
+
+
+def main(name: str, argv: list[str]):
+    port = 8042
+    latency = 0.0
+    size = 1024
+    status = "200"
+    try:
+        opts, args = getopt.getopt(argv, "?p:", ["port=", "latency=", "size=", "status="])
+    except getopt.GetoptError:
+        print(name + USAGE)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-?":
+            print(name + USAGE)
+            sys.exit()
+        elif opt in ("-p", "--port"):
+            port = int(arg)
+        elif opt == "--latency":
+            latency = float(arg)
+        elif opt == "--size":
+            size = int(arg)
+        elif opt == "--status":
+            parse_mix(arg)
+            status = arg
+    try:
+        asyncio.run(MockServer(latency, size, status).serve(port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[0], sys.argv[1:])
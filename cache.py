@@ -0,0 +1,328 @@
+import asyncio
+import email.utils
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# A private HTTP cache (RFC 9111) for repeated runs of the same requests. Only
+# GET and HEAD responses are stored, and only for requests without a body.
+# Entries live in memory until memory_size is used up; older bodies are then
+# moved to files, and the least recently used entries are dropped once
+# max_size is exceeded. Spilled bodies are written once and never modified, so
+# the cache and the results it serves share them through hard links; file
+# work that can't be avoided runs in a thread, off the event loop.
+
+CACHEABLE_METHODS = ("GET", "HEAD")
+CACHEABLE_STATUSES = (200, 203, 204, 300, 301, 308, 404, 410)
+UNSAFE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+CONDITIONAL_HEADERS = ("if-none-match", "if-modified-since", "if-match", "if-unmodified-since", "if-range", "range")
+# Responses to different credentials are never shared, whether or not the origin sends Vary.
+CREDENTIAL_HEADERS = ("authorization", "proxy-authorization", "cookie")
+HEURISTIC_LIMIT = 24 * 60 * 60
+
+
+@dataclass
+class CacheOptions:
+    enabled: bool = False
+    memory_size: int = 16 * 1024 * 1024
+    max_size: int = 256 * 1024 * 1024
+    heuristic: bool = True
+
+
+class CacheEntry:
+    def __init__(self, status: int, headers: list[tuple[str, str]], vary: dict[str, str] | None,
+                 body: bytes | None, file: str | None, size: int, heuristic: bool):
+        self.status = status
+        self.headers = headers
+        self.vary = vary
+        self.body = body
+        self.file = file
+        self.size = size
+        self.heuristic = heuristic
+        self.update(headers)
+
+    def update(self, headers: list[tuple[str, str]]):
+        self.headers = headers
+        self.stored = time.time()
+        directives = cache_control(headers)
+        self.no_cache = "no-cache" in directives
+        self.initial_age = number(header(headers, "age")) or 0.0
+        self.lifetime = lifetime(headers, directives, self.heuristic)
+
+    def age(self) -> float:
+        return self.initial_age + max(time.time() - self.stored, 0.0)
+
+    def fresh(self, request_headers: list[tuple[str, str]]) -> bool:
+        if self.no_cache:
+            return False
+        directives = cache_control(request_headers)
+        if "no-cache" in directives or (header(request_headers, "pragma") or "").lower() == "no-cache":
+            return False
+        age = self.age()
+        max_age = number(directives.get("max-age"))
+        if max_age is not None and age > max_age:
+            return False
+        return age < self.lifetime
+
+    def conditional(self) -> list[tuple[str, str]]:
+        headers = []
+        etag = header(self.headers, "etag")
+        if etag is not None:
+            headers.append(("If-None-Match", etag))
+        modified = header(self.headers, "last-modified")
+        if modified is not None:
+            headers.append(("If-Modified-Since", modified))
+        return headers
+
+    def matches(self, request_headers: list[tuple[str, str]]) -> bool:
+        return self.vary is None or self.vary == vary_values(self.vary.keys(), request_headers)
+
+    async def read(self, preview_size: int, spill: bool) -> tuple[bytes, str | None]:
+        # The caller owns (and removes) the returned file; the entry may be moved to disk or evicted meanwhile.
+        body = self.body
+        if body is not None:
+            preview = body[:preview_size]
+            if len(preview) == self.size or not spill:
+                return preview, None
+            path = temporary_path()
+            await asyncio.to_thread(write_file, path, body)
+            return preview, path
+        # The open file outlives an eviction that removes its name.
+        with open(self.file, "rb") as f:
+            preview = await asyncio.to_thread(f.read, preview_size)
+            if len(preview) == self.size or not spill:
+                return preview, None
+            path = temporary_path()
+            if not share(self.file, path):
+                await asyncio.to_thread(copy_file, f, path)
+        return preview, path
+
+
+class ResponseCache:
+    def __init__(self, options: CacheOptions):
+        self.options = options
+        self.entries: OrderedDict[tuple[str, str, tuple], CacheEntry] = OrderedDict()
+        self.memory = 0
+        self.total = 0
+        self.directory: str | None = None
+
+    @staticmethod
+    def usable(method: str, headers: list[tuple[str, str]], payload) -> bool:
+        if method.upper() not in CACHEABLE_METHODS or payload is not None:
+            return False
+        if any(k.lower() in CONDITIONAL_HEADERS for k, _ in headers):
+            return False
+        return "no-store" not in cache_control(headers)
+
+    def get(self, method: str, url: str, headers: list[tuple[str, str]]) -> CacheEntry | None:
+        key = cache_key(method, url, headers)
+        entry = self.entries.get(key)
+        if entry is None or not entry.matches(headers):
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    async def store(self, method: str, url: str, request_headers: list[tuple[str, str]], status: int,
+              headers: list[tuple[str, str]], preview: bytes, size: int, file: str | None) -> bool:
+        if status == 304:
+            # Answers a conditional request whose entry is gone; there is nothing to store.
+            return False
+        key = cache_key(method, url, request_headers)
+        self.remove(key)
+        if status not in CACHEABLE_STATUSES or size > self.options.max_size:
+            return False
+        if len(preview) < size and file is None:
+            return False
+        directives = cache_control(headers)
+        if "no-store" in directives:
+            return False
+        names = [n.strip().lower() for n in (header(headers, "vary") or "").split(",") if n.strip()]
+        if "*" in names:
+            return False
+        entry = CacheEntry(status, headers, vary_values(names, request_headers) if names else None,
+                           preview if file is None else None, None, size, self.options.heuristic)
+        if entry.lifetime <= 0 and not entry.conditional():
+            return False
+        if file is not None:
+            path = self.spill_path()
+            if not share(file, path):
+                with open(file, "rb") as f:
+                    await asyncio.to_thread(copy_file, f, path)
+            entry.file = path
+            # Another response for the same key may have been stored while the body was copied.
+            self.remove(key)
+        else:
+            self.memory += size
+        self.entries[key] = entry
+        self.total += size
+        await self.shrink()
+        return True
+
+    def revalidated(self, method: str, url: str, request_headers: list[tuple[str, str]], entry: CacheEntry,
+                    headers: list[tuple[str, str]]) -> bool:
+        # A 304 carries updated metadata for the stored response; its body and length stay the same.
+        # The entry may have been evicted or replaced while the request was in flight.
+        if self.entries.get(cache_key(method, url, request_headers)) is not entry:
+            return False
+        names = {k.lower() for k, _ in headers} - {"content-length"}
+        merged = [(k, v) for k, v in entry.headers if k.lower() not in names]
+        merged += [(k, v) for k, v in headers if k.lower() != "content-length"]
+        entry.update(merged)
+        return True
+
+    def invalidate(self, url: str):
+        for key in [key for key in self.entries if key[1] == url]:
+            self.remove(key)
+
+    def remove(self, key: tuple[str, str, tuple]):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total -= entry.size
+        if entry.file is not None:
+            os.remove(entry.file)
+        else:
+            self.memory -= entry.size
+
+    async def shrink(self):
+        while self.total > self.options.max_size:
+            self.remove(next(iter(self.entries)))
+        for key, entry in list(self.entries.items()):
+            if self.memory <= self.options.memory_size:
+                break
+            body = entry.body
+            if body is None:
+                continue
+            path = self.spill_path()
+            await asyncio.to_thread(write_file, path, body)
+            # The entry may have been dropped, or moved by another shrink, while the body was written.
+            if self.entries.get(key) is entry and entry.body is body:
+                entry.file, entry.body = path, None
+                self.memory -= entry.size
+            else:
+                os.remove(path)
+
+    def spill_path(self) -> str:
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="pyramis-cache-")
+        fd, path = tempfile.mkstemp(suffix=".body", dir=self.directory)
+        os.close(fd)
+        return path
+
+    def clear(self):
+        self.entries.clear()
+        self.memory = 0
+        self.total = 0
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+class CachePool:
+    def __init__(self):
+        self.caches: dict[str, ResponseCache] = {}
+
+    def get(self, key: str, options: CacheOptions) -> ResponseCache | None:
+        cache = self.caches.get(key)
+        if cache is not None and cache.options != options:
+            cache.clear()
+            del self.caches[key]
+            cache = None
+        if not options.enabled:
+            return None
+        if cache is None:
+            cache = self.caches[key] = ResponseCache(options)
+        return cache
+
+    def close(self) -> None:
+        caches, self.caches = self.caches, {}
+        for cache in caches.values():
+            cache.clear()
+
+
+CACHES = CachePool()
+
+
+def temporary_path() -> str:
+    fd, path = tempfile.mkstemp(prefix="pyramis-", suffix=".body")
+    os.close(fd)
+    return path
+
+
+def share(source: str, target: str) -> bool:
+    # Replaces target with a hard link to source. Fails across file systems, or once source was removed.
+    try:
+        os.link(source, target + ".link")
+        os.replace(target + ".link", target)
+        return True
+    except OSError:
+        return False
+
+
+def write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def copy_file(source, path: str):
+    source.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(source, f)
+
+
+def header(headers: list[tuple[str, str]], name: str) -> str | None:
+    values = [v for k, v in headers if k.lower() == name]
+    return ", ".join(values) if values else None
+
+
+def cache_control(headers: list[tuple[str, str]]) -> dict[str, str | None]:
+    directives = {}
+    for directive in (header(headers, "cache-control") or "").split(","):
+        name, _, value = directive.partition("=")
+        name = name.strip().lower()
+        if name:
+            directives[name] = value.strip().strip('"') if value else None
+    return directives
+
+
+def number(value: str | None) -> float | None:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def http_date(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def lifetime(headers: list[tuple[str, str]], directives: dict[str, str | None],
+             heuristic: bool) -> float:
+    max_age = number(directives.get("max-age"))
+    if max_age is not None:
+        return max_age
+    date = http_date(header(headers, "date")) or time.time()
+    if header(headers, "expires") is not None:
+        # An invalid Expires value means "already expired".
+        expires = http_date(header(headers, "expires"))
+        return expires - date if expires is not None else 0.0
+    modified = http_date(header(headers, "last-modified"))
+    if heuristic and modified is not None:
+        return min((date - modified) / 10, HEURISTIC_LIMIT)
+    return 0.0
+
+
+def cache_key(method: str, url: str, headers: list[tuple[str, str]]) -> tuple[str, str, tuple]:
+    return method.upper(), url, tuple((k.lower(), v) for k, v in headers if k.lower() in CREDENTIAL_HEADERS)
+
+
+def vary_values(names, headers: list[tuple[str, str]]) -> dict[str, str]:
+    return {name: header(headers, name) or "" for name in names}
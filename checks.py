@@ -0,0 +1,245 @@
+import codecs
+import json
+import re
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import Any, TYPE_CHECKING
+
+from jsonstream import JSONStream, select, lookup
+
+if TYPE_CHECKING:
+    from executor import Result
+
+SOURCES = ("status", "latency", "body", "header", "json", "regex")
+OPERATORS = ("==", "!=", "<=", ">=", "<", ">", "contains", "matches", "exists")
+EXTRACTOR_PATTERN = re.compile(r"\s*([\w.-]+)\s*=\s*(\w+)(?:\s+(.*?))?\s*")
+ASSERTION_PATTERN = re.compile(
+    r"\s*(\w+)(?:\s+(.*?))?\s+(" + "|".join(re.escape(o) for o in OPERATORS) + r")(?:\s+(.*?))?\s*"
+)
+JSON_PATH_PATTERN = re.compile(r"\.([^.\[\]]+)|\[(\d+)]|\[(['\"])(.*?)\3]")
+# A spilled body is searched in windows that overlap by this many characters,
+# so matches up to this long are found as if the whole body were searched.
+SEARCH_OVERLAP = 64 * 1024
+SEARCH_LIMIT = 16 * SEARCH_OVERLAP
+
+
+@dataclass
+class Selector:
+    source: str
+    expression: str = ""
+
+    def __post_init__(self):
+        if self.source not in SOURCES:
+            raise ValueError(f"unknown source: {self.source}")
+        if self.source in ("header", "json", "regex") and not self.expression:
+            raise ValueError(f"{self.source} needs an expression")
+        self.path = parse_json_path(self.expression) if self.source == "json" else None
+        self.pattern = re.compile(self.expression) if self.source == "regex" else None
+
+
+@dataclass
+class Extractor:
+    rule: str
+    name: str
+    selector: Selector
+
+
+@dataclass
+class Assertion:
+    rule: str
+    selector: Selector
+    operator: str
+    expected: str = ""
+
+
+@dataclass
+class AssertionResult:
+    rule: str
+    source: str
+    passed: bool
+    actual: str | None = None
+
+
+def parse_json_path(expression: str) -> tuple:
+    if not expression.startswith("$"):
+        raise ValueError(f"JSON path must start with $: {expression}")
+    path = []
+    position = 1
+    while position < len(expression):
+        match = JSON_PATH_PATTERN.match(expression, position)
+        if match is None:
+            raise ValueError(f"invalid JSON path: {expression}")
+        if match.group(1) is not None:
+            path.append(match.group(1))
+        elif match.group(2) is not None:
+            path.append(int(match.group(2)))
+        else:
+            path.append(match.group(4))
+        position = match.end()
+    return tuple(path)
+
+
+def parse_extractor(rule: str) -> Extractor:
+    match = EXTRACTOR_PATTERN.fullmatch(rule)
+    if match is None:
+        raise ValueError(f"invalid extractor: {rule}")
+    return Extractor(rule, match.group(1), Selector(match.group(2), match.group(3) or ""))
+
+
+def parse_assertion(rule: str) -> Assertion:
+    match = ASSERTION_PATTERN.fullmatch(rule)
+    if match is None:
+        raise ValueError(f"invalid assertion: {rule}")
+    return Assertion(rule, Selector(match.group(1), match.group(2) or ""), match.group(3), match.group(4) or "")
+
+
+class Subject:
+    # Reads each part of a response at most once, however many rules refer to it.
+    def __init__(self, result: 'Result', paths: list[tuple]):
+        self.result = result
+        self.paths = paths
+        self.text: str | None = None
+        self.values: dict[tuple, Any] | None = None
+
+    def select(self, selector: Selector) -> tuple[bool, Any]:
+        if selector.source == "status":
+            return True, self.result.response_status
+        if selector.source == "latency":
+            return True, round(self.result.elapsed * 1000, 3)
+        if selector.source == "header":
+            name = selector.expression.lower()
+            values = [v for k, v in self.result.response_headers if k.lower() == name]
+            return bool(values), ", ".join(values)
+        if selector.source == "json":
+            values = self.json()
+            return selector.path in values, values.get(selector.path)
+        if selector.source == "regex":
+            match = self.search(selector.pattern)
+            if match is None:
+                return False, None
+            return True, match.group(1) if match.groups() else match.group(0)
+        return True, self.body()
+
+    def body(self) -> str:
+        # The preview: the whole body unless it was spilled to a file.
+        if self.text is None:
+            self.text = (self.result.response_payload or b"").decode("utf-8", "replace")
+        return self.text
+
+    def search(self, pattern: re.Pattern) -> re.Match | None:
+        if self.result.response_file is None:
+            return pattern.search(self.body())
+        # A match is only taken once SEARCH_OVERLAP characters follow it (or the body ends),
+        # so a longer match can't be cut at a window end. The kept window starts one character
+        # early, which gives ^, \b and lookbehinds the text before it.
+        text, start = "", 0
+        pieces = self.texts()
+        piece = next(pieces, None)
+        while piece is not None:
+            text += piece
+            piece = next(pieces, None)
+            match = pattern.search(text, start)
+            if match is not None and (piece is None or match.end() <= len(text) - SEARCH_OVERLAP
+                                      or len(text) > SEARCH_LIMIT):
+                return match
+            cut = len(text) - SEARCH_OVERLAP if match is None else min(match.start(), len(text) - SEARCH_OVERLAP)
+            if cut > start:
+                text, start = text[cut - 1:], 1
+        return None
+
+    def texts(self) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        for chunk in self.result.chunks():
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+    def json(self) -> dict[tuple, Any]:
+        if self.values is None:
+            self.values = {}
+            try:
+                if self.result.response_file is None:
+                    document = json.loads(self.result.response_payload or b"")
+                    for path in self.paths:
+                        found, value = lookup(document, path)
+                        if found:
+                            self.values[path] = value
+                else:
+                    self.values = select(JSONStream(self.result.chunks()), self.paths)
+            except ValueError:
+                pass
+        return self.values
+
+
+def evaluate(result: 'Result', extractors: list[Extractor], assertions: list[Assertion],
+             resolve: Callable[[str], str] = lambda value: value) -> dict[str, str]:
+    paths = list(dict.fromkeys(
+        rule.selector.path for rule in extractors + assertions if rule.selector.path is not None
+    ))
+    subject = Subject(result, paths)
+
+    extracted = {}
+    for extractor in extractors:
+        found, value = subject.select(extractor.selector)
+        if found and value is not None:
+            extracted[extractor.name] = to_string(value)
+
+    result.assertions = [check(subject, assertion, resolve(assertion.expected)) for assertion in assertions]
+    result.extracted = extracted
+    return extracted
+
+
+def check(subject: Subject, assertion: Assertion, expected: str) -> AssertionResult:
+    found, actual = subject.select(assertion.selector)
+    passed = False
+    if assertion.operator == "exists":
+        passed = found
+    elif found:
+        try:
+            if assertion.selector.source == "body" and assertion.operator in ("contains", "matches"):
+                pattern = re.escape(expected) if assertion.operator == "contains" else expected
+                passed = subject.search(re.compile(pattern)) is not None
+            else:
+                passed = compare(actual, assertion.operator, expected)
+        except (ValueError, TypeError, re.error):
+            passed = False
+    return AssertionResult(
+        rule=assertion.rule,
+        source=assertion.selector.source,
+        passed=passed,
+        actual=truncate(to_string(actual)) if found else None,
+    )
+
+
+def compare(actual: Any, operator: str, expected: str) -> bool:
+    text = to_string(actual)
+    if operator in ("==", "!="):
+        equal = text == expected
+        if not equal:
+            try:
+                parsed = json.loads(expected)
+                equal = parsed == actual and isinstance(parsed, bool) == isinstance(actual, bool)
+            except ValueError:
+                pass
+        return equal if operator == "==" else not equal
+    if operator == "contains":
+        return expected in text
+    if operator == "matches":
+        return re.search(expected, text) is not None
+    left, right = float(actual), float(expected)
+    if operator == "<":
+        return left < right
+    if operator == "<=":
+        return left <= right
+    if operator == ">":
+        return left > right
+    return left >= right
+
+
+def to_string(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def truncate(text: str, limit: int = 200) -> str:
+    return text if len(text) <= limit else text[:limit] + "..."
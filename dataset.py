@@ -0,0 +1,69 @@
+import asyncio
+import csv
+import json
+import os
+from collections.abc import Awaitable, Callable, Iterator
+
+from executor import Collection, Request, Result
+
+
+def read_rows(path: str, start: int = 0, offset: int = 0, step: int = 1) -> Iterator[tuple[int, dict[str, str]]]:
+    # Yields (index, variables) for every step-th row from offset on, reading the file lazily.
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+            index = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                if index >= start and index % step == offset:
+                    yield index, row_variables(json.loads(line))
+                index += 1
+        else:
+            for index, row in enumerate(csv.DictReader(f)):
+                if index >= start and index % step == offset:
+                    yield index, {k: v or "" for k, v in row.items() if k is not None}
+
+
+def row_variables(row: dict) -> dict[str, str]:
+    if not isinstance(row, dict):
+        raise ValueError(f"dataset rows must be JSON objects, got: {type(row).__name__}")
+    return {
+        k: v if isinstance(v, str) else "" if v is None else json.dumps(v)
+        for k, v in row.items()
+    }
+
+
+def completed_rows(path: str) -> tuple[int, set[int]]:
+    # Scans a previous output file and returns the first row that did not finish,
+    # along with the finished rows after it.
+    done = set()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["row"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    start = 0
+    while start in done:
+        done.discard(start)
+        start += 1
+    return start, done
+
+
+async def run_rows(collection: Collection, rows: Iterator[tuple[int, dict[str, str]]], parallel: int,
+                   consumer: Callable[[int, dict[str, str], list[tuple[Request, Result]]], Awaitable]) -> None:
+    async def worker():
+        # Workers pull from the shared iterator, so at most `parallel` rows are in memory at once.
+        for index, row in rows:
+            results = []
+
+            async def collect(request: Request, result: Result):
+                results.append((request, result))
+
+            await collection.scoped(row).run(collect)
+            await consumer(index, row, results)
+
+    await asyncio.gather(*(worker() for _ in range(max(parallel, 1))))
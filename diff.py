@@ -0,0 +1,301 @@
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from typing import Any
+
+from executor import Result
+from jsonstream import JSONStream
+
+DIFF_LIMIT = 100
+DIFF_IGNORE = ["headers.date"]
+
+
+@dataclass
+class Change:
+    path: str
+    kind: str
+    left: Any = None
+    right: Any = None
+
+
+@dataclass
+class ResultDiff:
+    request: str
+    left_status: int
+    right_status: int
+    elapsed: float
+    ttfb: float | None
+    headers: list[Change] = field(default_factory=list)
+    body: list[Change] = field(default_factory=list)
+    changes: int = 0
+    json: bool = False
+    partial: bool = False
+
+    def same(self) -> bool:
+        return self.left_status == self.right_status and self.changes == 0
+
+
+class Ignore:
+    def __init__(self, patterns: list[str]):
+        self.patterns = [tuple(p.split(".")) for p in patterns if p]
+
+    def __call__(self, path: tuple) -> bool:
+        for pattern in self.patterns:
+            if len(pattern) <= len(path) and all(p == "*" or p == str(k) for p, k in zip(pattern, path)):
+                return True
+        return False
+
+
+class Differ:
+    def __init__(self, ignore: Ignore, limit: int = DIFF_LIMIT):
+        self.ignore = ignore
+        self.limit = limit
+        self.changes: list[Change] = []
+        self.count = 0
+
+    def add(self, path: tuple, kind: str, left: Any = None, right: Any = None):
+        self.count += 1
+        if len(self.changes) < self.limit:
+            self.changes.append(Change(".".join(str(p) for p in path), kind, left, right))
+
+    def headers(self, left: list[tuple[str, str]], right: list[tuple[str, str]]):
+        left_headers = group_headers(left)
+        right_headers = group_headers(right)
+        for name, value in left_headers.items():
+            path = ("headers", name)
+            if self.ignore(path):
+                continue
+            if name not in right_headers:
+                self.add(path, "removed", value)
+            elif right_headers[name] != value:
+                self.add(path, "changed", value, right_headers[name])
+        for name, value in right_headers.items():
+            if name not in left_headers and not self.ignore(("headers", name)):
+                self.add(("headers", name), "added", right=value)
+
+    def stream(self, left: JSONStream, right: JSONStream, path: tuple):
+        left_measured = left.measure()
+        right_measured = right.measure() if left_measured is not None else None
+        if left_measured is not None and right_measured is not None:
+            (left_value, left_end), (right_value, right_end) = left_measured, right_measured
+            same = left.buffer[left.position:left_end] == right.buffer[right.position:right_end]
+            left.position = left_end
+            right.position = right_end
+            if not same:
+                self.value(path, left_value, right_value)
+            return
+
+        left_char = left.peek()
+        right_char = right.peek()
+        if left_char == "{" and right_char == "{":
+            self.stream_object(left, right, path)
+        elif left_char == "[" and right_char == "[":
+            self.stream_array(left, right, path)
+        else:
+            left_value = left.skip()
+            right_value = right.skip()
+            if left_char in ("{", "[") or right_char in ("{", "[") or differs(left_value, right_value):
+                self.add(path, "changed", left_value, right_value)
+
+    def stream_object(self, left: JSONStream, right: JSONStream, path: tuple):
+        # Matching keys are compared as they stream; a value is only held in memory
+        # while its key is still missing on the other side.
+        left_keys = left.members()
+        right_keys = right.members()
+        left_pending: dict[str, Any] = {}
+        right_pending: dict[str, Any] = {}
+        left_key = next(left_keys, None)
+        right_key = next(right_keys, None)
+        while left_key is not None or right_key is not None:
+            if left_key is not None and left_key == right_key:
+                if self.ignore(path + (left_key,)):
+                    left.skip()
+                    right.skip()
+                else:
+                    self.stream(left, right, path + (left_key,))
+                left_key = next(left_keys, None)
+                right_key = next(right_keys, None)
+            elif left_key is not None and left_key in right_pending:
+                self.value(path + (left_key,), left.value(), right_pending.pop(left_key))
+                left_key = next(left_keys, None)
+            elif right_key is not None and right_key in left_pending:
+                self.value(path + (right_key,), left_pending.pop(right_key), right.value())
+                right_key = next(right_keys, None)
+            else:
+                left_open = left_key is not None
+                right_open = right_key is not None
+                if left_open:
+                    if self.ignore(path + (left_key,)):
+                        left.skip()
+                    elif not right_open:
+                        self.add(path + (left_key,), "removed", left.skip())
+                    else:
+                        left_pending[left_key] = left.value()
+                    left_key = next(left_keys, None)
+                if right_open:
+                    if self.ignore(path + (right_key,)):
+                        right.skip()
+                    elif not left_open:
+                        self.add(path + (right_key,), "added", right=right.skip())
+                    else:
+                        right_pending[right_key] = right.value()
+                    right_key = next(right_keys, None)
+        for key, value in left_pending.items():
+            self.add(path + (key,), "removed", summary(value))
+        for key, value in right_pending.items():
+            self.add(path + (key,), "added", right=summary(value))
+
+    def stream_array(self, left: JSONStream, right: JSONStream, path: tuple):
+        left_items = left.items()
+        right_items = right.items()
+        left_index = next(left_items, None)
+        right_index = next(right_items, None)
+        while left_index is not None or right_index is not None:
+            if left_index is not None and right_index is not None:
+                if self.ignore(path + (left_index,)):
+                    left.skip()
+                    right.skip()
+                else:
+                    self.stream(left, right, path + (left_index,))
+                left_index = next(left_items, None)
+                right_index = next(right_items, None)
+            elif left_index is not None:
+                if not self.ignore(path + (left_index,)):
+                    self.add(path + (left_index,), "removed", left.skip())
+                else:
+                    left.skip()
+                left_index = next(left_items, None)
+            else:
+                if not self.ignore(path + (right_index,)):
+                    self.add(path + (right_index,), "added", right=right.skip())
+                else:
+                    right.skip()
+                right_index = next(right_items, None)
+
+    def value(self, path: tuple, left: Any, right: Any):
+        if self.ignore(path):
+            return
+        if isinstance(left, dict) and isinstance(right, dict):
+            for key, value in left.items():
+                if key in right:
+                    self.value(path + (key,), value, right[key])
+                elif not self.ignore(path + (key,)):
+                    self.add(path + (key,), "removed", summary(value))
+            for key, value in right.items():
+                if key not in left and not self.ignore(path + (key,)):
+                    self.add(path + (key,), "added", right=summary(value))
+        elif isinstance(left, list) and isinstance(right, list):
+            for index in range(max(len(left), len(right))):
+                if index >= len(right):
+                    if not self.ignore(path + (index,)):
+                        self.add(path + (index,), "removed", summary(left[index]))
+                elif index >= len(left):
+                    if not self.ignore(path + (index,)):
+                        self.add(path + (index,), "added", right=summary(right[index]))
+                else:
+                    self.value(path + (index,), left[index], right[index])
+        elif differs(left, right):
+            self.add(path, "changed", summary(left), summary(right))
+
+    def bytes(self, left: Iterator[bytes], right: Iterator[bytes]):
+        offset = 0
+        left_buffer = b""
+        right_buffer = b""
+        left_size = 0
+        right_size = 0
+        difference = None
+        while True:
+            if not left_buffer:
+                left_buffer = next(left, b"")
+                left_size += len(left_buffer)
+            if not right_buffer:
+                right_buffer = next(right, b"")
+                right_size += len(right_buffer)
+            if not left_buffer or not right_buffer:
+                break
+            length = min(len(left_buffer), len(right_buffer))
+            if difference is None and left_buffer[:length] != right_buffer[:length]:
+                difference = offset + next(i for i in range(length) if left_buffer[i] != right_buffer[i])
+            offset += length
+            left_buffer = left_buffer[length:]
+            right_buffer = right_buffer[length:]
+        for chunk in left:
+            left_size += len(chunk)
+        for chunk in right:
+            right_size += len(chunk)
+        if difference is None and left_size != right_size:
+            difference = offset
+        if difference is not None:
+            self.add(("body",), "changed", f"{left_size} bytes", f"{right_size} bytes, first difference at {difference}")
+
+
+def differs(left: Any, right: Any) -> bool:
+    return left != right or isinstance(left, bool) != isinstance(right, bool)
+
+
+def summary(value: Any) -> Any:
+    if isinstance(value, dict):
+        return "{...}"
+    if isinstance(value, list):
+        return "[...]"
+    return value
+
+
+def group_headers(headers: list[tuple[str, str]]) -> dict[str, str]:
+    grouped: dict[str, list[str]] = {}
+    for name, value in headers:
+        grouped.setdefault(name.lower(), []).append(value)
+    return {name: ", ".join(values) for name, values in grouped.items()}
+
+
+def is_json(result: Result) -> bool:
+    return any(k.lower() == "content-type" and "json" in v.lower() for k, v in result.response_headers)
+
+
+def diff_body(ignore: Ignore, limit: int, left: Callable[[], Iterator[bytes]], right: Callable[[], Iterator[bytes]],
+              structural: bool) -> tuple[Differ, bool]:
+    body = Differ(ignore, limit)
+    if structural:
+        try:
+            left_stream = JSONStream(left())
+            right_stream = JSONStream(right())
+            if left_stream.peek() and right_stream.peek():
+                body.stream(left_stream, right_stream, ("body",))
+                left_stream.end()
+                right_stream.end()
+                return body, True
+        except ValueError:
+            body = Differ(ignore, limit)
+    if not ignore(("body",)):
+        body.bytes(left(), right())
+    return body, False
+
+
+def diff_results(request: str, left: Result, right: Result, ignore: list[str] | None = None,
+                 limit: int = DIFF_LIMIT) -> ResultDiff:
+    patterns = Ignore(ignore or [])
+    differ = Differ(patterns, limit)
+    differ.headers(left.response_headers, right.response_headers)
+    body, structural = diff_body(
+        patterns,
+        limit,
+        left.chunks,
+        right.chunks,
+        is_json(left) and is_json(right),
+    )
+
+    ttfb = None
+    if left.timings and right.timings and left.timings.ttfb is not None and right.timings.ttfb is not None:
+        ttfb = right.timings.ttfb - left.timings.ttfb
+
+    return ResultDiff(
+        request=request,
+        left_status=left.response_status,
+        right_status=right.response_status,
+        elapsed=right.elapsed - left.elapsed,
+        ttfb=ttfb,
+        headers=differ.changes,
+        body=body.changes,
+        changes=differ.count + body.count,
+        json=structural,
+        partial=any(r.response_truncated and r.response_file is None for r in (left, right)),
+    )
@@ -1,10 +1,40 @@
+import asyncio
+import copy
+import logging
+import email.utils
+import os
+import random
 import re
-from collections.abc import Callable
-from dataclasses import dataclass
+import tempfile
+import time
+import urllib.parse
+from collections.abc import AsyncIterator, Callable, Iterator
+from dataclasses import dataclass, field
 from typing import overload, Awaitable
 
 import httpx
 
+from cache import CacheEntry, CacheOptions, ResponseCache, CACHES, UNSAFE_METHODS
+from checks import Assertion, AssertionResult, Extractor, evaluate
+from metrics import REQUESTS, REQUEST_DURATION, REQUESTS_IN_FLIGHT, BYTES_SENT, BYTES_RECEIVED, CACHE_LOOKUPS
+
+TEMPLATE_PATTERN = re.compile("\\{\\{(.*?)}}")
+TEMPLATE_BYTES_PATTERN = re.compile(b"\\{\\{(.*?)}}")
+TEMPLATE_NAME_LIMIT = 4096
+PAYLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class Timings:
+    # DNS resolution happens inside httpcore's connect_tcp, so it is included in connect.
+    connect: float | None = None
+    tls: float | None = None
+    ttfb: float | None = None
+    download: float | None = None
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    reused: bool = True
+
 
 @dataclass
 class Result:
@@ -15,39 +45,594 @@ class Result:
     response_status: int
     response_headers: list[tuple[str, str]]
     response_payload: bytes | None
+    response_size: int = 0
+    response_truncated: bool = False
+    response_file: str | None = None
+    elapsed: float = 0.0
+    error: str | None = None
+    timings: Timings | None = None
+    assertions: list[AssertionResult] = field(default_factory=list)
+    extracted: dict[str, str] = field(default_factory=dict)
+    retries: int = 0
+    waited: float = 0.0
+    # "hit" (served without a request), "revalidated" (confirmed by a 304) or "miss"; None when not cached.
+    cache: str | None = None
+    cache_age: float | None = None
+
+    def ok(self) -> bool:
+        if self.error is not None:
+            return False
+        if not all(a.passed for a in self.assertions):
+            return False
+        return any(a.source == "status" for a in self.assertions) or 0 < self.response_status < 400
+
+    def chunks(self, size: int = 64 * 1024) -> Iterator[bytes]:
+        if self.response_file is not None:
+            with open(self.response_file, "rb") as f:
+                while chunk := f.read(size):
+                    yield chunk
+        elif self.response_payload:
+            yield self.response_payload
+
+
+class Tracer:
+    def __init__(self):
+        self.timings = Timings()
+        self.started: dict[str, float] = {}
+        self.sent: float | None = None
+        self.received: float | None = None
+        self.body_size: int | None = None
+
+    async def __call__(self, event: str, info: dict):
+        now = time.perf_counter()
+        name, _, phase = event.rpartition(".")
+        if phase == "started":
+            self.started[name] = now
+            return
+        if phase != "complete":
+            return
+        start = self.started.pop(name, now)
+        if name == "connection.connect_tcp" or name == "connection.connect_unix_socket":
+            self.timings.connect = (self.timings.connect or 0.0) + now - start
+            self.timings.reused = False
+        elif name == "connection.start_tls":
+            self.timings.tls = (self.timings.tls or 0.0) + now - start
+        elif name.endswith(".send_request_body"):
+            self.sent = now
+        elif name.endswith(".receive_response_headers"):
+            self.timings.ttfb = now - (self.sent or start)
+            self.received = now
+
+    async def count(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        # A streamed request body cannot be measured afterwards, so it is counted as it is sent.
+        self.body_size = 0
+        async for chunk in chunks:
+            self.body_size += len(chunk)
+            yield chunk
+
+    def finish(self, response: httpx.Response, end: float) -> Timings:
+        if self.received is not None:
+            self.timings.download = end - self.received
+        request = response.request
+        self.timings.bytes_sent = header_size(
+            f"{request.method} {request.url.raw_path.decode('ascii')} {response.http_version}",
+            request.headers.raw,
+        ) + (self.body_size if self.body_size is not None else len(request.content))
+        self.timings.bytes_received = header_size(
+            f"{response.http_version} {response.status_code} {response.reason_phrase}",
+            response.headers.raw,
+        ) + response.num_bytes_downloaded
+        return self.timings
+
+
+def header_size(start_line: str, headers: list[tuple[bytes, bytes]]) -> int:
+    return len(start_line) + 2 + sum(len(k) + len(v) + 4 for k, v in headers) + 2
+
+
+@dataclass
+class BodyOptions:
+    preview_size: int = 1024 * 1024
+    spill: bool = True
+
+
+@dataclass
+class RateLimitOptions:
+    rate: float | None = None
+    burst: int = 1
+
+    def share(self, jobs: int) -> 'RateLimitOptions':
+        # Every worker process has its own buckets, so each gets an equal share of the rate.
+        if not self.rate or jobs <= 1:
+            return self
+        return RateLimitOptions(self.rate / jobs, self.burst)
+
+
+@dataclass
+class RetryOptions:
+    attempts: int = 1
+    statuses: list[int] = field(default_factory=lambda: [429, 503])
+    errors: list[str] = field(default_factory=lambda: ["ConnectError", "ConnectTimeout", "PoolTimeout"])
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+    jitter: bool = True
+    retry_after: bool = True
+
+    def delay(self, attempt: int, result: 'Result', error: Exception | None) -> float | None:
+        # Returns how long to wait before the next attempt, or None if the result is final.
+        if attempt + 1 >= self.attempts:
+            return None
+        if error is not None:
+            if not any(t.__name__ in self.errors for t in type(error).__mro__):
+                return None
+        elif result.response_status not in self.statuses:
+            return None
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if self.retry_after and error is None:
+            after = retry_after(result.response_headers)
+            if after is not None:
+                delay = max(delay, min(after, self.max_backoff))
+        return delay
+
+
+def retry_after(headers: list[tuple[str, str]]) -> float | None:
+    for name, value in headers:
+        if name.lower() != "retry-after":
+            continue
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> float:
+        # Tokens may go negative: each caller reserves its slot and sleeps until it is due, in arrival order.
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+
+class RateLimiter:
+    def __init__(self, options: RateLimitOptions):
+        self.options = options
+        self.buckets: dict[str, TokenBucket] = {}
+
+    async def acquire(self, host: str) -> float:
+        if not self.options.rate:
+            return 0.0
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(self.options.rate, self.options.burst)
+        return await bucket.acquire()
+
+
+@dataclass
+class ClientOptions:
+    max_connections: int | None = 100
+    max_keepalive_connections: int | None = 20
+    keepalive_expiry: float | None = 5.0
+    http2: bool = False
+    timeout: float | None = 5.0
+
+
+class ClientStats:
+    def __init__(self):
+        self.clients = 0
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+
+    def reused(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+
+class ClientPool:
+    def __init__(self):
+        self.clients: dict[str, tuple[asyncio.AbstractEventLoop, ClientOptions, httpx.AsyncClient]] = {}
+        self.stats: dict[str, ClientStats] = {}
+
+    def get(self, key: str, options: ClientOptions) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        entry = self.clients.get(key)
+        if entry is not None:
+            client_loop, client_options, client = entry
+            if client_loop is loop and client_options == options and not client.is_closed:
+                return client
+            if client_loop is loop:
+                loop.create_task(client.aclose())
+
+        stats = self.stats.setdefault(key, ClientStats())
+        client = self.create(options, stats)
+        stats.clients += 1
+        self.clients[key] = (loop, options, client)
+        return client
+
+    @staticmethod
+    def create(options: ClientOptions, stats: ClientStats) -> httpx.AsyncClient:
+        async def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.complete":
+                stats.connections += 1
+            elif event == "connection.start_tls.complete":
+                stats.tls_handshakes += 1
+
+        async def on_request(request: httpx.Request):
+            stats.requests += 1
+            request_trace = request.extensions.get("trace")
+            if request_trace is None:
+                request.extensions["trace"] = trace
+            else:
+                async def traces(event: str, info: dict):
+                    await trace(event, info)
+                    await request_trace(event, info)
+
+                request.extensions["trace"] = traces
+
+        http2 = options.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logging.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+                http2 = False
+
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=options.max_connections,
+                max_keepalive_connections=options.max_keepalive_connections,
+                keepalive_expiry=options.keepalive_expiry,
+            ),
+            timeout=options.timeout,
+            http2=http2,
+            event_hooks={"request": [on_request]},
+        )
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        clients, self.clients = self.clients, {}
+        for client_loop, _, client in clients.values():
+            if client_loop is loop:
+                await client.aclose()
+
+
+CLIENTS = ClientPool()
+
+
+class Template:
+    def __init__(self, source: str | bytes):
+        self.source = source
+        self.literals = []
+        self.names: list[str | None] = []
+        self.placeholders = []
+        self.key: tuple | None = None
+        self.rendered = source
+
+        binary = isinstance(source, bytes)
+        if (b"{{" if binary else "{{") not in source:
+            return
+        position = 0
+        for match in (TEMPLATE_BYTES_PATTERN if binary else TEMPLATE_PATTERN).finditer(source):
+            self.literals.append(source[position:match.start()])
+            self.names.append(template_name(match.group(1)) if binary else match.group(1))
+            self.placeholders.append(match.group(0))
+            position = match.end()
+        self.literals.append(source[position:])
+
+    def render(self, variables: dict[str, str]) -> str | bytes:
+        if not self.names:
+            return self.source
+        key = tuple(variables.get(name) for name in self.names)
+        if key != self.key:
+            binary = isinstance(self.source, bytes)
+            parts = [self.literals[0]]
+            for value, placeholder, literal in zip(key, self.placeholders, self.literals[1:]):
+                if value is None:
+                    parts.append(placeholder)
+                else:
+                    parts.append(value.encode("utf-8") if binary else value)
+                parts.append(literal)
+            self.rendered = self.source[:0].join(parts)
+            self.key = key
+        return self.rendered
+
+
+class PayloadFile:
+    # A payload.data that is sent straight from the file, so it is never held in memory as a whole.
+    def __init__(self, path: str, chunk_size: int = PAYLOAD_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        # Unknown until the first send: scanning a large file would block the event loop while the collection is built.
+        self.templated: bool | None = None
+
+    async def scan(self) -> bool:
+        if self.templated is None:
+            self.templated = await asyncio.to_thread(contains, self.path, b"{{")
+        return self.templated
+
+    async def render(self, variables: dict[str, str]) -> AsyncIterator[bytes]:
+        with open(self.path, "rb") as f:
+            if self.templated is False:
+                while chunk := f.read(self.chunk_size):
+                    yield chunk
+                return
+            pending = b""
+            while True:
+                chunk = f.read(self.chunk_size)
+                data = pending + chunk if pending else chunk
+                if not chunk:
+                    if data:
+                        yield Template(data).render(variables)
+                    return
+                cut = template_boundary(data)
+                if cut > 0:
+                    yield Template(data[:cut]).render(variables)
+                pending = data[cut:]
+
+
+def template_name(name: bytes) -> str | None:
+    # A name that is not UTF-8 matches no variable, so binary payloads keep those bytes unchanged.
+    try:
+        return name.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def contains(path: str, needle: bytes, chunk_size: int = 1024 * 1024) -> bool:
+    # Scans through one reusable buffer; chunks overlap so a needle split between them is found.
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    carry = len(needle) - 1
+    kept = 0
+    with open(path, "rb") as f:
+        while read := f.readinto(view[kept:]):
+            end = kept + read
+            if buffer.find(needle, 0, end) != -1:
+                return True
+            kept = min(carry, end)
+            buffer[:kept] = buffer[end - kept:end]
+    return False
+
+
+def template_boundary(data: bytes) -> int:
+    # Returns how much of data can be rendered now: a placeholder that may still
+    # be completed by the next chunk is held back, up to TEMPLATE_NAME_LIMIT bytes.
+    end = 0
+    for match in TEMPLATE_BYTES_PATTERN.finditer(data):
+        end = match.end()
+    held = data.find(b"{{", max(end, data.rfind(b"\n") + 1))
+    if held != -1 and len(data) - held <= TEMPLATE_NAME_LIMIT:
+        return held
+    if data.endswith(b"{"):
+        return len(data) - 1
+    return len(data)
 
 
 class Request:
-    def __init__(self, name: str, method: str, url: str, headers: list[tuple[str, str]], payload: bytes | None = None):
+    def __init__(self, name: str, method: str, url: str, headers: list[tuple[str, str]],
+                 payload: bytes | PayloadFile | None = None,
+                 after: list[str] | None = None, extractors: list[Extractor] | None = None,
+                 assertions: list[Assertion] | None = None):
         self.name = name
         self.method = method
         self.url = url
         self.headers = headers
         self.payload = payload
+        self.after = after or []
+        self.extractors = extractors or []
+        self.assertions = assertions or []
+        self.templates: dict[tuple, Template] = {}
 
-    async def run(self, collection: 'Collection', client: httpx.AsyncClient) -> Result:
-        response = await client.request(
-            method=collection.resolve(self.method),
-            url=collection.resolve(self.url),
-            headers=[(collection.resolve(k), collection.resolve(v)) for k, v in self.headers],
-            data=collection.resolve(self.payload),
+    def template(self, key: tuple, source: str | bytes) -> Template:
+        template = self.templates.get(key)
+        if template is None or template.source is not source:
+            template = self.templates[key] = Template(source)
+        return template
+
+    def resolve(self, variables: dict[str, str]) \
+            -> tuple[str, str, list[tuple[str, str]], str | bytes | AsyncIterator[bytes] | None]:
+        headers = [
+            (self.template(("header", i, 0), k).render(variables),
+             self.template(("header", i, 1), v).render(variables))
+            for i, (k, v) in enumerate(self.headers)
+        ]
+        if isinstance(self.payload, PayloadFile):
+            # A streamed body is sent chunked unless its length is known up front.
+            if self.payload.templated is False and not any(k.lower() == "content-length" for k, _ in headers):
+                headers.append(("Content-Length", str(self.payload.size)))
+            payload = self.payload.render(variables)
+        elif self.payload is not None:
+            payload = self.template(("payload",), self.payload).render(variables)
+        else:
+            payload = None
+        return (
+            self.template(("method",), self.method).render(variables),
+            self.template(("url",), self.url).render(variables),
+            headers,
+            payload,
         )
 
-        return Result(
+    async def run(self, collection: 'Collection', client: httpx.AsyncClient,
+                  acquire: Callable[[str], Awaitable[None]]) -> Result:
+        # acquire(host) is awaited right before the request goes out, so fresh cache hits skip the rate limit.
+        if isinstance(self.payload, PayloadFile):
+            await self.payload.scan()
+        method, url, headers, payload = self.resolve(collection.variables)
+        labels = (os.path.basename(collection.name), urllib.parse.urlsplit(url).netloc.lower())
+        cache = collection.cache
+        if cache is not None and not ResponseCache.usable(method, headers, payload):
+            cache = None
+        entry = cache.get(method, url, headers) if cache is not None else None
+        if entry is not None and entry.fresh(headers):
+            CACHE_LOOKUPS.inc(labels[0], "hit")
+            return await self.cached(collection, entry, method, url, headers)
+        request_headers = headers
+        if entry is not None:
+            headers = headers + entry.conditional()
+        await acquire(labels[1])
+        tracer = Tracer()
+        if isinstance(self.payload, PayloadFile):
+            payload = tracer.count(payload)
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            async with client.stream(
+                method=method,
+                url=url,
+                headers=headers,
+                content=payload,
+                extensions={"trace": tracer},
+            ) as response:
+                preview, size, file = await read_body(response, collection.body_options)
+        except Exception as e:
+            REQUESTS.inc(*labels, type(e).__name__)
+            raise
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+        end = time.perf_counter()
+
+        result = Result(
             request_method=response.request.method,
             request_url=str(response.request.url),
             request_headers=response.request.headers.multi_items(),
-            request_payload=response.request.content,
+            request_payload=None if isinstance(self.payload, PayloadFile) else response.request.content,
             response_status=response.status_code,
             response_headers=response.headers.multi_items(),
-            response_payload=response.content
+            response_payload=preview,
+            response_size=size,
+            response_truncated=size > len(preview),
+            response_file=file,
+            elapsed=end - start,
+            timings=tracer.finish(response, end),
+        )
+        REQUESTS.inc(*labels, str(response.status_code))
+        REQUEST_DURATION.observe(result.elapsed, *labels)
+        BYTES_SENT.inc(*labels, value=result.timings.bytes_sent)
+        BYTES_RECEIVED.inc(*labels, value=result.timings.bytes_received)
+
+        if entry is not None and response.status_code == 304 \
+                and cache.revalidated(method, url, request_headers, entry, result.response_headers):
+            preview, file = await entry.read(collection.body_options.preview_size, collection.body_options.spill)
+            result.response_status = entry.status
+            result.response_headers = entry.headers
+            result.response_payload = preview
+            result.response_size = entry.size
+            result.response_truncated = entry.size > len(preview)
+            result.response_file = file
+            result.cache = "revalidated"
+            result.cache_age = entry.age()
+        elif cache is not None:
+            await cache.store(method, url, request_headers, response.status_code, result.response_headers,
+                              preview, size, file)
+            result.cache = "miss"
+        elif collection.cache is not None and method.upper() in UNSAFE_METHODS and response.status_code < 400:
+            collection.cache.invalidate(url)
+        if result.cache is not None:
+            CACHE_LOOKUPS.inc(labels[0], result.cache)
+        return result
+
+    async def cached(self, collection: 'Collection', entry: CacheEntry, method: str, url: str,
+                     headers: list[tuple[str, str]]) -> Result:
+        preview, file = await entry.read(collection.body_options.preview_size, collection.body_options.spill)
+        return Result(
+            request_method=method,
+            request_url=url,
+            request_headers=headers,
+            request_payload=None,
+            response_status=entry.status,
+            response_headers=entry.headers,
+            response_payload=preview,
+            response_size=entry.size,
+            response_truncated=entry.size > len(preview),
+            response_file=file,
+            cache="hit",
+            cache_age=entry.age(),
+        )
+
+    def failed(self, collection: 'Collection', error: Exception) -> Result:
+        method, url, headers, payload = self.resolve(collection.variables)
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        return Result(
+            request_method=method,
+            request_url=url,
+            request_headers=headers,
+            request_payload=payload if isinstance(payload, bytes) else None,
+            response_status=0,
+            response_headers=[],
+            response_payload=None,
+            error=f"{type(error).__name__}: {error}" if str(error) else type(error).__name__,
         )
 
 
+async def read_body(response: httpx.Response, options: BodyOptions) -> tuple[bytes, int, str | None]:
+    preview = bytearray()
+    size = 0
+    spill = None
+    try:
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            taken = min(len(chunk), options.preview_size - len(preview))
+            if taken > 0:
+                preview += chunk[:taken]
+            if taken == len(chunk) or not options.spill:
+                continue
+            if spill is None:
+                spill = tempfile.NamedTemporaryFile(prefix="pyramis-", suffix=".body", delete=False)
+                spill.write(preview)
+            spill.write(memoryview(chunk)[taken:])
+    except BaseException:
+        if spill is not None:
+            spill.close()
+            os.remove(spill.name)
+        raise
+    if spill is not None:
+        spill.close()
+    return bytes(preview), size, spill.name if spill is not None else None
+
+
 class Collection:
-    def __init__(self, variables: dict[str, str], requests: list[Request]):
+    def __init__(self, variables: dict[str, str], requests: list[Request], concurrency: int = 1,
+                 name: str = "", options: ClientOptions | None = None, body_options: BodyOptions | None = None,
+                 rate_limit: RateLimitOptions | None = None, retry: RetryOptions | None = None,
+                 cache: CacheOptions | None = None, environment: str | None = None):
         self.variables = variables
         self.requests = requests
+        self.concurrency = concurrency
+        self.name = name
+        self.options = options or ClientOptions()
+        self.body_options = body_options or BodyOptions()
+        self.retry = retry or RetryOptions()
+        # Scoped copies share the limiter, so rows of a dataset run draw from the same buckets.
+        self.limiter = RateLimiter(rate_limit or RateLimitOptions())
+        # The cache outlives the collection, so repeated runs of the same collection share it.
+        # Environments each have their own, so the two sides of a comparison never answer each other.
+        self.cache = CACHES.get(f"{name}#{environment}" if environment else name, cache or CacheOptions())
+
+    def client(self) -> httpx.AsyncClient:
+        return CLIENTS.get(self.name, self.options)
+
+    def scoped(self, variables: dict[str, str]) -> 'Collection':
+        scoped = copy.copy(self)
+        scoped.variables = self.variables | variables
+        return scoped
 
     @overload
     def resolve(self, value: None) -> None:
@@ -64,29 +649,106 @@ class Collection:
     def resolve(self, value: bytes | str | None) -> bytes | str | None:
         if value is None:
             return None
+        return Template(value).render(self.variables)
 
-        if isinstance(value, bytes):
-            def repl(match: re.Match[bytes]) -> bytes:
-                key = match.group(1).decode('utf-8')
-                if key in self.variables:
-                    return self.variables[key].encode('utf-8')
-                return match.group(0)
+    def ordered(self) -> list[Request]:
+        by_name = {request.name: request for request in self.requests}
+        ordered = []
+        state = {}
 
-            return re.sub(b"\\{\\{(.*?)}}", repl, value, re.MULTILINE)
+        def visit(request: Request):
+            if state.get(request.name) == "done":
+                return
+            if state.get(request.name) == "visiting":
+                raise Exception(f"dependency cycle at request: {request.name}")
+            state[request.name] = "visiting"
+            for name in request.after:
+                if name in by_name:
+                    visit(by_name[name])
+            state[request.name] = "done"
+            ordered.append(request)
 
-        def repl(match: re.Match[str]) -> str:
-            key = match.group(1)
-            if key in self.variables:
-                return self.variables[key]
-            return match.group(0)
-
-        return re.sub("\\{\\{(.*?)}}", repl, value, re.MULTILINE)
+        for request in self.requests:
+            visit(request)
+        return ordered
 
     async def run(self, consumer: Callable[[Request, Result], Awaitable]) -> None:
-        async with httpx.AsyncClient() as client:
-            for request in self.requests:
-                await consumer(request, await request.run(self, client))
+        requests = self.ordered()
+        client = self.client()
+        if self.concurrency <= 1:
+            for request in requests:
+                await consumer(request, await self.execute(request, client))
+        else:
+            await self.run_concurrent(requests, client, consumer)
+
+    async def run_concurrent(self, requests: list[Request], client: httpx.AsyncClient,
+                             consumer: Callable[[Request, Result], Awaitable]) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        finished = {request.name: asyncio.Event() for request in requests}
+
+        async def run_one(request: Request):
+            try:
+                for name in request.after:
+                    if name in finished:
+                        await finished[name].wait()
+                async with semaphore:
+                    result = await self.execute(request, client)
+            finally:
+                finished[request.name].set()
+            await consumer(request, result)
+
+        tasks = [asyncio.ensure_future(run_one(request)) for request in requests]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
     async def run_single(self, request: Request) -> Result:
-        async with httpx.AsyncClient() as client:
-            return await request.run(self, client)
+        return await self.execute(request, self.client())
+
+    async def execute(self, request: Request, client: httpx.AsyncClient) -> Result:
+        result = await self.send(request, client)
+        if result.error is not None:
+            return result
+        if request.extractors or request.assertions:
+            if result.response_file is None:
+                extracted = evaluate(result, request.extractors, request.assertions, self.resolve)
+            else:
+                extracted = await asyncio.to_thread(
+                    evaluate, result, request.extractors, request.assertions, self.resolve
+                )
+            self.variables.update(extracted)
+        return result
+
+    async def send(self, request: Request, client: httpx.AsyncClient) -> Result:
+        # Sends the request under the collection's rate limit and retry policy, without evaluating its rules.
+        attempt = 0
+        waited = 0.0
+
+        async def acquire(host: str):
+            nonlocal waited
+            waited += await self.limiter.acquire(host)
+
+        while True:
+            start = time.perf_counter()
+            before = waited
+            error = None
+            try:
+                result = await request.run(self, client, acquire)
+            except (httpx.HTTPError, OSError) as e:
+                error = e
+                result = request.failed(self, e)
+                result.elapsed = time.perf_counter() - start - (waited - before)
+            delay = self.retry.delay(attempt, result, error)
+            if delay is None:
+                break
+            if result.response_file is not None:
+                os.remove(result.response_file)
+            attempt += 1
+            await asyncio.sleep(delay)
+            waited += delay
+        result.retries = attempt
+        result.waited = waited
+        return result
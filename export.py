@@ -0,0 +1,209 @@
+import array
+import ast
+import json
+import math
+import os
+import sys
+import zlib
+
+# Columnar export of run results. Every column is a NumPy .npy file, written
+# with the standard library only, so numpy.load (optionally memory mapped)
+# reads it without parsing. Repeated strings are dictionary encoded: the
+# column holds int32 codes (-1 for none) and schema.json the labels. URLs are
+# stored Arrow style as int64 offsets into a UTF-8 blob, and response bodies
+# as raw (optionally zlib compressed) bytes in bodies.bin.
+
+FORMAT = "pyramis-columns"
+VERSION = 1
+NPY_HEADER_SIZE = 128
+FLUSH_SIZE = 8192
+ENDIAN = "<" if sys.byteorder == "little" else ">"
+DTYPES = {"d": ENDIAN + "f8", "q": ENDIAN + "i8", "i": ENDIAN + "i4", "b": "|i1", "B": "|b1"}
+
+
+class Column:
+    def __init__(self, path: str, typecode: str):
+        self.path = path
+        self.typecode = typecode
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * NPY_HEADER_SIZE)
+        self.buffer = array.array(typecode)
+        self.length = 0
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.length += len(self.buffer)
+        self.buffer.tofile(self.file)
+        self.buffer = array.array(self.typecode)
+
+    def close(self):
+        # The shape is only known at the end, so the header space is reserved up front and filled in last.
+        self.flush()
+        header = repr({"descr": DTYPES[self.typecode], "fortran_order": False, "shape": (self.length,)})
+        header = header.encode("latin1").ljust(NPY_HEADER_SIZE - 10 - 1) + b"\n"
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header)
+        self.file.close()
+
+
+class DictionaryColumn(Column):
+    def __init__(self, path: str):
+        super().__init__(path, "i")
+        self.codes: dict[str, int] = {}
+
+    def append(self, value: str | None):
+        if value is None:
+            super().append(-1)
+        else:
+            super().append(self.codes.setdefault(value, len(self.codes)))
+
+    def labels(self) -> list[str]:
+        return list(self.codes)
+
+
+class BlobColumn(Column):
+    def __init__(self, path: str, data_path: str, compress: bool = False):
+        super().__init__(path, "q")
+        self.data = open(data_path, "wb")
+        self.compress = compress
+        self.offset = 0
+        super().append(0)
+
+    def append(self, value: bytes):
+        if self.compress:
+            value = zlib.compress(value)
+        self.data.write(value)
+        self.offset += len(value)
+        super().append(self.offset)
+
+    def close(self):
+        super().close()
+        self.data.close()
+
+
+# Record key, kind and type code of every column; None values become NaN or -1.
+COLUMNS = (
+    ("collection", "dictionary", "i"),
+    ("request", "dictionary", "i"),
+    ("row", "number", "q"),
+    ("shard", "number", "i"),
+    ("method", "dictionary", "i"),
+    ("url", "blob", "q"),
+    ("status", "number", "i"),
+    ("ok", "number", "B"),
+    ("error", "dictionary", "i"),
+    ("elapsed_ms", "number", "d"),
+    ("retries", "number", "i"),
+    ("waited_ms", "number", "d"),
+    ("cache", "dictionary", "i"),
+    ("connect_ms", "number", "d"),
+    ("tls_ms", "number", "d"),
+    ("ttfb_ms", "number", "d"),
+    ("download_ms", "number", "d"),
+    ("bytes_sent", "number", "q"),
+    ("bytes_received", "number", "q"),
+    ("reused", "number", "b"),
+    ("size", "number", "q"),
+    ("timestamp", "number", "d"),
+)
+
+
+class Export:
+    def __init__(self, path: str, compress: bool = False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.compress = compress
+        self.rows = 0
+        self.columns: dict[str, Column] = {}
+        for name, kind, typecode in COLUMNS:
+            file = os.path.join(path, name + ".npy")
+            if kind == "dictionary":
+                self.columns[name] = DictionaryColumn(file)
+            elif kind == "blob":
+                self.columns[name] = BlobColumn(file, os.path.join(path, name + ".bin"))
+            else:
+                self.columns[name] = Column(file, typecode)
+        self.bodies = BlobColumn(os.path.join(path, "body.npy"), os.path.join(path, "body.bin"), compress)
+
+    def add(self, record: dict):
+        # Takes the per-request records of runner.py, or a data row holding them in "results".
+        if "results" in record:
+            for result in record["results"]:
+                self.add_result(result, record["row"])
+        else:
+            self.add_result(record, -1)
+
+    def add_result(self, record: dict, row: int):
+        body = record.pop("body", None) or b""
+        for name, kind, typecode in COLUMNS:
+            value = row if name == "row" else record.get(name)
+            if kind == "blob":
+                value = (value or "").encode("utf-8")
+            elif kind == "number" and value is None:
+                value = math.nan if typecode == "d" else -1
+            self.columns[name].append(value)
+        self.bodies.append(body)
+        self.rows += 1
+
+    def close(self):
+        schema = {"format": FORMAT, "version": VERSION, "rows": self.rows, "columns": {}}
+        for name, column in list(self.columns.items()) + [("body", self.bodies)]:
+            column.close()
+            entry = {"file": os.path.basename(column.path), "dtype": DTYPES[column.typecode]}
+            if isinstance(column, DictionaryColumn):
+                entry["labels"] = column.labels()
+            elif isinstance(column, BlobColumn):
+                entry["data"] = os.path.basename(column.data.name)
+                entry["compression"] = "zlib" if column.compress else None
+            schema["columns"][name] = entry
+        with open(os.path.join(self.path, "schema.json"), "w") as f:
+            json.dump(schema, f, indent="\t")
+
+
+def read_column(path: str) -> array.array:
+    # Reads a column without NumPy; with NumPy, numpy.load(path, mmap_mode="r") does the same.
+    with open(path, "rb") as f:
+        f.seek(8)
+        header = ast.literal_eval(f.read(int.from_bytes(f.read(2), "little")).decode("latin1"))
+        typecode = next(t for t, d in DTYPES.items() if d == header["descr"])
+        values = array.array(typecode)
+        values.fromfile(f, header["shape"][0])
+    return values
+
+
+class ExportReader:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "schema.json")) as f:
+            self.schema = json.load(f)
+        self.cache: dict[str, array.array] = {}
+
+    def __len__(self) -> int:
+        return self.schema["rows"]
+
+    def column(self, name: str) -> array.array:
+        if name not in self.cache:
+            self.cache[name] = read_column(os.path.join(self.path, self.schema["columns"][name]["file"]))
+        return self.cache[name]
+
+    def value(self, name: str, index: int):
+        column = self.schema["columns"][name]
+        if "labels" in column:
+            code = self.column(name)[index]
+            return column["labels"][code] if code >= 0 else None
+        if "data" in column:
+            data = self.blob(name, index)
+            return data if name == "body" else data.decode("utf-8")
+        return self.column(name)[index]
+
+    def blob(self, name: str, index: int) -> bytes:
+        column = self.schema["columns"][name]
+        offsets = self.column(name)
+        with open(os.path.join(self.path, column["data"]), "rb") as f:
+            f.seek(offsets[index])
+            data = f.read(offsets[index + 1] - offsets[index])
+        return zlib.decompress(data) if column["compression"] == "zlib" else data
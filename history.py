@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from executor import Result
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bodies (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    collection TEXT NOT NULL,
+    request TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    status INTEGER NOT NULL,
+    method TEXT NOT NULL,
+    url TEXT NOT NULL,
+    request_headers TEXT NOT NULL,
+    request_body TEXT REFERENCES bodies (hash),
+    response_headers TEXT NOT NULL,
+    response_body TEXT REFERENCES bodies (hash),
+    response_size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_collection ON runs (collection, request, id);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS runs_status ON runs (status, id);
+"""
+
+SUMMARY_COLUMNS = "id, collection, request, timestamp, status, method, url, response_size"
+
+
+@dataclass
+class HistoryEntry:
+    id: int
+    collection: str
+    request: str
+    timestamp: float
+    result: 'Result'
+
+
+class History:
+    def __init__(self, batch_size: int = 500):
+        self.path: str | None = None
+        self.batch_size = batch_size
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: threading.Thread | None = None
+
+    def open(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        db = self.connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+        self.thread = threading.Thread(target=self.write_loop, name="history", daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def add(self, collection: str, request: str, result: 'Result') -> None:
+        if self.thread is not None:
+            self.queue.put((collection, request, time.time(), result))
+
+    def write_loop(self) -> None:
+        db = self.connect()
+        try:
+            running = True
+            while running:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                for item in batch:
+                    if item is None:
+                        running = False
+                    else:
+                        self.write(db, *item)
+                db.commit()
+        finally:
+            db.close()
+
+    def write(self, db: sqlite3.Connection, collection: str, request: str, timestamp: float, result: 'Result') -> None:
+        db.execute(
+            "INSERT INTO runs (collection, request, timestamp, status, method, url, request_headers, request_body,"
+            " response_headers, response_body, response_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                collection,
+                request,
+                timestamp,
+                result.response_status,
+                result.request_method,
+                result.request_url,
+                json.dumps(result.request_headers),
+                self.write_body(db, result.request_payload),
+                json.dumps(result.response_headers),
+                self.write_body(db, result.response_payload),
+                result.response_size,
+            ),
+        )
+
+    @staticmethod
+    def write_body(db: sqlite3.Connection, data: bytes | None) -> str | None:
+        if not data:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        db.execute(
+            "INSERT OR IGNORE INTO bodies (hash, size, data) VALUES (?, ?, ?)",
+            (digest, len(data), zlib.compress(data)),
+        )
+        return digest
+
+    def query(self, collection: str | None = None, request: str | None = None, status: int | None = None,
+              since: float | None = None, until: float | None = None, before: int | None = None,
+              limit: int = 50) -> list[dict]:
+        if self.path is None:
+            return []
+        where = []
+        params = []
+        for column, operator, value in (
+                ("collection", "=", collection),
+                ("request", "=", request),
+                ("status", "=", status),
+                ("timestamp", ">=", since),
+                ("timestamp", "<", until),
+                ("id", "<", before),
+        ):
+            if value is not None:
+                where.append(f"{column} {operator} ?")
+                params.append(value)
+        sql = f"SELECT {SUMMARY_COLUMNS} FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        db = self.connect()
+        try:
+            columns = [c.strip() for c in SUMMARY_COLUMNS.split(",")]
+            return [dict(zip(columns, row)) for row in db.execute(sql, params)]
+        finally:
+            db.close()
+
+    def entry(self, entry_id: int) -> HistoryEntry | None:
+        from executor import Result
+        if self.path is None:
+            return None
+        db = self.connect()
+        try:
+            row = db.execute(
+                "SELECT id, collection, request, timestamp, status, method, url, request_headers, request_body,"
+                " response_headers, response_body, response_size FROM runs WHERE id = ?",
+                (entry_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            request_body = self.read_body(db, row[8])
+            response_body = self.read_body(db, row[10])
+        finally:
+            db.close()
+
+        return HistoryEntry(
+            id=row[0],
+            collection=row[1],
+            request=row[2],
+            timestamp=row[3],
+            result=Result(
+                request_method=row[5],
+                request_url=row[6],
+                request_headers=[tuple(h) for h in json.loads(row[7])],
+                request_payload=request_body,
+                response_status=row[4],
+                response_headers=[tuple(h) for h in json.loads(row[9])],
+                response_payload=response_body,
+                response_size=row[11],
+                response_truncated=row[11] > len(response_body or b""),
+            ),
+        )
+
+    @staticmethod
+    def read_body(db: sqlite3.Connection, digest: str | None) -> bytes | None:
+        if digest is None:
+            return None
+        row = db.execute("SELECT data FROM bodies WHERE hash = ?", (digest,)).fetchone()
+        return zlib.decompress(row[0]) if row else None
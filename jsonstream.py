@@ -0,0 +1,218 @@
+import codecs
+import json
+import re
+from collections.abc import Iterator
+from typing import Any
+
+STREAM_THRESHOLD = 256 * 1024
+NUMBER_PATTERN = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?")
+NUMBER_CHARS_PATTERN = re.compile(r"[-+.eE0-9]*")
+WHITESPACE_PATTERN = re.compile(r"[ \t\n\r]*")
+SCANNER = json.scanner.make_scanner(json.JSONDecoder())
+
+
+class JSONStream:
+    # Pull parser over a chunked JSON document, so a body is never held in memory as a whole.
+    def __init__(self, chunks: Iterator[bytes], threshold: int = STREAM_THRESHOLD):
+        self.chunks = chunks
+        self.threshold = threshold
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self) -> str | None:
+        if self.eof:
+            return None
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.decoder.decode(b"", final=True)
+        else:
+            text = self.decoder.decode(chunk)
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        return text
+
+    def peek(self) -> str:
+        if self.position < len(self.buffer) and self.buffer[self.position] not in " \t\n\r":
+            return self.buffer[self.position]
+        while True:
+            self.position = WHITESPACE_PATTERN.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.fill() is None:
+                return ""
+
+    def measure(self) -> tuple[Any, int] | None:
+        # Parses the next value with the C scanner if it fits within the threshold, without consuming it.
+        if self.peek() == "":
+            return None
+        while True:
+            try:
+                value, end = SCANNER(self.buffer, self.position)
+                # A number cut off by the end of the chunk ("1." of "1.5") scans as a shorter one, so the
+                # result only counts once something other than number characters follows it.
+                if self.eof or NUMBER_CHARS_PATTERN.match(self.buffer, end).end() < len(self.buffer):
+                    return value, end
+            except (json.JSONDecodeError, StopIteration):
+                if self.eof:
+                    return None
+            if len(self.buffer) - self.position > self.threshold or self.fill() is None:
+                return None
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at {self.position}")
+        self.position += 1
+
+    def string(self) -> str:
+        while True:
+            try:
+                value, self.position = json.decoder.scanstring(self.buffer, self.position + 1)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                text = self.fill()
+                while text and '"' not in text:
+                    text = self.fill()
+
+    def scalar(self) -> Any:
+        char = self.peek()
+        if char == '"':
+            return self.string()
+        if char == "":
+            raise ValueError("unexpected end of document")
+        if char in "-0123456789":
+            while True:
+                end = NUMBER_CHARS_PATTERN.match(self.buffer, self.position).end()
+                if end < len(self.buffer) or self.fill() is None:
+                    break
+            match = NUMBER_PATTERN.fullmatch(self.buffer, self.position, end)
+            if match is None:
+                raise ValueError(f"invalid number at {self.position}")
+            self.position = end
+            text = match.group(0)
+            return float(text) if "." in text or "e" in text or "E" in text else int(text)
+        while len(self.buffer) - self.position < 5 and self.fill() is not None:
+            pass
+        for literal, value in (("true", True), ("false", False), ("null", None)):
+            if self.buffer.startswith(literal, self.position):
+                self.position += len(literal)
+                return value
+        raise ValueError(f"unexpected {char!r} at {self.position}")
+
+    def members(self) -> Iterator[str]:
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError(f"expected key at {self.position}")
+            key = self.string()
+            self.expect(":")
+            yield key
+            char = self.peek()
+            self.position += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"expected ',' or '}}' at {self.position}")
+
+    def items(self) -> Iterator[int]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            char = self.peek()
+            self.position += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"expected ',' or ']' at {self.position}")
+
+    def value(self) -> Any:
+        char = self.peek()
+        if char == "{":
+            return {key: self.value() for key in self.members()}
+        if char == "[":
+            return [self.value() for _ in self.items()]
+        return self.scalar()
+
+    def skip(self) -> Any:
+        # Consumes a value and returns it, or a placeholder for containers.
+        char = self.peek()
+        if char in ("{", "["):
+            measured = self.measure()
+            if measured is not None:
+                self.position = measured[1]
+                return "{...}" if char == "{" else "[...]"
+        if char == "{":
+            for _ in self.members():
+                self.skip()
+            return "{...}"
+        if char == "[":
+            for _ in self.items():
+                self.skip()
+            return "[...]"
+        return self.scalar()
+
+    def end(self):
+        if self.peek() != "":
+            raise ValueError(f"trailing data at {self.position}")
+
+
+def select(stream: JSONStream, paths: list[tuple]) -> dict[tuple, Any]:
+    # Walks the document once, materialising only the values at the given paths.
+    tree: dict = {}
+    for path in paths:
+        node = tree
+        for key in path:
+            node = node.setdefault(key, {})
+        node[None] = True
+    selected: dict[tuple, Any] = {}
+
+    def walk(node: dict, path: tuple):
+        if None in node:
+            value = stream.value()
+            for wanted in paths:
+                if wanted[:len(path)] == path:
+                    found, nested = lookup(value, wanted[len(path):])
+                    if found:
+                        selected[wanted] = nested
+            return
+        char = stream.peek()
+        if char == "{":
+            for key in stream.members():
+                if key in node:
+                    walk(node[key], path + (key,))
+                else:
+                    stream.skip()
+        elif char == "[":
+            for index in stream.items():
+                if index in node:
+                    walk(node[index], path + (index,))
+                else:
+                    stream.skip()
+        else:
+            stream.skip()
+
+    walk(tree, ())
+    return selected
+
+
+def lookup(value: Any, path: tuple) -> tuple[bool, Any]:
+    for key in path:
+        if isinstance(key, int) and isinstance(value, list) and 0 <= key < len(value):
+            value = value[key]
+        elif isinstance(key, str) and isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            return False, None
+    return True, value
@@ -0,0 +1,144 @@
+import asyncio
+import math
+import time
+from collections.abc import Callable
+from typing import Awaitable
+
+import httpx
+
+from executor import Collection, Request, BodyOptions
+
+
+class Histogram:
+    def __init__(self, significant_digits: int = 2):
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        value = max(value, 0)
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.min = value if self.count == 0 else min(self.min, value)
+        self.max = max(self.max, value)
+        self.count += 1
+        self.total += value
+
+    def index(self, value: int) -> int:
+        magnitude = max(value.bit_length() - self.sub_bucket_bits, 0)
+        return (magnitude << self.sub_bucket_bits) + (value >> magnitude)
+
+    def highest_equivalent(self, index: int) -> int:
+        magnitude = index >> self.sub_bucket_bits
+        sub_bucket = index - (magnitude << self.sub_bucket_bits)
+        return ((sub_bucket + 1) << magnitude) - 1
+
+    def percentile(self, percentile: float) -> int:
+        if self.count == 0:
+            return 0
+        target = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.highest_equivalent(index), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class LoadStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished: float | None = None
+        self.latency = Histogram()
+        self.statuses: dict[str, int] = {}
+        self.errors = 0
+
+    def record(self, status: str, error: bool, micros: int) -> None:
+        self.latency.record(micros)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if error:
+            self.errors += 1
+
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def throughput(self) -> float:
+        elapsed = self.elapsed()
+        return self.latency.count / elapsed if elapsed > 0 else 0.0
+
+
+class Load:
+    def __init__(self, collection: Collection, iterations: int | None = None, duration: float | None = None,
+                 rate: float | None = None, concurrency: int = 1):
+        self.collection = collection
+        self.iterations = iterations
+        self.duration = duration
+        self.rate = rate
+        self.concurrency = max(concurrency, 1)
+        self.collection.body_options = BodyOptions(preview_size=0, spill=False)
+        # Load runs measure the target, so they never answer from the response cache.
+        self.collection.cache = None
+        if self.iterations is None and self.duration is None:
+            self.iterations = len(collection.requests)
+
+    async def run(self, consumer: Callable[[LoadStats], Awaitable], interval: float = 1.0) -> LoadStats:
+        requests = self.collection.ordered()
+        stats = LoadStats()
+        if not requests:
+            stats.finished = time.monotonic()
+            return stats
+
+        deadline = stats.started + self.duration if self.duration is not None else None
+        claimed = 0
+
+        def claim() -> int | None:
+            nonlocal claimed
+            if self.iterations is not None and claimed >= self.iterations:
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            claimed += 1
+            return claimed - 1
+
+        async def worker(client: httpx.AsyncClient):
+            while (iteration := claim()) is not None:
+                if self.rate:
+                    delay = stats.started + iteration / self.rate - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await self.run_one(requests[iteration % len(requests)], client, stats)
+
+        async def report():
+            while True:
+                await asyncio.sleep(interval)
+                await consumer(stats)
+
+        reporter = asyncio.ensure_future(report())
+        try:
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            async with httpx.AsyncClient(limits=limits) as client:
+                await asyncio.gather(*(worker(client) for _ in range(self.concurrency)))
+        finally:
+            reporter.cancel()
+        stats.finished = time.monotonic()
+        return stats
+
+    async def run_one(self, request: Request, client: httpx.AsyncClient, stats: LoadStats) -> None:
+        # Goes through the collection's rate limit and retries; the latency is the last attempt's, without waits.
+        start = time.perf_counter()
+        try:
+            result = await self.collection.send(request, client)
+        except Exception as e:
+            stats.record(type(e).__name__, True, int((time.perf_counter() - start) * 1_000_000))
+            return
+        micros = int(result.elapsed * 1_000_000)
+        if result.error is not None:
+            stats.record(result.error.partition(":")[0], True, micros)
+        else:
+            stats.record(str(result.response_status), result.response_status >= 400, micros)
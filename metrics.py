@@ -0,0 +1,170 @@
+import bisect
+import math
+
+# Metrics are plain dicts keyed by label values. They are only updated from the
+# event loop thread, so no locks are taken on the request path.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = {} if labels else {(): 0.0}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + value
+
+    def samples(self) -> list[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        return [(self.name, self.labels, labels, value) for labels, value in sorted(self.values.items())]
+
+    def take(self) -> dict[tuple[str, ...], float]:
+        values = {labels: value for labels, value in self.values.items() if value}
+        self.values = {} if self.labels else {(): 0.0}
+        return values
+
+    def add(self, values: dict[tuple[str, ...], float]) -> None:
+        for labels, value in values.items():
+            self.inc(*labels, value=value)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, value: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) - value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Per label set: one count per bucket plus +Inf, then the sum of all observations.
+        self.values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def take(self) -> dict[tuple[str, ...], list[float]]:
+        values, self.values = self.values, {}
+        return values
+
+    def add(self, values: dict[tuple[str, ...], list[float]]) -> None:
+        for labels, counts in values.items():
+            current = self.values.get(labels)
+            if current is None:
+                self.values[labels] = list(counts)
+            else:
+                for i, count in enumerate(counts):
+                    current[i] += count
+
+    def samples(self) -> list[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        samples = []
+        for labels, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", self.labels + ("le",), labels + (format_value(bound),),
+                                cumulative))
+            samples.append((self.name + "_sum", self.labels, labels, counts[-1]))
+            samples.append((self.name + "_count", self.labels, labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Counter | Gauge | Histogram] = []
+
+    def counter(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def take(self) -> dict[str, dict]:
+        # Moves what a worker process recorded so far out of its registry, to be added to the parent's.
+        # Gauges describe the worker's own state, so they stay behind.
+        taken = {}
+        for metric in self.metrics:
+            if metric.kind != "gauge":
+                values = metric.take()
+                if values:
+                    taken[metric.name] = values
+        return taken
+
+    def add(self, taken: dict[str, dict]) -> None:
+        for metric in self.metrics:
+            if metric.name in taken:
+                metric.add(taken[metric.name])
+
+    def render(self) -> str:
+        # Prometheus text exposition format, version 0.0.4.
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, names, values, value in metric.samples():
+                if names:
+                    labels = ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
+                    lines.append(f"{name}{{{labels}}} {format_value(value)}")
+                else:
+                    lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+METRICS = Registry()
+
+REQUESTS = METRICS.counter(
+    "pyramis_requests_total", "Requests sent by the executor.", ("collection", "host", "status"))
+REQUEST_DURATION = METRICS.histogram(
+    "pyramis_request_duration_seconds", "Time from sending a request until its body was read.",
+    ("collection", "host"))
+REQUESTS_IN_FLIGHT = METRICS.gauge(
+    "pyramis_requests_in_flight", "Requests being sent or read right now.")
+BYTES_SENT = METRICS.counter(
+    "pyramis_request_bytes_sent_total", "Approximate request bytes on the wire.", ("collection", "host"))
+BYTES_RECEIVED = METRICS.counter(
+    "pyramis_request_bytes_received_total", "Approximate response bytes on the wire.", ("collection", "host"))
+CACHE_LOOKUPS = METRICS.counter(
+    "pyramis_cache_lookups_total", "Response cache lookups by outcome (hit, revalidated, miss).",
+    ("collection", "outcome"))
+RUNS_IN_FLIGHT = METRICS.gauge(
+    "pyramis_runs_in_flight", "Collection runs, diffs and load runs started from the UI and not finished yet.",
+    ("kind",))
+WEBSOCKETS = METRICS.gauge(
+    "pyramis_websocket_connections", "Open WebSocket connections.")
+PAGE_DURATION = METRICS.histogram(
+    "pyramis_page_render_seconds", "Time to build and render a page, by template.", ("template",))
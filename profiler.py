@@ -0,0 +1,185 @@
+import asyncio
+import os
+import selectors
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+
+# A sampling profiler for the server's event loop. A background thread looks
+# at the loop thread's stack every interval and charges the wall and CPU time
+# that passed since the previous sample to that stack, under the activities
+# (HTTP handler, rendered template, WebSocket event, collection) of the task
+# that was running. Nothing is hooked into the profiled code: the cost is one
+# stack walk per sample, in the sampler thread.
+#
+# Stacks are written in the collapsed format ("frame;frame;frame value") read
+# by flamegraph.pl, inferno and speedscope, with the activities as the
+# outermost frames and values in microseconds.
+
+INTERVAL = 0.01
+IDLE = "(idle)"
+EVENT_LOOP = "(event loop)"
+UNLABELLED = "(unlabelled)"
+HANDLE_RUN = asyncio.events.Handle._run.__code__
+
+# Activities of each task; tasks created while one runs inherit its activities.
+LABELS: 'weakref.WeakKeyDictionary[asyncio.Task, tuple[str, ...]]' = weakref.WeakKeyDictionary()
+
+
+@contextmanager
+def activity(name: str):
+    task = asyncio.current_task()
+    if task is None:
+        yield
+        return
+    labels = LABELS.get(task, ())
+    LABELS[task] = labels + (name.replace(";", ","),)
+    try:
+        yield
+    finally:
+        LABELS[task] = labels
+
+
+def task_factory(loop: asyncio.AbstractEventLoop, coro, **kwargs) -> asyncio.Task:
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    parent = asyncio.current_task(loop)
+    if parent is not None:
+        labels = LABELS.get(parent)
+        if labels:
+            LABELS[task] = labels
+    return task
+
+
+class Profiler:
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.ident: int | None = None
+        self.interval = INTERVAL
+        self.thread: threading.Thread | None = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.names: dict[object, str] = {}
+        self.reset()
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        # Must be called from the loop's thread, before the tasks to attribute are created.
+        self.loop = loop
+        self.ident = threading.get_ident()
+        loop.set_task_factory(task_factory)
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def reset(self):
+        with self.lock:
+            self.wall: Counter[tuple[tuple[str, ...], tuple[str, ...]]] = Counter()
+            self.cpu: Counter[tuple[tuple[str, ...], tuple[str, ...]]] = Counter()
+            self.samples = 0
+            self.duration = 0.0
+            self.overhead = 0.0
+            self.started: float | None = None
+
+    def start(self, interval: float | None = None):
+        if self.loop is None:
+            raise Exception("profiler is not attached to an event loop")
+        if self.running:
+            return
+        self.reset()
+        self.interval = interval or INTERVAL
+        self.started = time.time()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.sample, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        thread, self.thread = self.thread, None
+        if thread is None:
+            return
+        self.stopping.set()
+        thread.join()
+
+    def sample(self):
+        clock = cpu_clock(self.ident)
+        wall = time.perf_counter()
+        cpu = time.clock_gettime(clock) if clock is not None else 0.0
+        start = wall
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            task = asyncio.current_task(self.loop)
+            now = time.perf_counter()
+            cpu_now = time.clock_gettime(clock) if clock is not None else 0.0
+            if frame is None:
+                break
+            key = self.stack(frame, task)
+            del frame
+            with self.lock:
+                self.wall[key] += int((now - wall) * 1e6)
+                self.cpu[key] += int((cpu_now - cpu) * 1e6)
+                self.samples += 1
+                self.duration = now - start
+                self.overhead = time.thread_time()
+            wall, cpu = now, cpu_now
+
+    def stack(self, frame, task: asyncio.Task | None) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        if task is None and frame.f_code.co_name == "select" and frame.f_code.co_filename == selectors.__file__:
+            return (IDLE,), ()
+        frames = []
+        while frame is not None and frame.f_code is not HANDLE_RUN:
+            frames.append(self.name(frame.f_code))
+            frame = frame.f_back
+        frames.reverse()
+        if task is None:
+            return (EVENT_LOOP,), tuple(frames)
+        return LABELS.get(task) or (UNLABELLED,), tuple(frames)
+
+    def name(self, code) -> str:
+        name = self.names.get(code)
+        if name is None:
+            name = self.names[code] = \
+                f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+        return name
+
+    def collapsed(self, kind: str = "wall") -> str:
+        with self.lock:
+            values = list((self.cpu if kind == "cpu" else self.wall).items())
+        return "".join(f"{';'.join(labels + frames)} {value}\n" for (labels, frames), value in values if value > 0)
+
+    def summary(self) -> dict:
+        with self.lock:
+            wall = list(self.wall.items())
+            cpu = dict(self.cpu)
+            samples, duration, overhead, started = self.samples, self.duration, self.overhead, self.started
+        activities: dict[tuple[str, ...], list[int]] = {}
+        for key, value in wall:
+            totals = activities.setdefault(key[0], [0, 0])
+            totals[0] += value
+            totals[1] += cpu[key]
+        return {
+            "running": self.running,
+            "interval": self.interval * 1000,
+            "started": started,
+            "duration": duration,
+            "samples": samples,
+            "overhead": overhead,
+            "cpu": cpu_clock(self.ident) is not None if self.ident is not None else False,
+            "activities": [{
+                "activity": " > ".join(labels),
+                "wall_ms": wall_us / 1000,
+                "cpu_ms": cpu_us / 1000,
+            } for labels, (wall_us, cpu_us) in sorted(activities.items(), key=lambda a: -a[1][0])],
+        }
+
+
+PROFILER = Profiler()
+
+
+def cpu_clock(ident: int) -> int | None:
+    # The CPU clock of another thread is only available where pthread_getcpuclockid is.
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
@@ -1,34 +1,68 @@
+import asyncio
 import getopt
+import os
 import sys
 import webbrowser
-from http.server import ThreadingHTTPServer
 
+from profiler import PROFILER
+from server import shutdown, HISTORY, TEMPLATES
 from server.handler import HTTPHandler
 
 
+USAGE = ' -h <host> -p <port> --history <path> --profile'
+HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".pyramis", "history.sqlite3")
+
+
 def main(name: str, argv: list[str]):
     port = 8041
     host = '127.0.0.1'
+    history = HISTORY_PATH
+    profile = False
 
     try:
-        opts, args = getopt.getopt(argv, "?h:p:", ["host=", "port="])
+        opts, args = getopt.getopt(argv, "?h:p:", ["host=", "port=", "history=", "profile"])
     except getopt.GetoptError:
-        print(name + ' -h <host> -p <port>')
+        print(name + USAGE)
         sys.exit(2)
 
     for opt, arg in opts:
         if opt == '-?':
-            print(name + ' -h <host> -p <port>')
+            print(name + USAGE)
             sys.exit()
         elif opt in ("-h", "--host"):
             host = host
         elif opt in ("-p", "--port"):
             port = int(arg)
+        elif opt == "--history":
+            history = arg
+        elif opt == "--profile":
+            profile = True
 
+    if history:
+        HISTORY.open(history)
+
+    try:
+        asyncio.run(serve(host, port, profile))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve(host: str, port: int, profile: bool = False):
     print(f"Starting server on http://{host}:{port}")
-    httpd = ThreadingHTTPServer(("", port), HTTPHandler)
+    # Attached before the first connection, so every handler's tasks carry their activity.
+    PROFILER.attach(asyncio.get_running_loop())
+    if profile:
+        PROFILER.start()
+    httpd = await asyncio.start_server(HTTPHandler.serve, None, port)
     webbrowser.open_new_tab(f"http://{host}:{port}")
-    httpd.serve_forever()
+    # Compiles the templates while the browser loads the page, instead of on its first fragment.
+    warm = asyncio.get_running_loop().run_in_executor(None, TEMPLATES.warm)
+    try:
+        async with httpd:
+            await httpd.serve_forever()
+    finally:
+        warm.cancel()
+        await shutdown()
 
 
 if __name__ == "__main__":
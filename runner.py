@@ -0,0 +1,330 @@
+import getopt
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from collections.abc import Callable
+
+from cache import CACHES
+from dataset import read_rows, completed_rows, run_rows
+from executor import BodyOptions, Collection, RateLimiter, Request, Result, Timings, CLIENTS
+from export import Export
+from storage import read_collection, build_collection
+from workers import run, shard
+
+
+USAGE = ' [-j <jobs>] [-c <concurrency>] [-r <request>]... [-v <name>=<value>]... --junit <path> --jsonl <path>' \
+        ' [--export <dir> [--compress]] <collection>\n' \
+        '    or [-j <jobs>] [-c <concurrency>] [-p <rows>] --data <csv|jsonl> --output <path> [--start <row>] [--resume]' \
+        ' [--export <dir> [--compress]] <collection>'
+
+
+def main(name: str, argv: list[str]):
+    jobs = 1
+    concurrency = 1
+    requests = []
+    variables = {}
+    junit = None
+    jsonl = None
+    data = None
+    output = None
+    parallel = 1
+    start = 0
+    resume = False
+    export = None
+    compress = False
+
+    try:
+        opts, args = getopt.getopt(argv, "?j:c:r:v:d:o:p:", [
+            "jobs=", "concurrency=", "request=", "var=", "junit=", "jsonl=",
+            "data=", "output=", "parallel=", "start=", "resume", "export=", "compress",
+        ])
+    except getopt.GetoptError:
+        print(name + USAGE)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-?':
+            print(name + USAGE)
+            sys.exit()
+        elif opt in ("-j", "--jobs"):
+            jobs = max(int(arg), 1)
+        elif opt in ("-c", "--concurrency"):
+            concurrency = max(int(arg), 1)
+        elif opt in ("-r", "--request"):
+            requests.append(arg)
+        elif opt in ("-v", "--var"):
+            key, _, value = arg.partition("=")
+            variables[key] = value
+        elif opt == "--junit":
+            junit = arg
+        elif opt == "--jsonl":
+            jsonl = arg
+        elif opt in ("-d", "--data"):
+            data = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt in ("-p", "--parallel"):
+            parallel = max(int(arg), 1)
+        elif opt == "--start":
+            start = max(int(arg), 0)
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--export":
+            export = arg
+        elif opt == "--compress":
+            compress = True
+
+    if len(args) != 1 or not os.path.isdir(args[0]) or data and (not output or junit or jsonl):
+        print(name + USAGE)
+        sys.exit(2)
+    collection = args[0].rstrip(os.sep) or args[0]
+
+    if not requests:
+        requests = [r["name"] for r in read_collection(collection)["requests"]]
+
+    # Bodies only travel from the workers when they are exported.
+    exported = Export(export, compress) if export else None
+
+    def emit(add: Callable[[dict], None]) -> Callable[[dict], None]:
+        if exported is None:
+            return add
+
+        def export_and_add(record: dict):
+            exported.add(record)
+            add(record)
+
+        return export_and_add
+
+    if data:
+        done = set()
+        if resume:
+            resumed, done = completed_rows(output)
+            start = max(start, resumed)
+        rows = RowReport(collection, output, append=resume or start > 0)
+        try:
+            ok = run(run_rows_shard, [
+                (collection, requests, concurrency, variables, jobs, data, i, parallel, start, done, bool(export))
+                for i in range(jobs)
+            ], emit(rows.add))
+        except KeyboardInterrupt:
+            ok = False
+        rows.close()
+        if exported is not None:
+            exported.close()
+        print(rows.summary())
+        sys.exit(0 if ok and rows.failed == 0 else 1)
+
+    shards = shard(build_collection(collection, requests).requests, jobs)
+    report = Report(collection)
+    try:
+        ok = run(run_shard, [
+            (collection, shard_requests, concurrency, variables, len(shards), i, bool(export))
+            for i, shard_requests in enumerate(shards)
+        ], emit(report.add))
+    except KeyboardInterrupt:
+        ok = False
+    report.finish()
+    if exported is not None:
+        exported.close()
+
+    if junit:
+        report.write_junit(junit)
+    if jsonl:
+        report.write_jsonl(jsonl)
+    print(report.summary())
+    sys.exit(0 if ok and report.ok() else 1)
+
+
+def prepare(collection: str, requests: list[str], concurrency: int, variables: dict[str, str],
+            jobs: int, bodies: bool = False) -> Collection:
+    c = build_collection(collection, requests, concurrency)
+    c.variables.update(variables)
+    # Bodies are only spilled to files where rules or the export have to see all of them.
+    spill = c.body_options.spill and (bodies or any(r.extractors or r.assertions for r in c.requests))
+    c.body_options = BodyOptions(preview_size=c.body_options.preview_size, spill=spill)
+    if jobs > 1:
+        c.limiter = RateLimiter(c.limiter.options.share(jobs))
+    return c
+
+
+async def run_shard(collection: str, requests: list[str], concurrency: int, variables: dict[str, str], jobs: int,
+                    index: int, bodies: bool, emit: Callable[[dict], None]):
+    c = prepare(collection, requests, concurrency, variables, jobs, bodies)
+
+    async def consume(request: Request, result: Result):
+        try:
+            emit(result_to_record(collection, request.name, index, result, bodies))
+        finally:
+            discard(result)
+
+    try:
+        await c.run(consume)
+    finally:
+        await CLIENTS.close()
+        CACHES.close()
+
+
+async def run_rows_shard(collection: str, requests: list[str], concurrency: int, variables: dict[str, str],
+                         jobs: int, data: str, index: int, parallel: int, start: int, done: set[int], bodies: bool,
+                         emit: Callable[[dict], None]):
+    c = prepare(collection, requests, concurrency, variables, jobs, bodies)
+    rows = ((i, row) for i, row in read_rows(data, start, index, jobs) if i not in done)
+
+    async def consume(row_index: int, row: dict[str, str], results: list[tuple[Request, Result]]):
+        try:
+            records = [result_to_record(collection, request.name, index, result, bodies) for request, result in results]
+        finally:
+            for _, result in results:
+                discard(result)
+        emit({
+            "row": row_index,
+            "shard": index,
+            "ok": all(r["ok"] for r in records),
+            "variables": row,
+            "results": records,
+        })
+
+    try:
+        await run_rows(c, rows, parallel, consume)
+    finally:
+        await CLIENTS.close()
+        CACHES.close()
+
+
+def result_to_record(collection: str, request: str, index: int, result: Result, body: bool = False) -> dict:
+    timings = result.timings or Timings()
+    record = {
+        "collection": os.path.basename(collection),
+        "request": request,
+        "shard": index,
+        "method": result.request_method,
+        "url": result.request_url,
+        "status": result.response_status,
+        "ok": result.ok(),
+        "error": result.error,
+        "assertions": [{"rule": a.rule, "passed": a.passed, "actual": a.actual} for a in result.assertions],
+        "elapsed_ms": round(result.elapsed * 1000, 3),
+        "retries": result.retries,
+        "waited_ms": round(result.waited * 1000, 3),
+        "cache": result.cache,
+        "connect_ms": ms(timings.connect),
+        "tls_ms": ms(timings.tls),
+        "ttfb_ms": ms(timings.ttfb),
+        "download_ms": ms(timings.download),
+        "bytes_sent": timings.bytes_sent,
+        "bytes_received": timings.bytes_received,
+        "reused": timings.reused if result.timings else None,
+        "size": result.response_size,
+        "timestamp": time.time(),
+    }
+    if body:
+        # Raw bytes for the export; taken out again before the record is written as JSON.
+        record["body"] = b"".join(result.chunks())
+    return record
+
+
+def discard(result: Result):
+    if result.response_file is not None:
+        os.remove(result.response_file)
+
+
+def ms(seconds: float | None) -> float | None:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+class Report:
+    def __init__(self, collection: str):
+        self.name = os.path.basename(collection)
+        self.records: list[dict] = []
+        self.start = time.time()
+        self.elapsed = 0.0
+
+    def add(self, record: dict):
+        self.records.append(record)
+        print(f"{'ok' if record['ok'] else 'FAIL':4} {record['status'] or '---':>3} {record['elapsed_ms']:10.1f} ms"
+              f"  {record['request']}{'  ' + record['error'] if record['error'] else ''}", flush=True)
+
+    def finish(self):
+        self.elapsed = time.time() - self.start
+
+    def ok(self) -> bool:
+        return all(r["ok"] for r in self.records)
+
+    def summary(self) -> str:
+        failed = sum(1 for r in self.records if not r["ok"])
+        retries = sum(r["retries"] for r in self.records)
+        return f"{self.name}: {len(self.records)} requests, {failed} failed, {retries} retries in {self.elapsed:.2f}s"
+
+    def write_jsonl(self, path: str):
+        with open(path, "w") as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+
+    def write_junit(self, path: str):
+        errors = sum(1 for r in self.records if r["error"])
+        failures = sum(1 for r in self.records if not r["ok"] and not r["error"])
+        suite = ElementTree.Element("testsuite", {
+            "name": self.name,
+            "tests": str(len(self.records)),
+            "failures": str(failures),
+            "errors": str(errors),
+            "time": f"{self.elapsed:.3f}",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start)),
+        })
+        for record in self.records:
+            case = ElementTree.SubElement(suite, "testcase", {
+                "classname": self.name,
+                "name": record["request"],
+                "time": f"{record['elapsed_ms'] / 1000:.3f}",
+            })
+            if record["error"]:
+                ElementTree.SubElement(case, "error", {"message": record["error"]})
+            elif not record["ok"]:
+                failed = [a for a in record["assertions"] if not a["passed"]]
+                ElementTree.SubElement(case, "failure", {
+                    "message": ", ".join(a["rule"] for a in failed) if failed else f"HTTP {record['status']}",
+                }).text = "\n".join(
+                    [f"{record['method']} {record['url']} -> {record['status']}"]
+                    + [f"{a['rule']}: got {a['actual'] if a['actual'] is not None else 'nothing'}" for a in failed]
+                )
+        ElementTree.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+class RowReport:
+    def __init__(self, collection: str, path: str, append: bool = False):
+        self.name = os.path.basename(collection)
+        if append and os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        else:
+            torn = False
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+        if torn:
+            self.file.write("\n")
+        self.rows = 0
+        self.failed = 0
+        self.start = time.time()
+
+    def add(self, record: dict):
+        # One line per row, flushed as it completes, so an interrupted run can be resumed.
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.rows += 1
+        if not record["ok"]:
+            self.failed += 1
+        elapsed = sum(r["elapsed_ms"] for r in record["results"])
+        print(f"{'ok' if record['ok'] else 'FAIL':4} row {record['row']:>8} {len(record['results']):>4} requests"
+              f" {elapsed:10.1f} ms", flush=True)
+
+    def close(self):
+        self.file.close()
+
+    def summary(self) -> str:
+        return f"{self.name}: {self.rows} rows, {self.failed} failed in {time.time() - self.start:.2f}s"
+
+
+if __name__ == "__main__":
+    main(sys.argv[0], sys.argv[1:])
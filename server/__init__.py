@@ -1,16 +1,125 @@
 import asyncio
+import datetime
 import json
 import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Coroutine, TYPE_CHECKING
 
-from jinja2 import Environment, PackageLoader, select_autoescape
+from history import History, HistoryEntry
+from storage import INDEX, read_collection, build_collection
 
-from executor import Collection, Request, Result
+if TYPE_CHECKING:
+    from jinja2 import Environment, Template
+    from diff import Change, ResultDiff
+    from executor import Result, Timings
+    from load import LoadStats
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-ENV = Environment(
-    loader=PackageLoader("server", "templates"),
-    autoescape=select_autoescape(),
-)
+
+
+class Templates:
+    # Jinja is imported on the first render rather than at startup. Compiled
+    # templates are kept in Jinja's on-disk bytecode cache between runs.
+    def __init__(self):
+        self.env: 'Environment | None' = None
+        self.lock = threading.Lock()
+
+    def environment(self) -> 'Environment':
+        with self.lock:
+            if self.env is None:
+                from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader, select_autoescape
+                self.env = Environment(
+                    loader=PackageLoader("server", "templates"),
+                    autoescape=select_autoescape(),
+                    bytecode_cache=FileSystemBytecodeCache(),
+                )
+            return self.env
+
+    def get(self, name: str) -> 'Template':
+        return self.environment().get_template(name)
+
+    def warm(self):
+        env = self.environment()
+        for name in env.list_templates():
+            env.get_template(name)
+
+
+TEMPLATES = Templates()
+
+
+class BodyStore:
+    def __init__(self, limit: int = 100):
+        self.limit = limit
+        self.paths: OrderedDict[str, str] = OrderedDict()
+
+    def add(self, path: str) -> str:
+        body = uuid.uuid4().hex
+        self.paths[body] = path
+        while len(self.paths) > self.limit:
+            self.remove(self.paths.popitem(last=False)[1])
+        return body
+
+    def get(self, body: str) -> str | None:
+        return self.paths.get(body)
+
+    def clear(self):
+        paths, self.paths = self.paths, OrderedDict()
+        for path in paths.values():
+            self.remove(path)
+
+    @staticmethod
+    def remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ChangeFeed:
+    # Pushes small change events to every subscribed UI connection, so pages
+    # patch the affected nodes instead of re-rendering whole fragments.
+    def __init__(self):
+        self.subscribers: set[Callable[[str], Coroutine]] = set()
+        # Sends in flight; the loop only keeps weak references to tasks.
+        self.tasks: set[asyncio.Task] = set()
+
+    def subscribe(self, send: Callable[[str], Coroutine]):
+        self.subscribers.add(send)
+
+    def unsubscribe(self, send: Callable[[str], Coroutine]):
+        self.subscribers.discard(send)
+
+    def publish(self, typ: str, data: dict):
+        if not self.subscribers:
+            return
+        msg = json.dumps({"type": typ, "data": data})
+        for send in list(self.subscribers):
+            task = asyncio.ensure_future(send(msg))
+            self.tasks.add(task)
+            task.add_done_callback(lambda t, send=send: self.sent(t, send))
+
+    def sent(self, task: asyncio.Task, send: Callable[[str], Coroutine]):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.unsubscribe(send)
+
+
+BODIES = BodyStore()
+HISTORY = History()
+CHANGES = ChangeFeed()
+
+
+async def shutdown():
+    from cache import CACHES
+    from executor import CLIENTS
+    from profiler import PROFILER
+    PROFILER.stop()
+    BODIES.clear()
+    CACHES.close()
+    await CLIENTS.close()
+    await asyncio.to_thread(HISTORY.close)
 
 
 def read_collections(collections: list[str]):
@@ -19,94 +128,158 @@ def read_collections(collections: list[str]):
     }
 
 
-def read_collection(collection: str | None) -> dict:
-    if collection is None:
-        return {
-            "name": "",
-            "collection": "",
-            "variables": [],
-            "requests": []
-        }
+async def run_request_async(collection: str, request: str) -> dict:
+    result = await build_collection(collection, []).run_single(INDEX.built(collection, request))
+    record_result(collection, request, result)
+    return result_to_dict(result)
 
-    requests = []
-    path = os.path.join(collection, "requests")
-    if os.path.isdir(path):
-        requests = [
-            {"name": r} for r in os.listdir(path) if os.path.isdir(os.path.join(path, r))
-        ]
-    meta = {}
-    try:
-        with open(os.path.join(collection, "meta.json"), "r") as f:
-            meta = json.load(f)
-    except FileNotFoundError:
-        pass
 
-    return {
-        "name": os.path.basename(collection),
+def record_result(collection: str, request: str, result: 'Result'):
+    HISTORY.add(collection, request, result)
+    CHANGES.publish("result-appended", {
         "collection": collection,
-        "variables": meta.get("variables", []),
-        "requests": requests
+        "request": request,
+        "status": result.response_status,
+        "ok": result.ok(),
+        "elapsed": round(result.elapsed * 1000, 3),
+    })
+
+
+def result_to_dict(result: 'Result') -> dict:
+    return {
+        "request_method": result.request_method,
+        "request_url": result.request_url,
+        "request_headers": format_headers(result.request_headers),
+        "request_payload": result.request_payload.decode("utf-8", "replace") if result.request_payload else None,
+        "response_status": result.response_status,
+        "response_headers": format_headers(result.response_headers),
+        "response_payload": result.response_payload.decode("utf-8", "replace") if result.response_payload else None,
+        "response_size": result.response_size,
+        "response_truncated": result.response_truncated,
+        "response_body": BODIES.add(result.response_file) if result.response_file else None,
+        "elapsed": round(result.elapsed * 1000, 3),
+        "error": result.error,
+        "timings": timings_to_dict(result.timings) if result.timings else None,
+        "ok": result.ok(),
+        "assertions": [
+            {"rule": a.rule, "passed": a.passed, "actual": a.actual}
+            for a in result.assertions
+        ],
+        "extracted": result.extracted,
+        "retries": result.retries,
+        "waited": round(result.waited * 1000, 3),
+        "cache": result.cache,
+        "cache_age": round(result.cache_age, 3) if result.cache_age is not None else None,
     }
 
 
-def read_request(collection: str, request: str | None) -> dict:
-    if request is None:
-        return {
-            "collection": collection,
-            "request": "",
-            "method": "",
-            "url": "",
-            "headers": [],
-            "payload": "",
-        }
+def timings_to_dict(timings: 'Timings') -> dict:
+    return {
+        "connect": round(timings.connect * 1000, 3) if timings.connect is not None else None,
+        "tls": round(timings.tls * 1000, 3) if timings.tls is not None else None,
+        "ttfb": round(timings.ttfb * 1000, 3) if timings.ttfb is not None else None,
+        "download": round(timings.download * 1000, 3) if timings.download is not None else None,
+        "bytes_sent": timings.bytes_sent,
+        "bytes_received": timings.bytes_received,
+        "reused": timings.reused,
+    }
 
-    path = os.path.join(collection, "requests", request)
-    with open(os.path.join(path, "meta.json"), "r") as f:
-        meta = json.load(f)
 
-    payload = ""
-    if os.path.isfile(os.path.join(path, "payload.data")):
-        with open(os.path.join(path, "payload.data"), "r") as f:
-            payload = f.read()
+def diff_to_dict(diff: 'ResultDiff') -> dict:
+    return {
+        "request": diff.request,
+        "same": diff.same(),
+        "left_status": diff.left_status,
+        "right_status": diff.right_status,
+        "elapsed": round(diff.elapsed * 1000, 3),
+        "ttfb": round(diff.ttfb * 1000, 3) if diff.ttfb is not None else None,
+        "headers": [change_to_dict(c) for c in diff.headers],
+        "body": [change_to_dict(c) for c in diff.body],
+        "changes": diff.changes,
+        "json": diff.json,
+        "partial": diff.partial,
+    }
+
 
+def change_to_dict(change: 'Change') -> dict:
     return {
-        "collection": collection,
-        "request": request,
-        "method": meta.get("method", ""),
-        "url": meta.get("url", ""),
-        "headers": meta.get("headers", []),
-        "payload": payload,
+        "path": change.path,
+        "kind": change.kind,
+        "left": change.left,
+        "right": change.right,
+    }
+
+
+def history_summary_to_dict(summary: dict) -> dict:
+    return summary | {
+        "time": datetime.datetime.fromtimestamp(summary["timestamp"]).isoformat(sep=" ", timespec="seconds"),
     }
 
 
-def run_request(collection: str, request: str) -> dict:
-    return asyncio.run(run_request_async(collection, request))
+def history_entry_to_dict(entry: HistoryEntry) -> dict:
+    return result_to_dict(entry.result) | {
+        "id": entry.id,
+        "collection": entry.collection,
+        "request": entry.request,
+        "time": datetime.datetime.fromtimestamp(entry.timestamp).isoformat(sep=" ", timespec="seconds"),
+    }
 
 
-async def run_request_async(collection: str, request: str) -> dict:
-    collection_read = read_collection(collection)
-    request_read = read_request(collection, request)
-    return result_to_dict(await Collection(
-        variables={v["name"]: v["value"] for v in collection_read["variables"] if v["enabled"]},
-        requests=[],
-    ).run_single(Request(
-        name=request,
-        method=request_read["method"],
-        url=request_read["url"],
-        headers=[(h["name"], h["value"]) for h in request_read["headers"] if h["enabled"]],
-        payload=request_read["payload"] if request_read["payload"] else None,
-    )))
-
-
-def result_to_dict(result: Result) -> dict:
+async def read_history(query: dict) -> dict:
+    limit = int(query.get("limit") or 50)
+    rows = await asyncio.to_thread(
+        HISTORY.query,
+        collection=query.get("collection") or None,
+        request=query.get("request") or None,
+        status=int(query["status"]) if query.get("status") else None,
+        before=int(query["before"]) if query.get("before") else None,
+        limit=limit,
+    )
     return {
-        "request_method": result.request_method,
-        "request_url": result.request_url,
-        "request_headers": format_headers(result.request_headers),
-        "request_payload": result.request_payload.decode("utf-8") if result.request_payload else None,
-        "response_status": result.response_status,
-        "response_headers": format_headers(result.response_headers),
-        "response_payload": result.response_payload.decode("utf-8") if result.response_payload else None,
+        "collection": query.get("collection") or "",
+        "request": query.get("request") or "",
+        "status": query.get("status") or "",
+        "entries": [history_summary_to_dict(r) for r in rows],
+        "next": rows[-1]["id"] if len(rows) == limit else None,
+    }
+
+
+async def read_history_entry(entry_id: int) -> dict:
+    entry = await asyncio.to_thread(HISTORY.entry, entry_id)
+    if entry is None:
+        raise Exception(f"history entry not found: {entry_id}")
+    return history_entry_to_dict(entry)
+
+
+def load_stats_to_dict(stats: 'LoadStats') -> dict:
+    return {
+        "iterations": stats.latency.count,
+        "errors": stats.errors,
+        "statuses": stats.statuses,
+        "elapsed": round(stats.elapsed(), 3),
+        "throughput": round(stats.throughput(), 2),
+        "latency": {
+            "min": stats.latency.min / 1000,
+            "mean": round(stats.latency.mean() / 1000, 3),
+            "p50": stats.latency.percentile(50) / 1000,
+            "p90": stats.latency.percentile(90) / 1000,
+            "p99": stats.latency.percentile(99) / 1000,
+            "max": stats.latency.max / 1000,
+        },
+    }
+
+
+def client_stats_to_dict() -> dict:
+    from executor import CLIENTS
+    return {
+        name: {
+            "clients": stats.clients,
+            "requests": stats.requests,
+            "connections": stats.connections,
+            "reused": stats.reused(),
+            "tls_handshakes": stats.tls_handshakes,
+        }
+        for name, stats in CLIENTS.stats.items()
     }
 
 
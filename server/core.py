@@ -0,0 +1,185 @@
+import asyncio
+import email.parser
+import email.utils
+import html
+import http.client
+import logging
+import mimetypes
+import os
+import posixpath
+import sys
+import time
+import urllib.parse
+from http import HTTPStatus
+
+from profiler import activity
+
+MAX_HEADERS = 100
+
+
+class AsyncHTTPRequestHandler:
+    server_version = "pyramis"
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, directory: str | None = None):
+        self.reader = reader
+        self.writer = writer
+        self.directory = directory or os.getcwd()
+        self.command = ""
+        self.path = ""
+        self.request_version = ""
+        self.requestline = ""
+        self.headers = http.client.HTTPMessage()
+        self.close_connection = True
+        self.buffer: list[bytes] = []
+
+    @classmethod
+    async def serve(cls, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while await cls(reader, writer).handle_one_request():
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def handle_one_request(self) -> bool:
+        line = await self.reader.readline()
+        if not line:
+            return False
+
+        self.requestline = line.decode("iso-8859-1").rstrip("\r\n")
+        words = self.requestline.split()
+        if len(words) != 3 or not words[2].startswith("HTTP/"):
+            self.send_error(HTTPStatus.BAD_REQUEST, f"Bad request syntax ({self.requestline!r})")
+            return False
+        self.command, self.path, self.request_version = words
+
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            lines.append(line)
+            if len(lines) > MAX_HEADERS:
+                self.send_error(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                return False
+        self.headers = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(b"".join(lines))
+
+        connection = self.headers.get("Connection", "").lower()
+        if self.request_version == "HTTP/1.1":
+            self.close_connection = connection == "close"
+        else:
+            self.close_connection = connection != "keep-alive"
+
+        method = getattr(self, "do_" + self.command, None)
+        if method is None:
+            self.send_error(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({self.command!r})")
+        else:
+            with activity(f"{self.command} {self.path.split('?', 1)[0]}"):
+                await method()
+        await self.writer.drain()
+        return not self.close_connection
+
+    async def read_payload(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return await self.reader.readexactly(length) if length > 0 else b""
+
+    def send_response(self, code: int, message: str | None = None):
+        self.log_request(code)
+        if message is None:
+            message = HTTPStatus(code).phrase if code in HTTPStatus._value2member_map_ else ""
+        self.buffer.append(f"{self.protocol_version} {code} {message}\r\n".encode("latin-1", "strict"))
+        self.send_header("Server", self.server_version)
+        self.send_header("Date", email.utils.formatdate(time.time(), usegmt=True))
+
+    def send_header(self, keyword: str, value: str):
+        self.buffer.append(f"{keyword}: {value}\r\n".encode("latin-1", "strict"))
+        if keyword.lower() == "connection" and value.lower() == "close":
+            self.close_connection = True
+
+    def end_headers(self):
+        self.buffer.append(b"\r\n")
+        self.writer.write(b"".join(self.buffer))
+        self.buffer = []
+
+    def write(self, data: bytes):
+        self.writer.write(data)
+
+    def send_error(self, code: int, message: str | None = None):
+        status = HTTPStatus(code)
+        body = (
+            f"<!DOCTYPE html><html><head><title>Error response</title></head><body>"
+            f"<h1>Error response</h1><p>Error code: {code}</p>"
+            f"<p>Message: {html.escape(message or status.phrase)}</p></body></html>"
+        ).encode("utf-8", "replace")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.write(body)
+
+    async def do_GET(self):
+        body = await self.send_head()
+        if body is not None:
+            self.write(body)
+
+    async def do_HEAD(self):
+        await self.send_head()
+
+    async def send_head(self) -> bytes | None:
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        if self.headers.get("If-Modified-Since") == modified:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("Last-Modified", modified)
+            self.end_headers()
+            return None
+
+        body = await asyncio.to_thread(read_file, path)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Last-Modified", modified)
+        self.end_headers()
+        return body
+
+    def translate_path(self, path: str) -> str:
+        path = path.split("?", 1)[0].split("#", 1)[0]
+        path = posixpath.normpath(urllib.parse.unquote(path))
+        result = self.directory
+        for word in filter(None, path.split("/")):
+            if os.path.dirname(word) or word in (os.curdir, os.pardir):
+                continue
+            result = os.path.join(result, word)
+        return result
+
+    def log_request(self, code: int):
+        peer = self.writer.get_extra_info("peername")
+        sys.stderr.write("%s - - [%s] \"%s\" %d -\n" % (
+            peer[0] if peer else "-",
+            time.strftime("%d/%b/%Y %H:%M:%S"),
+            self.requestline,
+            code,
+        ))
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
@@ -1,126 +1,165 @@
 import asyncio
 import http.cookies
+import inspect
 import json
 import logging
 import os
 import re
+import time
 import traceback
 from http import HTTPStatus
-from http.server import SimpleHTTPRequestHandler
-from io import BytesIO
 from os import mkdir
-from typing import Callable
+from typing import Awaitable, Callable
 
-from server import ROOT_DIR, ENV, read_request, read_collections, read_collection, run_request
-from server.ws import ws_accept, ws_read_frame, ws_encode_frame
-from server.ws.handler import do_ws, is_ws_exit
+from checks import parse_extractor, parse_assertion
+from metrics import METRICS, PAGE_DURATION, WEBSOCKETS
+from profiler import PROFILER, activity
+from server import ROOT_DIR, TEMPLATES, CHANGES, read_collections, run_request_async, read_history, read_history_entry
+from server.core import AsyncHTTPRequestHandler
+from server.ws import ws_accept, ws_deflate_offer, ws_deflate_response, WebSocket
+from storage import INDEX, read_collection, read_request
 
-REQUEST_RUN_TEMPLATE_PATTERN = re.compile("/request-run-template/(\\d+)")
+REQUEST_RUN_TEMPLATE_PATTERN = re.compile("/request-run-template/(\\d+)(?:/(ok|failed))?")
 
 
-class HTTPHandler(SimpleHTTPRequestHandler):
+class HTTPHandler(AsyncHTTPRequestHandler):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         self.cookies = http.cookies.SimpleCookie()
         self.payload = None
         self.ws_exit = False
-        super().__init__(*args, directory=os.path.join(ROOT_DIR, "static"), **kwargs)
+        self.ws: WebSocket | None = None
+        super().__init__(reader, writer, directory=os.path.join(ROOT_DIR, "static"))
 
-    def do_HEAD(self):
+    async def do_HEAD(self):
         if self.path == "/ws":
             self.send_response(HTTPStatus.CONTINUE)
             self.end_headers()
             return
 
-        return super().do_HEAD()
+        return await super().do_HEAD()
 
-    def do_GET(self):
+    async def do_GET(self):
         if self.path == "/ws":
             self.send_response(HTTPStatus.SWITCHING_PROTOCOLS)
             self.send_header("Upgrade", "websocket")
             self.send_header("Connection", "upgrade")
             self.send_header("Sec-WebSocket-Accept", ws_accept(self.headers.get("Sec-WebSocket-Key")))
+            deflate = ws_deflate_offer(self.headers.get("Sec-WebSocket-Extensions"))
+            if deflate is not None:
+                self.send_header("Sec-WebSocket-Extensions", ws_deflate_response(deflate))
             self.end_headers()
-            asyncio.run(self.ws_loop())
+            self.close_connection = True
+            self.ws = WebSocket(self.reader, self.writer, deflate=deflate)
+            await self.ws_loop()
             return
 
-        return super().do_GET()
+        return await super().do_GET()
 
     async def ws_loop(self):
-        while not self.ws_exit:
-            msg = ws_read_frame(self.rfile)
-            if msg is None:
-                return
-            if len(msg) > 0:
-                await do_ws(msg, self.send_ws)
+        # The WebSocket session pulls in the executor, httpx and the diff engine, so it is loaded on first use.
+        from server.ws.handler import Session
+        session = Session(self.send_ws)
+        WEBSOCKETS.inc()
+        try:
+            while not self.ws_exit:
+                msg = await self.ws.receive()
+                if msg is None:
+                    return
+                if len(msg) > 0:
+                    session.dispatch(msg)
+        finally:
+            WEBSOCKETS.dec()
+            await session.close()
 
     async def send_ws(self, msg: str | bytes) -> None:
+        from server.ws.handler import is_ws_exit
         if is_ws_exit(msg):
             self.ws_exit = True
+            await self.ws.close()
             return
-        self.wfile.write(ws_encode_frame(msg))
+        await self.ws.send(msg)
 
-    def send_head(self):
+    async def send_head(self) -> bytes | None:
         self.cookies.load(self.headers.get("Cookie", ""))
-        if self.path == "/collections":
-            return self.send_rendered("collections.html", self.get_collections)
+        if self.path == "/metrics":
+            return self.send_metrics()
+        elif self.path == "/profile":
+            return self.send_json(PROFILER.summary())
+        elif self.path in ("/profile/wall.folded", "/profile/cpu.folded"):
+            return self.send_profile(self.path[len("/profile/"):-len(".folded")])
+        elif self.path == "/collections":
+            return await self.send_rendered("collections.html", self.get_collections)
         elif self.path == "/collection-form":
-            return self.send_rendered("collection_form.html", self.collection_form)
+            return await self.send_rendered("collection_form.html", self.collection_form)
         else:
             match = REQUEST_RUN_TEMPLATE_PATTERN.fullmatch(self.path)
             if match:
-                return self.send_rendered("request_run.html", lambda: {
+                return await self.send_rendered("request_run.html", lambda: {
                     "response_status": int(match.group(1)),
+                    "ok": match.group(2) == "ok" if match.group(2) else None,
                 })
-            return super().send_head()
+            return await super().send_head()
 
-    def do_POST(self):
+    async def do_POST(self):
         self.cookies.load(self.headers.get("Cookie", ""))
-        self.payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.payload = await self.read_payload()
 
-        f = None
+        b = None
         if self.path == "/collections":
-            f = self.send_rendered("collection_form.html", self.post_collections)
+            b = await self.send_rendered("collection_form.html", self.post_collections)
         elif self.path == "/collection-form":
-            f = self.send_rendered("collection_form.html", self.collection_form)
+            b = await self.send_rendered("collection_form.html", self.collection_form)
         elif self.path == "/collection-run":
-            f = self.send_rendered("collection_run.html", self.collection_run)
+            b = await self.send_rendered("collection_run.html", self.collection_run)
         elif self.path == "/request-form":
-            f = self.send_rendered("request_form.html", self.request_form)
+            b = await self.send_rendered("request_form.html", self.request_form)
         elif self.path == "/requests":
-            f = self.send_rendered("request_form.html", self.post_requests)
+            b = await self.send_rendered("request_form.html", self.post_requests)
+        elif self.path == "/collection-item":
+            b = await self.send_rendered("collection_item.html", self.collection_item)
         elif self.path == "/request-run":
-            f = self.send_rendered("request_run.html", self.request_run)
+            b = await self.send_rendered("request_run.html", self.request_run)
+        elif self.path == "/history":
+            b = await self.send_rendered("history.html", self.history)
+        elif self.path == "/history-entries":
+            b = await self.send_rendered("history_entries.html", self.history)
+        elif self.path == "/history-entry":
+            b = await self.send_rendered("request_run.html", self.history_entry)
         else:
             self.send_error(HTTPStatus.NOT_FOUND)
-        self.send_content(f)
+        self.send_content(b)
 
-    def do_DELETE(self):
+    async def do_DELETE(self):
         self.cookies.load(self.headers.get("Cookie", ""))
-        self.payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.payload = await self.read_payload()
 
-        f = None
+        b = None
         if self.path == "/collections":
-            f = self.send_rendered("collections.html", self.delete_collections)
-        self.send_content(f)
+            b = await self.send_rendered("collections.html", self.delete_collections)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+        self.send_content(b)
 
-    def send_content(self, f):
-        if f:
-            try:
-                self.copyfile(f, self.wfile)
-            finally:
-                f.close()
+    def send_content(self, b: bytes | None):
+        if b:
+            self.write(b)
 
-    def send_rendered(self, template_path: str, call: Callable[[], dict]) -> BytesIO:
+    async def send_rendered(self, template_path: str, call: Callable[[], dict | Awaitable[dict]]) -> bytes:
+        start = time.perf_counter()
         try:
-            result = call()
-            template = ENV.get_template(template_path)
-            rendered = template.render(result)
+            with activity(f"render {template_path}"):
+                result = call()
+                if inspect.isawaitable(result):
+                    result = await result
+                template = TEMPLATES.get(template_path)
+                rendered = template.render(result)
+            PAGE_DURATION.observe(time.perf_counter() - start, template_path)
         except Exception as e:
             logging.error(e)
             traceback.print_exception(e)
             error = "".join(traceback.format_exception(e))
-            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+            self.send_response(HTTPStatus.INTERNAL_SERVER_ERROR)
             self.send_header("Content-Type", "text/plain")
             return self.send_finish(error)
 
@@ -128,12 +167,37 @@ class HTTPHandler(SimpleHTTPRequestHandler):
         self.send_header("Content-Type", "text/html")
         return self.send_finish(rendered)
 
-    def send_finish(self, data: str) -> BytesIO:
+    def send_metrics(self) -> bytes:
+        b = METRICS.render().encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        return b
+
+    def send_json(self, data: dict) -> bytes:
+        b = json.dumps(data).encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        return b
+
+    def send_profile(self, kind: str) -> bytes:
+        b = PROFILER.collapsed(kind).encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Disposition", f'attachment; filename="pyramis-{kind}.folded"')
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        return b
+
+    def send_finish(self, data: str) -> bytes:
         b = data.encode("utf-8")
         self.send_header("Set-Cookie", self.cookies.output(header="", sep=""))
         self.send_header("Content-Length", str(len(b)))
         self.end_headers()
-        return BytesIO(b)
+        return b
 
     def read_collections_cookie(self) -> list[str]:
         if "collections" not in self.cookies:
@@ -158,10 +222,20 @@ class HTTPHandler(SimpleHTTPRequestHandler):
             raise Exception("collection not found in payload")
         if not os.path.isdir(new["collection"]):
             raise Exception("not a directory")
-        with open(os.path.join(new["collection"], "meta.json"), "w") as f:
-            json.dump({
-                "variables": new.get("variables", []),
-            }, f, indent="\t")
+        meta_path = os.path.join(new["collection"], "meta.json")
+        meta = {}
+        if os.path.isfile(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        meta["variables"] = new.get("variables", [])
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent="\t")
+        INDEX.invalidate(new["collection"])
+        CHANGES.publish("collection-changed", {
+            "collection": new["collection"],
+            "variables": meta["variables"],
+            "origin": new.get("origin"),
+        })
         dirs = self.read_collections_cookie()
         dirs.append(new["collection"])
         self.write_collections_cookie(dirs)
@@ -176,6 +250,15 @@ class HTTPHandler(SimpleHTTPRequestHandler):
         self.write_collections_cookie(dirs)
         return read_collections(dirs)
 
+    def collection_item(self) -> dict:
+        new = json.loads(self.payload)
+        if not "collection" in new and new["collection"]:
+            raise Exception("collection not found in payload")
+        return {
+            "collection": read_collection(new["collection"]),
+            "index": int(new.get("index", 0)),
+        }
+
     def collection_form(self) -> dict:
         if self.payload is None:
             return read_collection(None)
@@ -190,7 +273,7 @@ class HTTPHandler(SimpleHTTPRequestHandler):
         payload = json.loads(self.payload)
         if not "collection" in payload and payload["collection"]:
             raise Exception("collection not found in payload")
-        return payload
+        return read_collection(payload["collection"])
 
     def request_form(self) -> dict:
         new = json.loads(self.payload)
@@ -202,27 +285,60 @@ class HTTPHandler(SimpleHTTPRequestHandler):
         new = json.loads(self.payload)
         if not ("request" in new and new["request"] and "collection" in new and new["collection"]):
             raise Exception("request or collection not found in payload")
+        # Rules are checked first, so an invalid one leaves no request directory without meta.json behind.
+        for rule in new.get("extract", []):
+            parse_extractor(rule)
+        for rule in new.get("assert", []):
+            parse_assertion(rule)
         path = os.path.join(new["collection"], "requests", new["request"])
-        if not os.path.isdir(path):
+        created = not os.path.isdir(path)
+        if created:
             mkdir(path)
-        with open(os.path.join(path, "meta.json"), "w") as f:
-            json.dump({
-                "method": new.get("method", ""),
-                "url": new.get("url", ""),
-                "headers": new.get("headers", []),
-            }, f, indent="\t")
+        meta_path = os.path.join(path, "meta.json")
+        meta = {}
+        if os.path.isfile(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        meta.update({
+            "method": new.get("method", ""),
+            "url": new.get("url", ""),
+            "headers": new.get("headers", []),
+            "after": new.get("after", []),
+            "extract": new.get("extract", []),
+            "assert": new.get("assert", []),
+        })
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent="\t")
         payload_path = os.path.join(path, "payload.data")
-        if "payload" in new and new["payload"]:
-            with open(payload_path, "w") as f:
-                f.write(new["payload"])
-        elif os.path.isfile(payload_path):
-            os.remove(payload_path)
+        # A payload of null leaves payload.data alone; large and binary payloads are not edited in the form.
+        if new.get("payload") is not None:
+            if new["payload"]:
+                with open(payload_path, "wb") as f:
+                    f.write(new["payload"].encode("utf-8"))
+            elif os.path.isfile(payload_path):
+                os.remove(payload_path)
+        INDEX.invalidate(new["collection"], new["request"])
+        CHANGES.publish("request-changed", {
+            "collection": new["collection"],
+            "request": new["request"],
+            "created": created,
+            "origin": new.get("origin"),
+        })
         return read_request(new["collection"], new["request"])
 
-    def request_run(self) -> dict:
+    async def request_run(self) -> dict:
         new = json.loads(self.payload)
         if not "collection" in new and new["collection"]:
             raise Exception("collection not found in payload")
         if not "request" in new and new["request"]:
             raise Exception("request not found in payload")
-        return run_request(new["collection"], new["request"])
+        return await run_request_async(new["collection"], new["request"])
+
+    async def history(self) -> dict:
+        return await read_history(json.loads(self.payload) if self.payload else {})
+
+    async def history_entry(self) -> dict:
+        new = json.loads(self.payload)
+        if not "id" in new:
+            raise Exception("id not found in payload")
+        return await read_history_entry(int(new["id"]))
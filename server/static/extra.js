@@ -40,6 +40,17 @@
         link.tab("show")
     }
 
+    function lines(text) {
+        return text
+            .split("\n")
+            .map(function (line) {
+                return line.trim()
+            })
+            .filter(function (line) {
+                return line.length > 0
+            })
+    }
+
     function refreshCollectionsWith(data) {
         var active = $("#collections-nav .accordion-button:not(.collapsed)")
         active = active.length ? active.attr("data-collection-name") : null
@@ -53,6 +64,118 @@
         $.get("collections", refreshCollectionsWith)
     }
 
+    // Identifies this page in change events, so its own saves are not
+    // reported back to it as changes made elsewhere.
+    var ORIGIN = String(Math.random()).replace(/^0\./, "")
+
+    function collectionItem(collection) {
+        return $("#collections-nav .accordion-item").filter(function () {
+            return $(this).attr("data-collection") == collection
+        })
+    }
+
+    function collectionRequestLink(collection, request) {
+        return collectionItem(collection).find(".collection-request").filter(function () {
+            return $(this).attr("data-request") == request
+        })
+    }
+
+    function addCollectionItem(collection) {
+        if (collectionItem(collection).length) {
+            return
+        }
+        var index = 1
+        $("#collections-nav .accordion-collapse").each(function () {
+            index = Math.max(index, parseInt($(this).attr("id").replace(/^.*-/, ""), 10) + 1)
+        })
+        $.post({
+            url: "collection-item",
+            contentType: "application/json",
+            data: JSON.stringify({
+                collection: collection,
+                index: index
+            }),
+            success: function (data) {
+                if (!collectionItem(collection).length) {
+                    $("#collections-accordion").append(data)
+                }
+            }
+        })
+    }
+
+    function addRequestLink(collection, request) {
+        var item = collectionItem(collection)
+        if (!item.length) {
+            addCollectionItem(collection)
+            return
+        }
+        if (collectionRequestLink(collection, request).length) {
+            return
+        }
+        item.find(".collection-no-requests").remove()
+        item.find(".collection-run").removeClass("disabled")
+        $("<a class='collection-request list-group-item list-group-item-action' />")
+            .attr("href", "#" + collection)
+            .attr("data-request", request)
+            .text(request)
+            .appendTo(item.find(".list-group"))
+    }
+
+    function applyChange(evt) {
+        var data = evt.data
+        switch (evt.type) {
+            case "collection-changed":
+                // The sidebar lists the collections tracked by this browser's
+                // cookie, so a collection saved elsewhere is not added here.
+                if (data.origin != ORIGIN) {
+                    $("#" + collectionTabId(data.collection)).find(".collection-form-stale").removeClass("d-none")
+                }
+                break
+            case "request-changed":
+                if (collectionItem(data.collection).length) {
+                    addRequestLink(data.collection, data.request)
+                }
+                if (data.origin != ORIGIN) {
+                    $("#" + requestTabId(data.collection, data.request)).find(".request-form-stale").removeClass("d-none")
+                }
+                break
+            case "result-appended":
+                var link = collectionRequestLink(data.collection, data.request)
+                var badge = link.find(".collection-request-status")
+                if (!badge.length) {
+                    badge = $("<span class='badge float-end collection-request-status' />").appendTo(link)
+                }
+                badge
+                    .toggleClass("text-bg-success", data.ok)
+                    .toggleClass("text-bg-danger", !data.ok)
+                    .attr("title", data.elapsed + " ms")
+                    .text(data.status || "error")
+                break
+        }
+    }
+
+    function subscribeChanges(reconnected) {
+        var socket = new WebSocket("ws")
+
+        socket.addEventListener("open", function (event) {
+            socket.send(JSON.stringify({ type: "subscribe" }))
+            if (reconnected) {
+                // Changes made while disconnected were missed.
+                refreshCollections()
+            }
+        })
+
+        socket.addEventListener("message", function (event) {
+            applyChange(JSON.parse(event.data))
+        })
+
+        socket.addEventListener("close", function (event) {
+            setTimeout(function () {
+                subscribeChanges(true)
+            }, 1000)
+        })
+    }
+
     function collectionTabId(collection) {
         return "collection-" +
             encodeURIComponent(collection).replaceAll(/[^A-Za-z0-9_-]/g, "_")
@@ -68,12 +191,21 @@
             encodeURIComponent(request || "").replaceAll(/[^A-Za-z0-9_-]/g, "_")
     }
 
+    function historyQuery(form) {
+        return {
+            collection: form.find(".history-collection").val(),
+            request: form.find(".history-request").val(),
+            status: form.find(".history-status").val()
+        }
+    }
+
     function runIdPostfix() {
         return "-run-" + String(Math.random()).replace(/^0\./, "")
     }
 
     $(function () {
         refreshCollections()
+        subscribeChanges(false)
 
         $("#tabs").on("click", "a.nav-link", function (event) {
             event.preventDefault()
@@ -97,6 +229,11 @@
 
         $("#refresh-collections").on("click", refreshCollections)
 
+        $("#history").on("click", function (event) {
+            event.preventDefault()
+            newTab("History", "history-tab", "history", {})
+        })
+
         $("#collections-nav").on("click", ".collection-new-request", function (event) {
             event.preventDefault()
             var collection = $(this).attr("href").replace(/^#/, "")
@@ -138,7 +275,7 @@
         $("#collections-nav").on("click", ".collection-request", function (event) {
             event.preventDefault()
             var collection = $(this).attr("href").replace(/^#/, "")
-            var request = $(this).text()
+            var request = $(this).attr("data-request")
             newTab(request, requestTabId(collection, request), "request-form", {
                 collection: collection,
                 request: request
@@ -173,6 +310,7 @@
                 contentType: "application/json",
                 data: JSON.stringify({
                     collection: collection,
+                    origin: ORIGIN,
                     variables: form.find(".collection-form-variables-row:not(.collection-form-variables-row-prototype)")
                             .map(function () {
                                 return {
@@ -187,7 +325,7 @@
                     var pane = form.closest(".tab-pane")
                     var tab = $("#tabs a[href='#" + pane.attr("id") + "']")
                     form.parent().html(data)
-                    refreshCollections()
+                    addCollectionItem(collection)
                     if (tab.length) {
                         tab.find(".text").text(collectionTabName(collection))
                         var newId = collectionTabId(collection)
@@ -232,6 +370,7 @@
                 data: JSON.stringify({
                     collection: collection,
                     request: request,
+                    origin: ORIGIN,
                     method: form.find(".request-form-method").val(),
                     url: form.find(".request-form-url").val(),
                     headers: form.find(".request-form-headers-row:not(.request-form-headers-row-prototype)")
@@ -243,13 +382,23 @@
                             }
                         })
                         .get(),
-                    payload: form.find(".request-form-payload").val(),
+                    payload: form.find(".request-form-payload").prop("readonly") ? null : form.find(".request-form-payload").val(),
+                    after: form.find(".request-form-after").val()
+                        .split(",")
+                        .map(function (name) {
+                            return name.trim()
+                        })
+                        .filter(function (name) {
+                            return name.length > 0
+                        }),
+                    extract: lines(form.find(".request-form-extract").val()),
+                    assert: lines(form.find(".request-form-assert").val()),
                 }),
                 success: function (data) {
                     var pane = form.closest(".tab-pane")
                     var tab = $("#tabs a[href='#" + pane.attr("id") + "']")
                     form.parent().html(data)
-                    refreshCollections()
+                    addRequestLink(collection, request)
                     if (tab.length) {
                         tab.find(".text").text(request)
                         var newId = requestTabId(collection, request)
@@ -260,6 +409,37 @@
             })
         })
 
+        $("#tab-contents").on("click", ".collection-form-reload", function (event) {
+            event.preventDefault()
+            var pane = $(this).closest(".tab-pane")
+            $.post({
+                url: "collection-form",
+                contentType: "application/json",
+                data: JSON.stringify({
+                    collection: pane.find(".collection-form-name").val()
+                }),
+                success: function (data) {
+                    pane.html(data)
+                }
+            })
+        })
+
+        $("#tab-contents").on("click", ".request-form-reload", function (event) {
+            event.preventDefault()
+            var pane = $(this).closest(".tab-pane")
+            $.post({
+                url: "request-form",
+                contentType: "application/json",
+                data: JSON.stringify({
+                    collection: pane.find(".request-form-collection").val(),
+                    request: pane.find(".request-form-name").val()
+                }),
+                success: function (data) {
+                    pane.html(data)
+                }
+            })
+        })
+
         $("#tab-contents").on("click", ".request-form-run", function (event) {
             event.preventDefault()
             var form = $(this).closest(".request-form")
@@ -276,9 +456,22 @@
             var form = $(this).closest(".collection-run-form")
             var results = form.next(".collection-run-results")
             var collection = form.find(".collection-run-collection").val()
+            var concurrency = parseInt(form.find(".collection-run-concurrency").val(), 10) || 1
+            var processes = parseInt(form.find(".collection-run-processes").val(), 10) || 1
+            var id = "collection" + runIdPostfix()
             var socket = new WebSocket("ws")
+            var stop = form.find(".collection-run-stop")
             results.find(".requests").html("")
 
+            stop.prop("disabled", false).off("click").on("click", function (event) {
+                event.preventDefault()
+                stop.prop("disabled", true)
+                socket.send(JSON.stringify({
+                    type: "cancel",
+                    data: { id: id }
+                }))
+            })
+
             socket.addEventListener("message", function (event) {
                 var evt = JSON.parse(event.data)
                 switch (evt.type) {
@@ -290,14 +483,15 @@
 
                         if (evt.data.status == "started") {
                             results.find(".progress-bar").addClass("progress-bar-striped progress-bar-animated")
-                        } else if (evt.data.status == "finished") {
+                        } else if (evt.data.status == "finished" || evt.data.status == "cancelled") {
                             results.find(".progress-bar").removeClass("progress-bar-striped progress-bar-animated")
+                            stop.prop("disabled", true)
                             socket.close()
                         }
                         break
                     case "request-result":
                         $("<a href='#' class='list-group-item list-group-item-action' />")
-                            .addClass("list-group-item-" + (evt.data.result.response_status < 400 ? "success" : "danger"))
+                            .addClass("list-group-item-" + (evt.data.result.ok ? "success" : "danger"))
                             .text(evt.data.request)
                             .attr("data-result", JSON.stringify(evt.data.result))
                             .appendTo(results.find(".requests"))
@@ -308,11 +502,192 @@
             socket.addEventListener("open", function (event) {
                 socket.send(JSON.stringify({
                     type: "collection-run",
-                    data: { collection: collection }
+                    id: id,
+                    data: { collection: collection, concurrency: concurrency, processes: processes }
                 }))
             })
         })
 
+        $("#tab-contents").on("click", ".collection-load-start", function (event) {
+            event.preventDefault()
+            var pane = $(this).closest(".tab-pane")
+            var form = $(this).closest(".collection-load-form")
+            var results = form.next(".collection-load-results")
+            var socket = new WebSocket("ws")
+            results.find(".stats").html("")
+
+            socket.addEventListener("message", function (event) {
+                var evt = JSON.parse(event.data)
+                if (evt.type != "load-status") {
+                    return
+                }
+                results.find(".status").text(evt.data.status)
+                var stats = evt.data.stats
+                if (stats.latency) {
+                    var rows = [
+                        ["Iterations", stats.iterations],
+                        ["Errors", stats.errors],
+                        ["Throughput", stats.throughput + " /s"],
+                        ["Latency p50", stats.latency.p50 + " ms"],
+                        ["Latency p90", stats.latency.p90 + " ms"],
+                        ["Latency p99", stats.latency.p99 + " ms"],
+                        ["Latency max", stats.latency.max + " ms"],
+                        ["Statuses", JSON.stringify(stats.statuses)]
+                    ]
+                    results.find(".stats").html("")
+                    rows.forEach(function (row) {
+                        $("<tr />")
+                            .append($("<th />").text(row[0]))
+                            .append($("<td />").text(row[1]))
+                            .appendTo(results.find(".stats"))
+                    })
+                }
+                if (evt.data.status == "finished") {
+                    socket.close()
+                }
+            })
+
+            socket.addEventListener("open", function (event) {
+                socket.send(JSON.stringify({
+                    type: "load-run",
+                    data: {
+                        collection: pane.find(".collection-run-collection").val(),
+                        concurrency: parseInt(pane.find(".collection-run-concurrency").val(), 10) || 1,
+                        iterations: form.find(".collection-load-iterations").val(),
+                        duration: form.find(".collection-load-duration").val(),
+                        rate: form.find(".collection-load-rate").val()
+                    }
+                }))
+            })
+        })
+
+        $("#tab-contents").on("click", ".collection-diff-start", function (event) {
+            event.preventDefault()
+            var pane = $(this).closest(".tab-pane")
+            var form = $(this).closest(".collection-diff-form")
+            var results = form.next(".collection-diff-results")
+            var socket = new WebSocket("ws")
+            results.find(".requests").html("")
+
+            function format(value) {
+                return typeof value == "string" ? value : JSON.stringify(value)
+            }
+
+            socket.addEventListener("message", function (event) {
+                var evt = JSON.parse(event.data)
+                switch (evt.type) {
+                    case "diff-status":
+                        results.find(".status").text(evt.data.status + ": " + evt.data.different + " of " + evt.data.done + " differ")
+                        if (evt.data.status == "finished" || evt.data.status == "cancelled") {
+                            socket.close()
+                        }
+                        break
+                    case "diff-result":
+                        var diff = evt.data.diff
+                        var lines = diff.headers.concat(diff.body).map(function (change) {
+                            if (change.kind == "added") {
+                                return "+ " + change.path + ": " + format(change.right)
+                            } else if (change.kind == "removed") {
+                                return "- " + change.path + ": " + format(change.left)
+                            }
+                            return "~ " + change.path + ": " + format(change.left) + " -> " + format(change.right)
+                        })
+                        if (diff.changes > lines.length) {
+                            lines.push("... " + (diff.changes - lines.length) + " more")
+                        }
+                        var summary = diff.left_status + " -> " + diff.right_status
+                            + ", " + (diff.elapsed >= 0 ? "+" : "") + diff.elapsed + " ms"
+                            + ", " + diff.changes + " changes" + (diff.partial ? " (partial)" : "")
+                        $("<div class='list-group-item' />")
+                            .addClass("list-group-item-" + (diff.same ? "success" : "warning"))
+                            .append($("<div />").text(evt.data.request + ": " + summary))
+                            .append(lines.length ? $("<pre class='mb-0 mt-2' />").text(lines.join("\n")) : null)
+                            .appendTo(results.find(".requests"))
+                        break
+                    case "error":
+                        results.find(".status").text(evt.data.message)
+                        socket.close()
+                        break
+                }
+            })
+
+            socket.addEventListener("open", function (event) {
+                socket.send(JSON.stringify({
+                    type: "collection-diff",
+                    data: {
+                        collection: pane.find(".collection-run-collection").val(),
+                        concurrency: parseInt(pane.find(".collection-run-concurrency").val(), 10) || 1,
+                        left: form.find(".collection-diff-left").val(),
+                        right: form.find(".collection-diff-right").val()
+                    }
+                }))
+            })
+        })
+
+        $("#tab-contents").on("click", ".response-load-full", function (event) {
+            event.preventDefault()
+            var button = $(this).prop("disabled", true)
+            var payload = button.closest(".request-run").find(".response-payload").val("")
+            var body = button.attr("data-body")
+            var socket = new WebSocket("ws")
+
+            socket.addEventListener("message", function (event) {
+                var evt = JSON.parse(event.data)
+                if (evt.type == "request-result-chunk" && evt.data.body == body) {
+                    payload.val(payload.val() + evt.data.data)
+                    if (evt.data.last) {
+                        socket.close()
+                    }
+                } else if (evt.type == "error") {
+                    payload.val(evt.data.message)
+                    socket.close()
+                }
+            })
+
+            socket.addEventListener("open", function (event) {
+                socket.send(JSON.stringify({
+                    type: "result-body",
+                    data: { body: body }
+                }))
+            })
+        })
+
+        $("#tab-contents").on("click", ".history-search", function (event) {
+            event.preventDefault()
+            var form = $(this).closest(".history-form")
+            $.post({
+                url: "history-entries",
+                contentType: "application/json",
+                data: JSON.stringify(historyQuery(form)),
+                success: function (data) {
+                    form.next(".history-entries").html(data)
+                }
+            })
+        })
+
+        $("#tab-contents").on("click", ".history-older", function (event) {
+            event.preventDefault()
+            var link = $(this)
+            var query = historyQuery(link.closest(".history-entries").prev(".history-form"))
+            query.before = link.attr("href").replace(/^#/, "")
+            $.post({
+                url: "history-entries",
+                contentType: "application/json",
+                data: JSON.stringify(query),
+                success: function (data) {
+                    link.replaceWith(data)
+                }
+            })
+        })
+
+        $("#tab-contents").on("click", ".history-entry", function (event) {
+            event.preventDefault()
+            var id = $(this).attr("href").replace(/^#/, "")
+            newTab($(this).attr("data-request") + " #" + id, "history-entry-" + id, "history-entry", {
+                id: id
+            })
+        })
+
         $("#tab-contents").on("click", ".collection-run-results .requests a", function (event) {
             event.preventDefault()
             var link = $(this)
@@ -322,15 +697,46 @@
             newTab(
                 request + " results",
                 requestTabId(collection, request) + runIdPostfix(),
-                "request-run-template/" + result.response_status,
+                "request-run-template/" + result.response_status + (result.ok ? "/ok" : "/failed"),
                 undefined,
                 function (pane) {
+                    pane.find(".response-status").val(result.error || result.response_status)
                     pane.find(".request-method").val(result.request_method)
                     pane.find(".request-url").val(result.request_url)
                     pane.find(".request-headers").val(result.request_headers)
                     pane.find(".request-payload").val(result.request_payload)
                     pane.find(".response-headers").val(result.response_headers)
                     pane.find(".response-payload").val(result.response_payload)
+                    pane.find(".response-truncated").toggleClass("d-none", !result.response_truncated)
+                    pane.find(".response-size").val(result.response_size)
+                    pane.find(".response-load-full")
+                        .attr("data-body", result.response_body || "")
+                        .prop("disabled", !result.response_body)
+                    var assertions = pane.find(".response-assertions").html("").toggleClass("d-none", !result.assertions.length)
+                    result.assertions.forEach(function (assertion) {
+                        $("<li class='list-group-item' />")
+                            .addClass("list-group-item-" + (assertion.passed ? "success" : "danger"))
+                            .append($("<code />").text(assertion.rule))
+                            .append(document.createTextNode(assertion.actual !== null ? " \u2014 " + assertion.actual : ""))
+                            .appendTo(assertions)
+                    })
+                    var extracted = pane.find(".response-extracted").html("").toggleClass("d-none", $.isEmptyObject(result.extracted))
+                    $.each(result.extracted, function (name, value) {
+                        $("<li class='list-group-item' />")
+                            .append($("<code />").text(name))
+                            .append(document.createTextNode(" = " + value))
+                            .appendTo(extracted)
+                    })
+                    pane.find(".response-timings").toggleClass("d-none", !result.timings)
+                    pane.find(".timing-elapsed").val(result.elapsed)
+                    pane.find(".timing-retries").val(result.retries || 0)
+                    pane.find(".timing-waited").val(result.waited || 0)
+                    pane.find(".response-cache").toggleClass("d-none", !result.cache)
+                    pane.find(".cache-outcome").val(result.cache || "")
+                    pane.find(".cache-age").val(result.cache_age === null ? "" : result.cache_age)
+                    $.each(result.timings || {}, function (key, value) {
+                        pane.find(".timing-" + key).val(key == "reused" ? (value ? "reused" : "new") : (value === null ? "" : value))
+                    })
                 }
             )
         })
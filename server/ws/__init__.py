@@ -1,7 +1,30 @@
+import asyncio
 import base64
 import hashlib
+import zlib
 from typing import Any
 
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+DEFLATE_MIN_SIZE = 64
+CONTROL_MAX_SIZE = 125
+
+
+class WebSocketError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
 
 # Credit: https://gist.github.com/gpiffault/c462466bd644080a92e3430692a22784
 
@@ -13,42 +36,194 @@ def ws_accept(key: Any) -> str:
     ).digest()).decode('ascii')
 
 
-def ws_read_frame(rfile) -> str | bytes | None:
-    preamble = rfile.read(2)
-    if len(preamble) < 2:
+def ws_deflate_offer(header: str | None) -> dict[str, str] | None:
+    if not header:
+        return None
+    for offer in header.split(","):
+        name, *params = [p.strip() for p in offer.split(";")]
+        if name != "permessage-deflate":
+            continue
+        return dict((p.split("=", 1) + [""])[:2] for p in params if p)
+    return None
+
+
+def ws_deflate_response(offer: dict[str, str]) -> str:
+    response = ["permessage-deflate"]
+    if "server_no_context_takeover" in offer:
+        response.append("server_no_context_takeover")
+    if offer.get("server_max_window_bits"):
+        response.append(f"server_max_window_bits={offer['server_max_window_bits']}")
+    return "; ".join(response)
+
+
+def ws_unmask(data: bytes, mask_key: bytes) -> bytes:
+    length = len(data)
+    if length == 0:
+        return data
+    key = (mask_key * ((length + 3) // 4))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+
+async def ws_read_frame(reader: asyncio.StreamReader, limit: int | None = None,
+                        masked: bool = False) -> tuple[bool, int, bool, bytes] | None:
+    # The length is checked before the payload is read, so a peer cannot make the server buffer more than limit.
+    try:
+        preamble = await reader.readexactly(2)
+        mask = preamble[1] >> 7
+        length = preamble[1] & 0x7f
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(await reader.readexactly(8), 'big')
+        if masked and not mask:
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, "unmasked client frame")
+        if preamble[0] & 0x8 and (length > CONTROL_MAX_SIZE or not preamble[0] & 0x80):
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, "invalid control frame")
+        if limit is not None and length > limit:
+            raise WebSocketError(CLOSE_TOO_BIG, f"frame of {length} bytes")
+        if mask:
+            mask_key = await reader.readexactly(4)
+        data = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
         return None
-    mask = preamble[1] >> 7
-    length = preamble[1] & 0x7f
-    if length == 126:
-        length = int.from_bytes(rfile.read(2), 'big')
-    elif length == 127:
-        length = int.from_bytes(rfile.read(4), 'big')
-    if mask:
-        mask_key = rfile.read(4)
-    data = rfile.read(length)
     if mask:
-        data = bytes([data[i] ^ mask_key[i % 4] for i in range(len(data))])
-    if preamble[0] & 0xf == 1:
-        data = data.decode('utf-8')
-    return data
+        data = ws_unmask(data, mask_key)
+    return bool(preamble[0] & 0x80), preamble[0] & 0xf, bool(preamble[0] & 0x40), data
+
 
+def ws_frame_header(length: int, opcode: int, fin: bool = True, rsv1: bool = False) -> bytes:
+    preamble = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode
+    if length <= 125:
+        return bytes([preamble, length])
+    elif length < 2 ** 16:
+        return bytes([preamble, 126]) + length.to_bytes(2, 'big')
+    return bytes([preamble, 127]) + length.to_bytes(8, 'big')
 
-def ws_encode_frame(msg: str | bytes) -> bytes:
-    # Setting fin to 1
-    preamble = 1 << 7
+
+def ws_encode_frame(msg: str | bytes, opcode: int | None = None, fin: bool = True, rsv1: bool = False) -> bytes:
     if isinstance(msg, str):
-        preamble |= 1
         msg = msg.encode('utf-8')
-    else:
-        preamble |= 2
-    frame = bytes([preamble])
-    if len(msg) <= 125:
-        frame += bytes([len(msg)])
-    elif len(msg) < 2 ** 16:
-        frame += bytes([126])
-        frame += len(msg).to_bytes(2, 'big')
-    else:
-        frame += bytes([127])
-        frame += len(msg).to_bytes(4, 'big')
-    frame += msg
-    return frame
+        if opcode is None:
+            opcode = OP_TEXT
+    elif opcode is None:
+        opcode = OP_BINARY
+    return b"".join((ws_frame_header(len(msg), opcode, fin, rsv1), msg))
+
+
+class WebSocket:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 deflate: dict[str, str] | None = None, fragment_size: int = 1024 * 1024,
+                 max_message_size: int = 64 * 1024 * 1024):
+        self.reader = reader
+        self.writer = writer
+        self.fragment_size = fragment_size
+        self.max_message_size = max_message_size
+        self.lock = asyncio.Lock()
+        self.closed = False
+        self.deflate = deflate is not None
+        if deflate is not None:
+            self.compress_reset = "server_no_context_takeover" in deflate
+            self.compress_bits = max(int(deflate.get("server_max_window_bits") or 15), 9)
+            self.compressor = self.new_compressor()
+            self.decompressor = zlib.decompressobj(-15)
+
+    def new_compressor(self):
+        return zlib.compressobj(zlib.Z_BEST_SPEED, zlib.DEFLATED, -self.compress_bits)
+
+    async def receive(self) -> str | bytes | None:
+        opcode = None
+        compressed = False
+        fragments = []
+        size = 0
+        while not self.closed:
+            try:
+                # Control frames may arrive between fragments, so up to their size is always allowed.
+                frame = await ws_read_frame(self.reader, max(self.max_message_size - size, CONTROL_MAX_SIZE),
+                                            masked=True)
+            except WebSocketError as e:
+                await self.close(e.code)
+                return None
+            if frame is None:
+                self.closed = True
+                return None
+            fin, frame_opcode, rsv1, data = frame
+
+            if frame_opcode == OP_PING:
+                await self.send_frame(data, OP_PONG)
+                continue
+            if frame_opcode == OP_PONG:
+                continue
+            if frame_opcode == OP_CLOSE:
+                await self.close(int.from_bytes(data[:2], 'big') if len(data) >= 2 else CLOSE_NORMAL)
+                return None
+
+            if frame_opcode == OP_CONTINUATION:
+                if opcode is None:
+                    await self.close(CLOSE_PROTOCOL_ERROR)
+                    return None
+            elif opcode is not None:
+                await self.close(CLOSE_PROTOCOL_ERROR)
+                return None
+            else:
+                opcode = frame_opcode
+                compressed = rsv1 and self.deflate
+
+            size += len(data)
+            if size > self.max_message_size:
+                await self.close(CLOSE_TOO_BIG)
+                return None
+            fragments.append(data)
+            if not fin:
+                continue
+
+            payload = b"".join(fragments)
+            if compressed:
+                payload = self.decompressor.decompress(payload + DEFLATE_TAIL, self.max_message_size)
+                if self.decompressor.unconsumed_tail:
+                    await self.close(CLOSE_TOO_BIG)
+                    return None
+            return payload.decode('utf-8') if opcode == OP_TEXT else payload
+        return None
+
+    async def send(self, msg: str | bytes) -> None:
+        opcode = OP_TEXT if isinstance(msg, str) else OP_BINARY
+        payload = msg.encode('utf-8') if isinstance(msg, str) else msg
+        compressed = self.deflate and len(payload) >= DEFLATE_MIN_SIZE
+        async with self.lock:
+            if self.closed:
+                return
+            if compressed:
+                if self.compress_reset:
+                    self.compressor = self.new_compressor()
+                payload = self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+                payload = payload[:-len(DEFLATE_TAIL)]
+            view = memoryview(payload)
+            try:
+                for offset in range(0, max(len(payload), 1), self.fragment_size):
+                    fragment = view[offset:offset + self.fragment_size]
+                    self.writer.write(ws_frame_header(
+                        len(fragment),
+                        opcode=opcode if offset == 0 else OP_CONTINUATION,
+                        fin=offset + self.fragment_size >= len(payload),
+                        rsv1=compressed and offset == 0,
+                    ))
+                    self.writer.write(fragment)
+                    await self.writer.drain()
+            except ConnectionError:
+                self.closed = True
+
+    async def send_frame(self, data: bytes, opcode: int) -> None:
+        async with self.lock:
+            if self.closed:
+                return
+            try:
+                self.writer.write(ws_encode_frame(data, opcode=opcode))
+                await self.writer.drain()
+            except ConnectionError:
+                self.closed = True
+
+    async def close(self, code: int = CLOSE_NORMAL) -> None:
+        if self.closed:
+            return
+        await self.send_frame(code.to_bytes(2, 'big'), OP_CLOSE)
+        self.closed = True
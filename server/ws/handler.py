@@ -1,22 +1,99 @@
 import asyncio
+import codecs
+import dataclasses
+import itertools
 import json
+import logging
 from typing import Callable, Coroutine
 
-from executor import Collection, Request
-from server import run_request_async, read_collection, result_to_dict, read_request
+from cache import CACHES
+from diff import diff_results, DIFF_IGNORE
+from executor import RateLimiter, Result, CLIENTS
+from load import Load
+from metrics import METRICS, RUNS_IN_FLIGHT
+from profiler import PROFILER, activity
+from server import run_request_async, result_to_dict, build_collection, load_stats_to_dict, client_stats_to_dict, \
+    read_history, read_collection, diff_to_dict, record_result, BODIES, CHANGES
+from workers import run_async, shard
 
 EOT = 4
 EOT_CHR = chr(EOT)
 EOT_BYTE = bytes([EOT])
+CHUNK_SIZE = 64 * 1024
 
 
 def is_ws_exit(msg: str | bytes) -> bool:
     return msg == EOT_CHR or msg == EOT_BYTE
 
 
-async def do_ws(msg: str | bytes, send: Callable[[str | bytes], Coroutine]):
-    evt = json.loads(msg)
+def ws_event(typ: str, data: dict, evt_id: str | None = None) -> str:
+    if evt_id is None:
+        return json.dumps({"type": typ, "data": data})
+    return json.dumps({"type": typ, "id": evt_id, "data": data})
+
+
+class Session:
+    def __init__(self, send: Callable[[str | bytes], Coroutine]):
+        self.send = send
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.ids = itertools.count(1)
+
+    def dispatch(self, msg: str | bytes):
+        try:
+            evt = json.loads(msg)
+        except ValueError as e:
+            asyncio.ensure_future(self.send(ws_event("error", {"message": f"Invalid event: {e}"})))
+            return
+        evt_id = str(evt["id"]) if evt.get("id") is not None else f"server-{next(self.ids)}"
+        evt["id"] = evt_id
+
+        if evt.get("type") == "cancel":
+            asyncio.ensure_future(self.cancel(evt))
+            return
+
+        if evt.get("type") == "subscribe":
+            CHANGES.subscribe(self.send)
+            return
+
+        task = asyncio.ensure_future(self.run(evt))
+        self.tasks[evt_id] = task
+        task.add_done_callback(lambda t: self.tasks.pop(evt_id, None) if self.tasks.get(evt_id) is t else None)
+
+    async def run(self, evt: dict):
+        try:
+            with activity(ws_activity(evt)):
+                await do_ws(evt, self.send)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(e)
+            await self.send(ws_event("error", {"message": str(e)}, evt["id"]))
+
+    async def cancel(self, evt: dict):
+        target = str(evt.get("data", {}).get("id", ""))
+        task = self.tasks.get(target)
+        if task is not None:
+            task.cancel()
+        await self.send(ws_event("cancelled", {"id": target, "found": task is not None}, evt["id"]))
+
+    async def close(self):
+        CHANGES.unsubscribe(self.send)
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def ws_activity(evt: dict) -> str:
+    # Runs are told apart by collection, so two runs of the same kind show up separately in a profile.
+    data = evt.get("data")
+    collection = data.get("collection") if isinstance(data, dict) else None
+    return f"ws {evt.get('type', '')} {collection}" if collection else f"ws {evt.get('type', '')}"
+
+
+async def do_ws(evt: dict, send: Callable[[str | bytes], Coroutine]):
     typ = evt.get("type", "")
+    evt_id = evt.get("id")
 
     if typ == "exit":
         await send(EOT_CHR)
@@ -24,83 +101,233 @@ async def do_ws(msg: str | bytes, send: Callable[[str | bytes], Coroutine]):
     elif typ == "request-run":
         collection = evt["data"]["collection"]
         request = evt["data"]["request"]
-        await send(json.dumps({
-            "type": "request-result",
-            "data": {
-                "collection": collection,
-                "request": request,
-                "result": await run_request_async(collection, request),
-            }
-        }))
+        await send(ws_event("request-result", {
+            "collection": collection,
+            "request": request,
+            "result": await run_request_async(collection, request),
+        }, evt_id))
 
     elif typ == "collection-run":
         name = evt["data"]["collection"]
-        c = read_collection(name)
-        r = [read_request(name, r["name"]) for r in c["requests"]]
-        collection = Collection(
-            variables={v["name"]: v["value"] for v in c["variables"] if v["enabled"]},
-            requests=[
-                Request(
-                    name=n["name"],
-                    method=r["method"],
-                    url=r["url"],
-                    headers=[(h["name"], h["value"]) for h in r["headers"] if h["enabled"]],
-                    payload=r["payload"] if r["payload"] else None,
-                )
-                for (n, r) in zip(c["requests"], r)
-            ],
-        )
+        concurrency = int(evt["data"].get("concurrency", 1))
+        processes = int(evt["data"].get("processes", 1))
+        collection = build_collection(name, concurrency=concurrency)
 
-        total = len(c["requests"])
+        total = len(collection.requests)
         done = Counter()
 
-        await send(json.dumps({
-            "type": "collection-status",
-            "data": {
+        def status(s: str, count: int) -> str:
+            return ws_event("collection-status", {
                 "collection": name,
-                "status": "started",
+                "status": s,
                 "total": total,
-                "done": done.at(),
-            }
-        }))
-
-        await collection.run(lambda req, res: asyncio.gather(
-            send(json.dumps({
-                "type": "request-result",
-                "data": {
+                "done": count,
+            }, evt_id)
+
+        await send(status("started", done.at()))
+
+        def consume(req, res):
+            record_result(name, req.name, res)
+            return asyncio.gather(
+                send(ws_event("request-result", {
                     "collection": name,
                     "request": req.name,
                     "result": result_to_dict(res),
-                }
-            })),
-            send(json.dumps({
-                "type": "collection-status",
-                "data": {
+                }, evt_id)),
+                send(status("in-progress", done.inc())),
+            )
+
+        def consume_shard(record: tuple[str, Result, dict, dict]):
+            # Results from worker processes arrive already converted; only the spill file is registered here.
+            request, res, result, metrics = record
+            METRICS.add(metrics)
+            if res.response_file:
+                result["response_body"] = BODIES.add(res.response_file)
+            record_result(name, request, res)
+            return asyncio.gather(
+                send(ws_event("request-result", {
                     "collection": name,
-                    "status": "in-progress",
-                    "total": total,
-                    "done": done.inc(),
-                }
-            }))
-        ))
-
-        await send(json.dumps({
-            "type": "collection-status",
-            "data": {
+                    "request": request,
+                    "result": result,
+                }, evt_id)),
+                send(status("in-progress", done.inc())),
+            )
+
+        RUNS_IN_FLIGHT.inc(typ)
+        try:
+            if processes > 1:
+                shards = shard(collection.requests, processes)
+                await run_async(run_collection_shard, [
+                    (name, requests, concurrency, len(shards)) for requests in shards
+                ], consume_shard)
+            else:
+                await collection.run(consume)
+        except asyncio.CancelledError:
+            await send(status("cancelled", done.at()))
+            raise
+        finally:
+            RUNS_IN_FLIGHT.dec(typ)
+
+        await send(status("finished", done.at()))
+
+    elif typ == "collection-diff":
+        data = evt["data"]
+        name = data["collection"]
+        concurrency = int(data.get("concurrency", 1))
+        ignore = read_collection(name)["diff"].get("ignore", DIFF_IGNORE)
+        left = build_collection(name, concurrency=concurrency, environment=data.get("left") or None)
+        right = build_collection(name, concurrency=concurrency, environment=data.get("right") or None)
+
+        total = len(left.requests)
+        done = Counter()
+        different = Counter()
+        pending: tuple[dict[str, Result], dict[str, Result]] = ({}, {})
+
+        def status(s: str, count: int) -> str:
+            return ws_event("diff-status", {
                 "collection": name,
-                "status": "finished",
+                "status": s,
                 "total": total,
-                "done": done.at(),
-            }
-        }))
+                "done": count,
+                "different": different.at(),
+            }, evt_id)
+
+        async def consume(side: int, req, res):
+            other = pending[1 - side].pop(req.name, None)
+            if other is None:
+                pending[side][req.name] = res
+                return
+            pair = (res, other) if side == 0 else (other, res)
+            try:
+                diff = await asyncio.to_thread(diff_results, req.name, *pair, ignore)
+            finally:
+                for r in pair:
+                    if r.response_file:
+                        BODIES.remove(r.response_file)
+            if not diff.same():
+                different.inc()
+            await asyncio.gather(
+                send(ws_event("diff-result", {
+                    "collection": name,
+                    "request": req.name,
+                    "diff": diff_to_dict(diff),
+                }, evt_id)),
+                send(status("in-progress", done.inc())),
+            )
+
+        await send(status("started", done.at()))
+        RUNS_IN_FLIGHT.inc(typ)
+        try:
+            await asyncio.gather(
+                left.run(lambda req, res: consume(0, req, res)),
+                right.run(lambda req, res: consume(1, req, res)),
+            )
+        except asyncio.CancelledError:
+            await send(status("cancelled", done.at()))
+            raise
+        finally:
+            RUNS_IN_FLIGHT.dec(typ)
+            for results in pending:
+                for r in results.values():
+                    if r.response_file:
+                        BODIES.remove(r.response_file)
+
+        await send(status("finished", done.at()))
+
+    elif typ == "result-body":
+        body = evt["data"]["body"]
+        path = BODIES.get(body)
+        if path is None:
+            await send(ws_event("error", {
+                "message": f"Result body not found: {body}"
+            }, evt_id))
+            return
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        offset = 0
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                last = len(chunk) < CHUNK_SIZE
+                await send(ws_event("request-result-chunk", {
+                    "body": body,
+                    "offset": offset,
+                    "data": decoder.decode(chunk, final=last),
+                    "last": last,
+                }, evt_id))
+                offset += len(chunk)
+                if last:
+                    break
+
+    elif typ == "history":
+        await send(ws_event("history-page", await read_history(evt.get("data", {})), evt_id))
+
+    elif typ == "profile-start":
+        data = evt.get("data") or {}
+        PROFILER.start(float(data["interval"]) / 1000 if data.get("interval") else None)
+        await send(ws_event("profile-status", PROFILER.summary(), evt_id))
+
+    elif typ == "profile-stop":
+        await asyncio.to_thread(PROFILER.stop)
+        await send(ws_event("profile-status", PROFILER.summary(), evt_id))
+
+    elif typ == "profile-status":
+        await send(ws_event("profile-status", PROFILER.summary(), evt_id))
+
+    elif typ == "client-pool":
+        await send(ws_event("client-pool-status", client_stats_to_dict(), evt_id))
+
+    elif typ == "load-run":
+        data = evt["data"]
+        name = data["collection"]
+        load = Load(
+            build_collection(name, [data["request"]] if data.get("request") else None),
+            iterations=int(data["iterations"]) if data.get("iterations") else None,
+            duration=float(data["duration"]) if data.get("duration") else None,
+            rate=float(data["rate"]) if data.get("rate") else None,
+            concurrency=int(data.get("concurrency", 1)),
+        )
+
+        def status(s: str, stats: dict) -> str:
+            return ws_event("load-status", {
+                "collection": name,
+                "request": data.get("request"),
+                "status": s,
+                "stats": stats,
+            }, evt_id)
+
+        await send(status("started", {}))
+        RUNS_IN_FLIGHT.inc(typ)
+        try:
+            stats = await load.run(lambda st: send(status("in-progress", load_stats_to_dict(st))))
+        except asyncio.CancelledError:
+            await send(status("cancelled", {}))
+            raise
+        finally:
+            RUNS_IN_FLIGHT.dec(typ)
+        await send(status("finished", load_stats_to_dict(stats)))
 
     else:
-        await send(json.dumps({
-            "type": "error",
-            "data": {
-                "message": f"Unknown event type: {typ}"
-            }
-        }))
+        await send(ws_event("error", {
+            "message": f"Unknown event type: {typ}"
+        }, evt_id))
+
+
+async def run_collection_shard(name: str, requests: list[str], concurrency: int, jobs: int,
+                               emit: Callable[[tuple[str, Result, dict, dict]], None]):
+    # Runs in a worker process with its own event loop and client pool. Templating, parsing, assertions and
+    # result conversion all happen here; the parent only forwards the results, and adds the metrics
+    # recorded for them to its own.
+    collection = build_collection(name, requests, concurrency=concurrency)
+    collection.limiter = RateLimiter(collection.limiter.options.share(jobs))
+
+    async def consume(req, res):
+        emit((req.name, res, result_to_dict(dataclasses.replace(res, response_file=None)), METRICS.take()))
+
+    try:
+        await collection.run(consume)
+    finally:
+        await CLIENTS.close()
+        CACHES.close()
 
 
 class Counter:
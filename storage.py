@@ -0,0 +1,228 @@
+import json
+import os
+from typing import TYPE_CHECKING
+
+from checks import parse_extractor, parse_assertion
+
+if TYPE_CHECKING:
+    from executor import Collection, Request, PayloadFile
+
+PAYLOAD_STREAM_THRESHOLD = 1024 * 1024
+
+
+def stat_signature(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class IndexEntry:
+    def __init__(self, signature: tuple, value: dict):
+        self.signature = signature
+        self.value = value
+        self.built: 'Request | None' = None
+
+
+class Index:
+    def __init__(self):
+        self.collections: dict[str, IndexEntry] = {}
+        self.requests: dict[tuple[str, str], IndexEntry] = {}
+
+    def collection(self, collection: str) -> dict:
+        signature = (
+            stat_signature(os.path.join(collection, "requests")),
+            stat_signature(os.path.join(collection, "meta.json")),
+        )
+        entry = self.collections.get(collection)
+        if entry is None or entry.signature != signature:
+            entry = self.collections[collection] = IndexEntry(signature, load_collection(collection))
+        return entry.value
+
+    def request(self, collection: str, request: str) -> dict:
+        return self.request_entry(collection, request).value
+
+    def built(self, collection: str, request: str) -> 'Request':
+        entry = self.request_entry(collection, request)
+        if entry.built is None:
+            entry.built = build_request(entry.value)
+        return entry.built
+
+    def request_entry(self, collection: str, request: str) -> IndexEntry:
+        path = os.path.join(collection, "requests", request)
+        signature = (
+            stat_signature(os.path.join(path, "meta.json")),
+            stat_signature(os.path.join(path, "payload.data")),
+        )
+        entry = self.requests.get((collection, request))
+        if entry is None or entry.signature != signature:
+            entry = self.requests[(collection, request)] = IndexEntry(signature, load_request(collection, request))
+        return entry
+
+    def invalidate(self, collection: str, request: str | None = None):
+        self.collections.pop(collection, None)
+        if request is not None:
+            self.requests.pop((collection, request), None)
+
+
+INDEX = Index()
+
+
+def read_collection(collection: str | None) -> dict:
+    if collection is None:
+        return {
+            "name": "",
+            "collection": "",
+            "variables": [],
+            "client": {},
+            "body": {},
+            "environments": {},
+            "diff": {},
+            "rate_limit": {},
+            "retry": {},
+            "cache": {},
+            "requests": []
+        }
+    return INDEX.collection(collection)
+
+
+def load_collection(collection: str) -> dict:
+    requests = []
+    path = os.path.join(collection, "requests")
+    if os.path.isdir(path):
+        requests = [
+            {"name": r} for r in os.listdir(path) if os.path.isdir(os.path.join(path, r))
+        ]
+    meta = {}
+    try:
+        with open(os.path.join(collection, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        pass
+
+    return {
+        "name": os.path.basename(collection),
+        "collection": collection,
+        "variables": meta.get("variables", []),
+        "client": meta.get("client", {}),
+        "body": meta.get("body", {}),
+        "environments": meta.get("environments", {}),
+        "diff": meta.get("diff", {}),
+        "rate_limit": meta.get("rate_limit", {}),
+        "retry": meta.get("retry", {}),
+        "cache": meta.get("cache", {}),
+        "requests": requests
+    }
+
+
+def read_request(collection: str, request: str | None) -> dict:
+    if request is None:
+        return {
+            "collection": collection,
+            "request": "",
+            "method": "",
+            "url": "",
+            "headers": [],
+            "payload": "",
+            "payload_file": None,
+            "payload_size": 0,
+            "payload_inline": True,
+            "after": [],
+            "extract": [],
+            "assert": [],
+        }
+    return INDEX.request(collection, request)
+
+
+def load_request(collection: str, request: str) -> dict:
+    path = os.path.join(collection, "requests", request)
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        meta = json.load(f)
+
+    # Payloads that are large or not UTF-8 text are only read when sent.
+    payload = ""
+    payload_file = os.path.join(path, "payload.data")
+    payload_size = 0
+    payload_inline = True
+    if os.path.isfile(payload_file):
+        payload_size = os.path.getsize(payload_file)
+        if payload_size > PAYLOAD_STREAM_THRESHOLD:
+            payload_inline = False
+        else:
+            with open(payload_file, "rb") as f:
+                data = f.read()
+            try:
+                payload = data.decode("utf-8")
+            except UnicodeDecodeError:
+                payload_inline = False
+    else:
+        payload_file = None
+
+    return {
+        "collection": collection,
+        "request": request,
+        "method": meta.get("method", ""),
+        "url": meta.get("url", ""),
+        "headers": meta.get("headers", []),
+        "payload": payload,
+        "payload_file": payload_file,
+        "payload_size": payload_size,
+        "payload_inline": payload_inline,
+        "after": meta.get("after", []),
+        "extract": meta.get("extract", []),
+        "assert": meta.get("assert", []),
+    }
+
+
+def build_collection(collection: str, requests: list[str] | None = None, concurrency: int = 1,
+                     environment: str | None = None) -> 'Collection':
+    # The executor (and httpx with it) is only imported once something is built to run.
+    from cache import CacheOptions
+    from executor import Collection, ClientOptions, BodyOptions, RateLimitOptions, RetryOptions
+    collection_read = read_collection(collection)
+    if requests is None:
+        requests = [r["name"] for r in collection_read["requests"]]
+    variables = {v["name"]: v["value"] for v in collection_read["variables"] if v["enabled"]}
+    if environment:
+        if environment not in collection_read["environments"]:
+            raise Exception(f"environment not found: {environment}")
+        variables.update(collection_read["environments"][environment])
+    return Collection(
+        variables=variables,
+        requests=[INDEX.built(collection, r) for r in requests],
+        concurrency=concurrency,
+        name=collection,
+        options=ClientOptions(**collection_read["client"]),
+        body_options=BodyOptions(**collection_read["body"]),
+        rate_limit=RateLimitOptions(**collection_read["rate_limit"]),
+        retry=RetryOptions(**collection_read["retry"]),
+        cache=CacheOptions(**collection_read["cache"]),
+        environment=environment,
+    )
+
+
+def build_request(request_read: dict) -> 'Request':
+    from executor import Request
+    return Request(
+        name=request_read["request"],
+        method=request_read["method"],
+        url=request_read["url"],
+        headers=[(h["name"], h["value"]) for h in request_read["headers"] if h["enabled"]],
+        payload=build_payload(request_read),
+        after=request_read["after"],
+        extractors=[parse_extractor(rule) for rule in request_read["extract"]],
+        assertions=[parse_assertion(rule) for rule in request_read["assert"]],
+    )
+
+
+def build_payload(request_read: dict) -> 'bytes | PayloadFile | None':
+    from executor import PayloadFile
+    if request_read["payload_file"] is None:
+        return None
+    if request_read["payload_size"] > PAYLOAD_STREAM_THRESHOLD:
+        return PayloadFile(request_read["payload_file"])
+    if request_read["payload_inline"]:
+        return request_read["payload"].encode("utf-8") or None
+    with open(request_read["payload_file"], "rb") as f:
+        return f.read()
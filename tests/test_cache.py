@@ -0,0 +1,65 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from cache import CacheOptions, ResponseCache
+
+URL = "http://example.com/me"
+HEADERS = [("Cache-Control", "max-age=60")]
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(CacheOptions(enabled=True))
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def store(self, headers: list[tuple[str, str]], body: bytes, file: str | None = None) -> bool:
+        preview = body if file is None else body[:4]
+        return asyncio.run(self.cache.store("GET", URL, headers, 200, HEADERS, preview, len(body), file))
+
+    def test_credentials_are_part_of_the_key(self):
+        alice = [("Authorization", "alice")]
+        self.assertTrue(self.store(alice, b"alice"))
+        self.assertIsNotNone(self.cache.get("GET", URL, alice))
+        self.assertIsNone(self.cache.get("GET", URL, [("Authorization", "bob")]))
+        self.assertIsNone(self.cache.get("GET", URL, []))
+
+    def test_invalidate_drops_every_credential(self):
+        for user in ("alice", "bob"):
+            self.store([("Cookie", user)], user.encode())
+        self.cache.invalidate(URL)
+        self.assertEqual(0, len(self.cache.entries))
+        self.assertEqual(0, self.cache.total)
+
+    def test_spilled_bodies_are_shared_not_copied(self):
+        body = os.urandom(100_000)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(body)
+        self.assertTrue(self.store([], body, f.name))
+        entry = self.cache.get("GET", URL, [])
+        self.assertTrue(os.path.samefile(f.name, entry.file))
+        os.remove(f.name)
+
+        preview, file = asyncio.run(entry.read(4, True))
+        self.assertEqual(body[:4], preview)
+        self.assertTrue(os.path.samefile(entry.file, file))
+        self.cache.invalidate(URL)
+        with open(file, "rb") as f:
+            self.assertEqual(body, f.read())
+        os.remove(file)
+
+    def test_shrink_moves_bodies_to_files(self):
+        self.cache = ResponseCache(CacheOptions(enabled=True, memory_size=10))
+        for user in ("alice", "bob", "carol"):
+            self.store([("Cookie", user)], user.encode())
+        self.assertLessEqual(self.cache.memory, 10)
+        entry = self.cache.get("GET", URL, [("Cookie", "alice")])
+        self.assertIsNone(entry.body)
+        self.assertEqual((b"alice", None), asyncio.run(entry.read(1024, True)))
+
+
+if __name__ == "__main__":
+    unittest.main()
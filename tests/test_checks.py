@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from checks import Subject, evaluate, parse_assertion, parse_extractor
+from executor import Result
+
+CHUNK = 64 * 1024
+# Values placed across chunk boundaries, and one at the very end of the body.
+BODY = ("x" * (CHUNK - 3) + '"id": 12345, ' + "é" * CHUNK + "\nline start\n" + "y" * (2 * CHUNK) + "token=abc").encode()
+
+
+def result(payload: bytes, spilled: bool) -> Result:
+    r = Result("GET", "http://example.com", [], None, 200, [], payload[:1024] if spilled else payload,
+               response_size=len(payload), response_truncated=spilled)
+    if spilled:
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(payload)
+        r.response_file = f.name
+    return r
+
+
+class BodyRuleTest(unittest.TestCase):
+    def setUp(self):
+        self.memory = result(BODY, False)
+        self.spilled = result(BODY, True)
+
+    def tearDown(self):
+        os.remove(self.spilled.response_file)
+
+    def test_spilled_search_matches_in_memory(self):
+        for expression in (r'"id":\s*(\d+)', r"(?m)^line (\w+)$", r"^x", r"^line", r"\btoken=(\w+)$", r"é{3}\n",
+                           r"y{10}token", r"missing"):
+            with self.subTest(expression=expression):
+                extractor = parse_extractor(f"value = regex {expression}")
+                self.assertEqual(evaluate(self.memory, [extractor], []), evaluate(self.spilled, [extractor], []))
+
+    def test_spilled_contains_and_matches(self):
+        for rule, passed in (("body contains 12345,", True), ("body contains abc", True),
+                             ("body contains nothing", False), ("body matches é\\nline", True),
+                             ("body matches ^y", False)):
+            with self.subTest(rule=rule):
+                evaluate(self.spilled, [], [parse_assertion(rule)])
+                self.assertEqual(passed, self.spilled.assertions[0].passed)
+                self.assertEqual(200, len(self.spilled.assertions[0].actual) - 3)
+
+    def test_body_extractor_is_the_preview(self):
+        self.assertEqual("x" * 1024, Subject(self.spilled, []).body())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import json
+import unittest
+
+from diff import Differ, Ignore
+from jsonstream import JSONStream, select, lookup
+
+DOCUMENTS = [
+    '{"id": 7, "price": 1.5, "rate": -2.5e-3, "big": 12345678901234567890, "ok": true, "none": null}',
+    '{"name": "caf\\u00e9 \\"quoted\\" \\\\ slash", "text": "zürich ✓ 😀", "empty": "", "list": []}',
+    '[1, -0.25, 3e10, 4E+2, {"a": [true, false, null]}, [], {}, "x"]',
+    '{"items": [{"id": 1, "tags": ["a", "b"]}, {"id": 2, "tags": []}], "next": {"cursor": 10.75}}',
+    ' {\n\t"spaced" :\t[ 1 ,\n 2 ] ,\r\n "last" : -1 } ',
+    '12.5',
+    '"just a string"',
+]
+
+# Pairs that differ in scalars, types, missing keys and array lengths.
+PAIRS = [
+    ('{"a": 1.5, "b": [1, 2, 3], "c": {"d": "x"}}', '{"a": 1.25, "b": [1, 2], "c": {"d": "y", "e": 1}}'),
+    ('{"a": 1, "b": true, "c": [1, {"x": 1}]}', '{"b": 1, "a": 1.0, "c": [1, {"x": 2}, 3]}'),
+    ('{"a": {"b": [1, 2]}, "z": 10e2}', '{"a": [1, 2], "z": 1000.5}'),
+    ('[{"id": 1, "v": -1.5e-2}, {"id": 2}]', '[{"id": 1, "v": -1.5e-3}, {"id": 3}, null]'),
+]
+
+
+def chunked(document: str, size: int):
+    data = document.encode("utf-8")
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def paths(value, path: tuple = ()) -> list[tuple]:
+    found = [path] if path else []
+    if isinstance(value, dict):
+        for key, nested in value.items():
+            found += paths(nested, path + (key,))
+    elif isinstance(value, list):
+        for index, nested in enumerate(value):
+            found += paths(nested, path + (index,))
+    return found
+
+
+def changes(differ: Differ) -> list[tuple]:
+    return sorted((c.path, c.kind, repr(c.left), repr(c.right)) for c in differ.changes)
+
+
+class JSONStreamTest(unittest.TestCase):
+    def test_value_in_small_chunks(self):
+        for document in DOCUMENTS:
+            for size in range(1, 8):
+                with self.subTest(document=document, size=size):
+                    stream = JSONStream(chunked(document, size), threshold=4)
+                    self.assertEqual(json.loads(document), stream.value())
+                    stream.end()
+
+    def test_skip_in_small_chunks(self):
+        for document in DOCUMENTS:
+            for size in range(1, 8):
+                with self.subTest(document=document, size=size):
+                    stream = JSONStream(chunked(document, size), threshold=4)
+                    stream.skip()
+                    stream.end()
+
+    def test_select_in_small_chunks(self):
+        for document in DOCUMENTS:
+            expected = json.loads(document)
+            wanted = paths(expected) + [("missing",), (99,)]
+            for size in range(1, 8):
+                for threshold in (4, 1024):
+                    with self.subTest(document=document, size=size, threshold=threshold):
+                        selected = select(JSONStream(chunked(document, size), threshold=threshold), wanted)
+                        for path in wanted:
+                            found, value = lookup(expected, path)
+                            if found:
+                                self.assertEqual(value, selected[path])
+                            else:
+                                self.assertNotIn(path, selected)
+
+
+class DifferStreamTest(unittest.TestCase):
+    def test_number_cut_at_chunk_end(self):
+        # The object is streamed member by member, and the chunk ends right after "1." of a measured value.
+        differ = Differ(Ignore([]))
+        left = JSONStream(iter([b'{"p": 1.', b'5, "q": 1}']), threshold=4)
+        right = JSONStream(iter([b'{"p": 1.', b'5, "q": 2}']), threshold=4)
+        differ.stream(left, right, ("body",))
+        left.end()
+        right.end()
+        self.assertEqual([("body.q", "changed", "1", "2")], changes(differ))
+
+    def test_stream_matches_in_memory_diff(self):
+        for left, right in PAIRS + [(d, d) for d in DOCUMENTS]:
+            expected = Differ(Ignore([]))
+            expected.value(("body",), json.loads(left), json.loads(right))
+            for size in range(1, 8):
+                for threshold in (4, 1024):
+                    with self.subTest(left=left, right=right, size=size, threshold=threshold):
+                        differ = Differ(Ignore([]))
+                        left_stream = JSONStream(chunked(left, size), threshold=threshold)
+                        right_stream = JSONStream(chunked(right, size), threshold=threshold)
+                        differ.stream(left_stream, right_stream, ("body",))
+                        left_stream.end()
+                        right_stream.end()
+                        self.assertEqual(changes(expected), changes(differ))
+                        self.assertEqual(expected.count, differ.count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from executor import Collection, PayloadFile, Template
+
+# The start of a PNG file, with a placeholder whose name is not UTF-8.
+BINARY = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR{{\xff}}\x00\x01{{name}}\xfe\xff"
+
+
+class TemplateTest(unittest.TestCase):
+    def test_binary_names_that_are_not_utf8_are_kept(self):
+        rendered = Template(BINARY).render({"name": "value"})
+        self.assertEqual(BINARY.replace(b"{{name}}", b"value"), rendered)
+
+    def test_binary_collection_resolve(self):
+        collection = Collection({"name": "value"}, [])
+        self.assertEqual(BINARY.replace(b"{{name}}", b"value"), collection.resolve(BINARY))
+
+    def test_binary_payload_file(self):
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
+            f.write(BINARY * 3)
+        try:
+            async def read() -> bytes:
+                return b"".join([chunk async for chunk in PayloadFile(f.name, chunk_size=16).render({"name": "v"})])
+
+            self.assertEqual((BINARY * 3).replace(b"{{name}}", b"v"), asyncio.run(read()))
+        finally:
+            os.remove(f.name)
+
+    def test_payload_file_is_scanned_on_first_send(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b"x" * 100 + b"{{name}}")
+        try:
+            payload = PayloadFile(f.name)
+            self.assertIsNone(payload.templated)
+            self.assertTrue(asyncio.run(payload.scan()))
+        finally:
+            os.remove(f.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import unittest
+import zlib
+
+from server.ws import ws_encode_frame, ws_frame_header, ws_read_frame, ws_unmask, WebSocket, WebSocketError, \
+    CLOSE_PROTOCOL_ERROR, CLOSE_TOO_BIG, DEFLATE_TAIL, OP_CLOSE, OP_CONTINUATION, OP_PING, OP_PONG, OP_TEXT
+
+
+def client_frame(data: bytes, opcode: int = OP_TEXT, fin: bool = True, rsv1: bool = False) -> bytes:
+    # Clients mask every frame (RFC 6455, section 5.3).
+    header = ws_frame_header(len(data), opcode, fin, rsv1)
+    mask_key = os.urandom(4)
+    return bytes([header[0], header[1] | 0x80]) + header[2:] + mask_key + ws_unmask(data, mask_key)
+
+
+class Writer:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def frames(self) -> list[tuple[bool, int, bool, bytes]]:
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(bytes(self.data))
+            reader.feed_eof()
+            frames = []
+            while (frame := await ws_read_frame(reader)) is not None:
+                frames.append(frame)
+            return frames
+
+        return asyncio.run(read())
+
+
+def receive(data: bytes, eof: bool = True, **options) -> tuple[str | bytes | None, Writer]:
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        if eof:
+            reader.feed_eof()
+        writer = Writer()
+        socket = WebSocket(reader, writer, **options)
+        return await asyncio.wait_for(socket.receive(), 5), writer
+
+    return asyncio.run(run())
+
+
+class FrameTest(unittest.TestCase):
+    def test_lengths(self):
+        # 7-bit, 16-bit and 64-bit length forms, on both sides of each boundary.
+        for size, header_size in ((0, 2), (125, 2), (126, 4), (65535, 4), (65536, 10), (70000, 10)):
+            with self.subTest(size=size):
+                data = os.urandom(size)
+                frame = ws_encode_frame(data)
+                self.assertEqual(header_size, len(frame) - size)
+
+                async def read():
+                    reader = asyncio.StreamReader()
+                    reader.feed_data(frame)
+                    return await ws_read_frame(reader)
+
+                self.assertEqual((True, 2, False, data), asyncio.run(read()))
+
+                message, _ = receive(client_frame(data, opcode=2))
+                self.assertEqual(data, message)
+
+    def test_fragments_with_interleaved_ping(self):
+        data = client_frame(b"hello ", fin=False) + client_frame(b"ping", opcode=OP_PING) \
+            + client_frame(b"world", opcode=OP_CONTINUATION)
+        message, writer = receive(data)
+        self.assertEqual("hello world", message)
+        self.assertEqual([(True, OP_PONG, False, b"ping")], writer.frames())
+
+    def test_deflate_round_trip(self):
+        text = '{"type": "request-result", "data": "' + "x" * 4096 + '"}'
+
+        compressor = zlib.compressobj(zlib.Z_BEST_SPEED, zlib.DEFLATED, -15)
+        payload = compressor.compress(text.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        message, _ = receive(client_frame(payload[:-len(DEFLATE_TAIL)], rsv1=True), deflate={})
+        self.assertEqual(text, message)
+
+        async def send():
+            writer = Writer()
+            await WebSocket(asyncio.StreamReader(), writer, deflate={}, fragment_size=512).send(text)
+            return writer
+
+        frames = asyncio.run(send()).frames()
+        self.assertTrue(frames[0][2])
+        self.assertTrue(all(frame[1] == OP_CONTINUATION for frame in frames[1:]))
+        compressed = b"".join(frame[3] for frame in frames)
+        self.assertLess(len(compressed), len(text))
+        self.assertEqual(text, zlib.decompressobj(-15).decompress(compressed + DEFLATE_TAIL).decode())
+
+    def test_oversize_frame_is_closed_before_its_payload(self):
+        # Only the header is sent and the stream stays open, so reading the payload would never finish.
+        header = ws_frame_header(2 ** 40, OP_TEXT)
+        message, writer = receive(bytes([header[0], header[1] | 0x80]) + header[2:] + os.urandom(4), eof=False,
+                                  max_message_size=1024)
+        self.assertIsNone(message)
+        self.assertEqual([(True, OP_CLOSE, False, CLOSE_TOO_BIG.to_bytes(2, "big"))], writer.frames())
+
+    def test_oversize_message_across_fragments(self):
+        data = client_frame(b"x" * 600, fin=False) + client_frame(b"x" * 600, opcode=OP_CONTINUATION)
+        message, writer = receive(data, max_message_size=1024)
+        self.assertIsNone(message)
+        self.assertEqual(CLOSE_TOO_BIG.to_bytes(2, "big"), writer.frames()[0][3])
+
+    def test_unmasked_client_frame(self):
+        message, writer = receive(ws_encode_frame("hello"))
+        self.assertIsNone(message)
+        self.assertEqual([(True, OP_CLOSE, False, CLOSE_PROTOCOL_ERROR.to_bytes(2, "big"))], writer.frames())
+
+    def test_oversize_control_frame(self):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(client_frame(b"x" * 126, opcode=OP_PING))
+            return await ws_read_frame(reader, masked=True)
+
+        with self.assertRaises(WebSocketError) as raised:
+            asyncio.run(read())
+        self.assertEqual(CLOSE_PROTOCOL_ERROR, raised.exception.code)
+
+
+if __name__ == "__main__":
+    unittest.main()
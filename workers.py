@@ -0,0 +1,128 @@
+import asyncio
+import multiprocessing
+import queue
+from collections.abc import Awaitable, Callable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from executor import Request
+
+# Records travel from the workers through a bounded queue: a worker blocks once
+# the parent falls this far behind, so slow consumers do not buffer a whole run.
+QUEUE_SIZE = 256
+DRAIN_SIZE = 64
+
+
+def shard(requests: list['Request'], jobs: int) -> list[list[str]]:
+    # Requests chained through "after" must run in the same process, so shards are built from connected groups.
+    parent = {request.name: request.name for request in requests}
+
+    def find(name: str) -> str:
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for request in requests:
+        for name in request.after:
+            if name in parent:
+                parent[find(name)] = find(request.name)
+
+    groups: dict[str, list[str]] = {}
+    for request in requests:
+        groups.setdefault(find(request.name), []).append(request.name)
+
+    shards: list[list[str]] = [[] for _ in range(min(jobs, len(groups)) or 1)]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(shards, key=len).extend(group)
+    return shards
+
+
+def run(job: Callable[..., Awaitable], shards: list[tuple], emit: Callable[[dict], None]) -> bool:
+    # Runs job(*args, emit) once per shard, in worker processes when there is more than one.
+    if len(shards) == 1:
+        asyncio.run(job(*shards[0], emit))
+        return True
+
+    records = multiprocessing.Queue(QUEUE_SIZE)
+    workers = start(multiprocessing, job, shards, records)
+    running = len(workers)
+    try:
+        while running:
+            try:
+                record = records.get(timeout=0.5)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            if record is None:
+                running -= 1
+            else:
+                emit(record)
+    finally:
+        stop(workers, running)
+    return all(worker.exitcode == 0 for worker in workers)
+
+
+async def run_async(job: Callable[..., Awaitable], shards: list[tuple], emit: Callable[[object], Awaitable]) -> bool:
+    # The same as run, for callers on an event loop: the queue is drained in a
+    # thread and each record is awaited, so a slow consumer pauses the workers.
+    # Workers are spawned, as forking a process that runs threads is not safe.
+    context = multiprocessing.get_context("spawn")
+    records = context.Queue(QUEUE_SIZE)
+    workers = start(context, job, shards, records)
+    running = len(workers)
+    try:
+        while running:
+            batch = await asyncio.to_thread(drain, records)
+            if not batch and not any(worker.is_alive() for worker in workers):
+                break
+            for record in batch:
+                if record is None:
+                    running -= 1
+                else:
+                    await emit(record)
+    finally:
+        await asyncio.to_thread(stop, workers, running)
+    return all(worker.exitcode == 0 for worker in workers)
+
+
+def drain(records: multiprocessing.Queue) -> list:
+    try:
+        batch = [records.get(timeout=0.5)]
+    except queue.Empty:
+        return []
+    while len(batch) < DRAIN_SIZE:
+        try:
+            batch.append(records.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def start(context, job: Callable[..., Awaitable], shards: list[tuple],
+          records: multiprocessing.Queue) -> list[multiprocessing.Process]:
+    workers = [
+        context.Process(target=shard_worker, args=(job, args, records), name=f"shard-{i}", daemon=True)
+        for i, args in enumerate(shards)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def stop(workers: list[multiprocessing.Process], running: int):
+    # Workers that sent their sentinel are only flushing the queue on exit; the rest were interrupted or crashed.
+    for worker in workers:
+        if running and worker.is_alive():
+            worker.terminate()
+        worker.join()
+
+
+def shard_worker(job: Callable[..., Awaitable], args: tuple, records: multiprocessing.Queue):
+    try:
+        asyncio.run(job(*args, records.put))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        records.put(None)